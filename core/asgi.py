@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
 
 application = get_asgi_application()
+
+# Load the recommender models in the background when NANCY_WARM_UP_ON_START is set
+from nancy.registry import warm_up_on_start  # noqa: E402
+
+warm_up_on_start()
@@ -34,7 +34,17 @@ env = environ.Env(
     EMAIL_HOST_USER=(str, ''),
     EMAIL_HOST_PASSWORD=(str, ''),
     EMAIL_USE_TLS=(bool, False),
-    EMAIL_USE_SSL=(bool, True)
+    EMAIL_USE_SSL=(bool, True),
+    NANCY_WARM_UP_ON_START=(bool, False),
+    NANCY_QUERY_CACHE_TIMEOUT=(int, 600),
+    NANCY_QUERY_CACHE_MAX_ENTRIES=(int, 10000),
+    NANCY_REQUEST_LOG_BUFFERED=(bool, True),
+    NANCY_LATENT_DIMS=(int, 0),
+    NANCY_RANKING_INDEX=(str, 'tfidf'),
+    NANCY_ANN_LISTS=(int, 0),
+    NANCY_ANN_PROBES=(int, 16),
+    NANCY_QUANTIZE=(str, 'none'),
+    NANCY_QUANTIZE_MIN_OVERLAP=(float, 0.95),
 )
 environ.Env.read_env()
 
@@ -726,11 +736,40 @@ CORS_ALLOW_METHODS = [
     "PUT",
 ]
 TMDB_API_KEY = env('TMDB_API_KEY')
+
+# Nancy recommender settings
+# Load the SpaCy pipeline and model artifacts when a server process starts instead of on the first request
+NANCY_WARM_UP_ON_START = env('NANCY_WARM_UP_ON_START')
+# Seconds between two checks for newly published model artifacts (swapped in without a restart)
+NANCY_MODELS_CHECK_INTERVAL = 5
+# Cache holding parsed queries, see nancy.query_cache
+NANCY_QUERY_CACHE_ALIAS = 'nancy-queries'
+# Log recommendation requests from a background thread in batches instead of one INSERT per request
+NANCY_REQUEST_LOG_BUFFERED = env('NANCY_REQUEST_LOG_BUFFERED')
+# Dimensions of the latent (TruncatedSVD) index built by regenerate_models, 0 to skip it
+NANCY_LATENT_DIMS = env('NANCY_LATENT_DIMS')
+# Vector space used to rank movies: 'tfidf' (sparse term postings) or 'latent'
+NANCY_RANKING_INDEX = env('NANCY_RANKING_INDEX')
+# IVF lists of the approximate neighbor index over the latent vectors (0: sqrt of the number of movies)
+NANCY_ANN_LISTS = env('NANCY_ANN_LISTS')
+# IVF lists scanned per latent query: more is slower with better recall, 0 scores every movie exactly
+NANCY_ANN_PROBES = env('NANCY_ANN_PROBES')
+# Precision of the stored neighbor scores and latent vectors: 'none' (float32), 'float16' or 'int8' (scaled per row)
+NANCY_QUANTIZE = env('NANCY_QUANTIZE')
+# Smallest top-10 overlap with full precision accepted for quantized latent vectors
+NANCY_QUANTIZE_MIN_OVERLAP = env('NANCY_QUANTIZE_MIN_OVERLAP')
 # core/settings.py
 
 CACHES = {
     'default': {
         'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
         'LOCATION': 'unique-snowflake',
-    }
+    },
+    # Parsed queries: a bounded LRU whose entries expire after TIMEOUT seconds
+    'nancy-queries': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'nancy-queries',
+        'TIMEOUT': env('NANCY_QUERY_CACHE_TIMEOUT'),
+        'OPTIONS': {'MAX_ENTRIES': env('NANCY_QUERY_CACHE_MAX_ENTRIES')},
+    },
 }
@@ -0,0 +1,142 @@
+# nancy/ann.py
+"""
+Inverted-file (IVF) approximate nearest neighbor index over the latent movie vectors.
+
+Movies are clustered with spherical k-means and stored list by list, the same
+offsets + postings layout as the inverted indexes. A query is compared with the
+centroids only, the movies of the `probes` closest lists are the candidates, and
+those are re-ranked exactly. More probes means better recall and slower queries;
+probing every list is exact search.
+"""
+import time
+
+import numpy as np
+
+from .ranking import top_k
+
+DEFAULT_PROBES = 16
+DEFAULT_ITERATIONS = 10
+# Rows per list sampled to train the centroids
+TRAINING_ROWS_PER_LIST = 64
+# Rows assigned to their centroid at once, bounds the (rows, lists) score block
+ASSIGN_BLOCK_SIZE = 8192
+
+
+def default_n_lists(n_rows):
+    # The usual sqrt(N) rule of thumb balances centroid and list scans
+    return max(1, int(np.sqrt(n_rows)))
+
+
+def _assign(vectors, centroids):
+    assignments = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), ASSIGN_BLOCK_SIZE):
+        block = vectors[start:start + ASSIGN_BLOCK_SIZE]
+        assignments[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return assignments
+
+
+def _lists(assignments, n_lists):
+    # Rows grouped by list (stable, so each list stays sorted) and the list offsets
+    rows = np.argsort(assignments, kind='stable').astype(np.int32)
+    offsets = np.zeros(n_lists + 1, dtype=np.int64)
+    np.cumsum(np.bincount(assignments, minlength=n_lists), out=offsets[1:])
+    return offsets, rows
+
+
+class IVFIndex:
+    """
+    Centroids (L, d) float32, and the movie rows of every list: rows[offsets[i]:offsets[i + 1]].
+    """
+
+    def __init__(self, centroids, offsets, rows):
+        self.centroids = centroids
+        self.offsets = offsets
+        self.rows = rows
+
+    def __len__(self):
+        return len(self.centroids)
+
+    @classmethod
+    def build(cls, vectors, n_lists=None, iterations=DEFAULT_ITERATIONS, seed=0):
+        """
+        Cluster L2-normalized `vectors` with spherical k-means, trained on a sample
+        of the rows, then assign every row to its closest centroid.
+        """
+        rng = np.random.default_rng(seed)
+        n_lists = max(1, min(n_lists or default_n_lists(len(vectors)), len(vectors)))
+        sample_size = min(len(vectors), n_lists * TRAINING_ROWS_PER_LIST)
+        sample = np.asarray(vectors[np.sort(rng.choice(len(vectors), sample_size, replace=False))])
+        centroids = sample[rng.choice(sample_size, n_lists, replace=False)].copy()
+
+        for _ in range(iterations):
+            assignments = _assign(sample, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignments, sample)
+            norms = np.linalg.norm(sums, axis=1)
+            # Restart empty lists from a random training row
+            empty = norms == 0
+            sums[empty] = sample[rng.choice(sample_size, int(empty.sum()))]
+            norms[empty] = np.linalg.norm(sums[empty], axis=1)
+            centroids = (sums / np.maximum(norms, 1e-12)[:, None]).astype(np.float32)
+
+        offsets, rows = _lists(_assign(vectors, centroids), n_lists)
+        return cls(centroids, offsets, rows)
+
+    def updated(self, vectors, changed):
+        """
+        Index over `vectors`, whose first rows are the ones indexed here: only the
+        `changed` rows (including every new one) are assigned to a centroid again,
+        the centroids and the other rows' lists are kept.
+        """
+        assignments = np.empty(len(vectors), dtype=np.int32)
+        assignments[self.rows] = np.repeat(np.arange(len(self), dtype=np.int32), np.diff(self.offsets))
+        changed = np.asarray(changed, dtype=np.intp)
+        if len(changed):
+            assignments[changed] = _assign(vectors[changed], self.centroids)
+        offsets, rows = _lists(assignments, len(self))
+        return IVFIndex(self.centroids, offsets, rows)
+
+    def candidates(self, vector, probes=DEFAULT_PROBES):
+        """
+        Rows of the `probes` lists whose centroids are closest to `vector`.
+        """
+        lists, _ = top_k(self.centroids @ vector, probes)
+        return np.concatenate([self.rows[self.offsets[i]:self.offsets[i + 1]] for i in lists])
+
+    def search(self, latent, vector, k, probes=DEFAULT_PROBES, exclude=None):
+        """
+        Approximate top-k movies of a LatentIndex for a normalized `vector`: the
+        candidates are scored exactly and ranked. Returns (rows, scores), best first.
+        """
+        rows = self.candidates(vector, probes)
+        if exclude is not None:
+            rows = rows[~np.isin(rows, exclude)]
+        positions, scores = top_k(latent.score(vector, rows), k)
+        return rows[positions], scores
+
+
+def evaluate(ivf, latent, queries, k=10, probes_options=(1, 2, 4, 8, 16, 32)):
+    """
+    Compare IVF search with exact search for the `queries` (movie rows of the
+    LatentIndex, left out of their own results). Returns one dict per setting
+    with the mean recall@k and the mean latency in milliseconds; probes is None
+    for exact search.
+    """
+    def timed(search):
+        start = time.perf_counter()
+        results = [search(query) for query in queries]
+        return results, (time.perf_counter() - start) * 1000 / len(queries)
+
+    vectors = {row: latent.vector_rows([row])[0] for row in queries}
+    exact, exact_ms = timed(lambda row: top_k(latent.score(vectors[row]), k, exclude=[row])[0])
+    report = [{'probes': None, 'recall': 1.0, 'ms': exact_ms}]
+    for probes in probes_options:
+        if probes > len(ivf):
+            break
+        approximate, ms = timed(lambda row: ivf.search(latent, vectors[row], k, probes, exclude=[row])[0])
+        recall = np.mean([
+            len(np.intersect1d(found, expected)) / max(len(expected), 1)
+            for found, expected in zip(approximate, exact)
+        ])
+        report.append({'probes': probes, 'recall': float(recall), 'ms': ms})
+    return report
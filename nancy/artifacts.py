@@ -0,0 +1,627 @@
+# nancy/artifacts.py
+"""
+Pickle-free storage for the recommender's model artifacts.
+
+Every artifact is a plain ``.npy`` array (or a string table made of a UTF-8 byte
+array plus an offsets array) that is opened with ``mmap_mode='r'``. Loading is
+therefore close to free and all worker processes share one copy of the data
+through the OS page cache instead of each unpickling a private copy.
+
+Each regeneration writes a new version directory under ``versions/`` and then
+switches the ``CURRENT`` pointer file to it with an atomic rename, so readers
+only ever see complete versions. Files already mapped by running workers stay
+valid until those workers swap to the new version.
+"""
+import hashlib
+import json
+import os
+import shutil
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from bisect import bisect_left
+
+import numpy as np
+from django.conf import settings
+from scipy import sparse
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+from .ann import DEFAULT_PROBES, IVFIndex
+from .inverted_index import EMPTY_POSTINGS, InvertedIndex
+from .latent import LatentIndex
+from .lexicon import normalize_string
+from .neighbors import NeighborIndex
+from .ranking import RANKING_LATENT, RANKING_TFIDF, get_ranking_index, top_k
+
+ARTIFACTS_DIRNAME = 'artifacts'
+MANIFEST_FILENAME = 'manifest.json'
+ARTIFACT_FORMAT = 1
+
+# Movie columns stored as string tables
+MOVIE_COLUMNS = ('title', 'normalized_title', 'genres', 'actors', 'directors')
+# Movie columns with an inverted index from each normalized value to movie rows
+INDEXED_COLUMNS = ('genres', 'actors', 'directors')
+# Movie columns whose content is summarized in the per-movie checksum
+CHECKSUM_COLUMNS = ('title', 'description', 'genres', 'actors', 'directors')
+
+
+# Layout of the artifacts directory: versions/<version>/... plus the CURRENT pointer
+VERSIONS_DIRNAME = 'versions'
+CURRENT_FILENAME = 'CURRENT'
+# Published versions kept on disk, besides the current one
+KEEP_VERSIONS = 3
+
+
+def get_artifacts_dir():
+    """
+    Root of the artifact store.
+    """
+    return os.path.join(settings.BASE_DIR, 'nancy', 'ml_models', ARTIFACTS_DIRNAME)
+
+
+def get_version_dir(version, root=None):
+    return os.path.join(root or get_artifacts_dir(), VERSIONS_DIRNAME, version)
+
+
+def current_version(root=None):
+    """
+    Name of the published version, or None when nothing was published.
+    """
+    try:
+        with open(os.path.join(root or get_artifacts_dir(), CURRENT_FILENAME), 'r', encoding='utf-8') as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def get_current_dir(root=None):
+    """
+    Directory of the published version. Stores written before versioning keep
+    their files directly in the root, which is returned for them.
+    """
+    root = root or get_artifacts_dir()
+    version = current_version(root)
+    return get_version_dir(version, root) if version else root
+
+
+def _save_array(directory, name, array):
+    np.save(os.path.join(directory, f'{name}.npy'), np.ascontiguousarray(array))
+
+
+def _load_array(directory, name, mmap=True):
+    return np.load(os.path.join(directory, f'{name}.npy'), mmap_mode='r' if mmap else None)
+
+
+def movie_checksum(values):
+    """
+    64-bit checksum of one movie's CHECKSUM_COLUMNS values, in that order.
+    """
+    text = '\x1f'.join(value if isinstance(value, str) else '' for value in values)
+    return int.from_bytes(hashlib.blake2b(text.encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+def movie_checksums(df_movies):
+    """
+    Checksum of every movie, used to tell which movies changed since the
+    artifacts were written.
+    """
+    columns = [df_movies[column].tolist() for column in CHECKSUM_COLUMNS]
+    return np.fromiter((movie_checksum(values) for values in zip(*columns)), dtype=np.uint64, count=len(df_movies))
+
+
+class StringTable:
+    """
+    Read-only sequence of strings stored as one UTF-8 byte array and an offsets array.
+    Strings are decoded on access, so opening a table does not touch its contents.
+    """
+
+    def __init__(self, data, offsets):
+        self.data = data
+        self.offsets = offsets
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError('string table index out of range')
+        return bytes(self.data[self.offsets[i]:self.offsets[i + 1]]).decode('utf-8')
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    @classmethod
+    def from_strings(cls, strings):
+        # Missing values (None/NaN) are stored as empty strings
+        encoded = [s.encode('utf-8') if isinstance(s, str) else b'' for s in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(s) for s in encoded], out=offsets[1:])
+        data = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+        return cls(data, offsets)
+
+    def save(self, directory, name):
+        _save_array(directory, f'{name}.data', self.data)
+        _save_array(directory, f'{name}.offsets', self.offsets)
+
+    @classmethod
+    def load(cls, directory, name, mmap=True):
+        return cls(_load_array(directory, f'{name}.data', mmap), _load_array(directory, f'{name}.offsets', mmap))
+
+
+class _SortedView:
+    """
+    Presents a StringTable in the order given by `order` so bisect can search it.
+    """
+
+    def __init__(self, table, order):
+        self.table = table
+        self.order = order
+
+    def __len__(self):
+        return len(self.order)
+
+    def __getitem__(self, i):
+        return self.table[int(self.order[i])]
+
+
+def _vectorizer_params(vectorizer):
+    params = vectorizer.get_params()
+    for name in ('preprocessor', 'tokenizer', 'analyzer', 'vocabulary'):
+        if callable(params.get(name)):
+            raise ValueError(f"Cannot store a TF-IDF vectorizer with a custom {name}.")
+    params.pop('vocabulary', None)
+    params['dtype'] = np.dtype(params['dtype']).name
+    params['stop_words'] = (
+        sorted(params['stop_words']) if isinstance(params['stop_words'], (set, frozenset, list)) else params['stop_words']
+    )
+    return params
+
+
+def _build_vectorizer(params, terms, idf):
+    params = dict(params)
+    params['dtype'] = np.dtype(params['dtype']).type
+    params['ngram_range'] = tuple(params['ngram_range'])
+    vectorizer = TfidfVectorizer(**params)
+    vectorizer.vocabulary_ = {term: i for i, term in enumerate(terms)}
+    vectorizer.idf_ = np.asarray(idf)
+    return vectorizer
+
+
+class ModelArtifacts:
+    """
+    Read-only, memory-mapped view of the artifacts written by write_artifacts().
+    """
+
+    def __init__(self, directory, manifest, movies, title_order, movie_ids, checksums, neighbors, inverted,
+                 vectorizer_parts, term_postings=None, latent=None, tfidf_rows=None, ranking_index=RANKING_TFIDF):
+        self.directory = directory
+        self.manifest = manifest
+        self.movies = movies
+        self.title_order = title_order
+        self.movie_ids = movie_ids
+        self.checksums = checksums
+        self.neighbors = neighbors
+        self.inverted = inverted
+        self.term_postings = term_postings
+        self.tfidf_rows = tfidf_rows
+        self.latent = latent
+        # Vector space used to rank movies, TF-IDF when the artifacts have no latent index
+        self.ranking_index = ranking_index if latent is not None else RANKING_TFIDF
+        self._vectorizer_parts = vectorizer_parts
+        self._vectorizer = None
+
+    def __len__(self):
+        return len(self.movies['title'])
+
+    @property
+    def version(self):
+        return self.manifest.get('version')
+
+    @property
+    def titles(self):
+        return self.movies['title']
+
+    def title_index(self, normalized_title):
+        """
+        Return the row of a normalized title, or None, with a binary search over the
+        sorted title order instead of a dictionary built at load time.
+        """
+        view = _SortedView(self.movies['normalized_title'], self.title_order)
+        position = bisect_left(view, normalized_title)
+        if position < len(view) and view[position] == normalized_title:
+            return int(self.title_order[position])
+        return None
+
+    def entity_set(self, field, value):
+        """
+        RowSet of the movies whose `field` ('genres', 'actors' or 'directors') includes
+        `value`, using the stored bitmaps of frequent values. Genres match on substrings
+        of the stored genre names.
+        """
+        index = self.inverted[field]
+        if field == 'genres':
+            return index.row_set_containing(normalize_string(value), len(self))
+        return index.row_set(normalize_string(value), len(self))
+
+    @property
+    def vectorizer(self):
+        """
+        The fitted TF-IDF vectorizer, rebuilt from its vocabulary and idf weights on first use.
+        """
+        if self._vectorizer is None:
+            params, terms, idf = self._vectorizer_parts
+            self._vectorizer = _build_vectorizer(params, terms, idf)
+        return self._vectorizer
+
+    @property
+    def ann_probes(self):
+        """
+        IVF lists probed per latent query, from the NANCY_ANN_PROBES setting (0 for exact search).
+        """
+        return getattr(settings, 'NANCY_ANN_PROBES', DEFAULT_PROBES)
+
+    @property
+    def has_vectors(self):
+        """
+        Whether movies can be scored against free text or other movies at all.
+        """
+        return self.term_postings is not None or self.ranking_index == RANKING_LATENT
+
+    def search(self, text, k):
+        """
+        Rank movies by the cosine similarity of their description to free text.
+
+        The query is vectorized with the fitted TF-IDF vectorizer and multiplied with
+        the term -> movie postings (the transposed TF-IDF matrix), so only the
+        postings of the query's terms are read. Returns (rows, scores), best first,
+        leaving out movies sharing no term with the query.
+        With the latent ranking index the query is projected and scored against
+        every movie with one dense matrix-vector product instead.
+        """
+        query_vector = self.vectorizer.transform([text])
+        if query_vector.nnz and self.ranking_index == RANKING_LATENT:
+            return self.latent.rank(self.latent.project(query_vector)[0], k, probes=self.ann_probes)
+        if self.term_postings is None:
+            return EMPTY_POSTINGS, np.empty(0, dtype=np.float64)
+        return self._rank(query_vector, k)
+
+    def similar_to_seeds(self, rows, k, weights=None, candidates=None):
+        """
+        Rank movies by their similarity to several seed movies at once.
+
+        The seeds' TF-IDF rows are gathered from the movie-major matrix (reading
+        only their own terms) and combined into one weighted sum (their centroid
+        when `weights` is None), then the catalog is scored against it with a
+        single pass over the postings of those terms, whatever the number of seeds.
+        Returns (rows, scores), best first, scores being cosine similarities to the
+        combined vector; the seeds themselves are left out. `candidates`, a RowSet,
+        restricts the ranking to the movies satisfying some constraints.
+        """
+        if not len(rows):
+            return EMPTY_POSTINGS, np.empty(0, dtype=np.float64)
+        rows = np.asarray(rows, dtype=np.intp)
+        if self.ranking_index == RANKING_LATENT:
+            seed_weights = np.full(len(rows), 1.0 / len(rows)) if weights is None else np.asarray(weights)
+            return self.latent.rank(
+                seed_weights @ self.latent.vector_rows(rows), k, exclude=rows, probes=self.ann_probes,
+                candidates=candidates.to_rows() if candidates is not None else None
+            )
+        if self.term_postings is None:
+            return EMPTY_POSTINGS, np.empty(0, dtype=np.float64)
+        seed_weights = np.full(len(rows), 1.0 / len(rows)) if weights is None else np.asarray(weights)
+        seed_weights = sparse.csr_matrix(seed_weights.astype(np.float32)[None, :])
+        if self.tfidf_rows is not None:
+            combined = seed_weights @ self.tfidf_rows[rows]
+        else:
+            # Artifacts written without the movie-major matrix: the seeds' columns
+            # of the postings, which reads every posting
+            combined = (self.term_postings[:, rows] @ seed_weights.T).T.tocsr()
+        norm = np.linalg.norm(combined.data)
+        if not norm:
+            return EMPTY_POSTINGS, np.empty(0, dtype=np.float64)
+        return self._rank(combined / norm, k, exclude=rows, candidates=candidates)
+
+    def _rank(self, query_vector, k, exclude=None, candidates=None):
+        # Only the postings of the query's terms are read, movies sharing no term
+        # with it get no score at all
+        scores = (query_vector @ self.term_postings).tocsr()
+        indices, data = scores.indices, scores.data
+        if exclude is not None:
+            kept = ~np.isin(indices, exclude)
+            indices, data = indices[kept], data[kept]
+        if candidates is not None:
+            kept = candidates.contains(indices)
+            indices, data = indices[kept], data[kept]
+        positions, top_scores = top_k(data, k)
+        return indices[positions], top_scores
+
+
+def write_artifacts(directory, df_movies, vectorizer, neighbor_index, build_info=None, tfidf_matrix=None,
+                    latent=None):
+    """
+    Write movie metadata, the TF-IDF vectorizer and the neighbor index as raw arrays.
+    `df_movies` needs the MOVIE_COLUMNS columns and, optionally, the database `id`
+    and either a precomputed `checksum` column or the `description` to compute it
+    (incremental regeneration relies on the checksums).
+    `build_info` is recorded as is in the manifest. The TF-IDF matrix of the movie
+    descriptions, when given, is stored both transposed (term postings, for
+    free-text search) and as is (movie rows, to look up seed movies), and so is
+    the optional LatentIndex.
+    """
+    os.makedirs(directory, exist_ok=True)
+
+    for column in MOVIE_COLUMNS:
+        StringTable.from_strings(df_movies[column].tolist()).save(directory, f'movies.{column}')
+    # Stable sort so duplicate normalized titles resolve to their first row
+    title_order = np.argsort(np.asarray(df_movies['normalized_title'].tolist(), dtype=object), kind='stable')
+    _save_array(directory, 'movies.title_order', title_order.astype(np.int32))
+    if 'id' in df_movies:
+        _save_array(directory, 'movies.id', df_movies['id'].to_numpy(dtype=np.int64))
+    has_checksums = 'checksum' in df_movies or 'description' in df_movies
+    if 'checksum' in df_movies:
+        _save_array(directory, 'movies.checksum', df_movies['checksum'].to_numpy(dtype=np.uint64))
+    elif 'description' in df_movies:
+        _save_array(directory, 'movies.checksum', movie_checksums(df_movies))
+
+    for column in INDEXED_COLUMNS:
+        index = InvertedIndex.build(df_movies[column].tolist())
+        StringTable.from_strings(index.keys).save(directory, f'index.{column}.keys')
+        _save_array(directory, f'index.{column}.offsets', index.offsets)
+        _save_array(directory, f'index.{column}.postings', index.postings)
+        bitmap_positions, bitmaps = index.dense_bitmaps(len(df_movies))
+        _save_array(directory, f'index.{column}.bitmap_positions', bitmap_positions)
+        _save_array(directory, f'index.{column}.bitmaps', bitmaps)
+
+    # Quantized scores and latent vectors are stored as given, full precision as float32
+    neighbor_scores = neighbor_index.scores
+    if neighbor_scores.dtype == np.float64:
+        neighbor_scores = neighbor_scores.astype(np.float32)
+    _save_array(directory, 'neighbors.ids', neighbor_index.ids.astype(np.int32))
+    _save_array(directory, 'neighbors.scores', neighbor_scores)
+    if neighbor_index.score_scales is not None:
+        _save_array(directory, 'neighbors.score_scales', neighbor_index.score_scales)
+
+    if tfidf_matrix is not None:
+        # One row per term listing the movies using it, i.e. CSR of the transposed matrix
+        postings = sparse.csr_matrix(tfidf_matrix, dtype=np.float32).T.tocsr()
+        postings.sort_indices()
+        _save_array(directory, 'tfidf.postings.data', postings.data)
+        _save_array(directory, 'tfidf.postings.indices', postings.indices.astype(np.int32))
+        _save_array(directory, 'tfidf.postings.indptr', postings.indptr.astype(np.int64))
+        # One row per movie listing its terms
+        rows = sparse.csr_matrix(tfidf_matrix, dtype=np.float32, copy=True)
+        rows.sort_indices()
+        _save_array(directory, 'tfidf.rows.data', rows.data)
+        _save_array(directory, 'tfidf.rows.indices', rows.indices.astype(np.int32))
+        _save_array(directory, 'tfidf.rows.indptr', rows.indptr.astype(np.int64))
+
+    latent_info = None
+    if latent is not None:
+        _save_array(directory, 'latent.vectors', latent.vectors)
+        _save_array(directory, 'latent.components', latent.components)
+        if latent.scales is not None:
+            _save_array(directory, 'latent.scales', latent.scales)
+        latent_info = {
+            'dims': latent.dims,
+            'explained_variance': latent.explained_variance,
+            'ivf_lists': None,
+            'dtype': latent.vectors.dtype.name,
+            'scaled': latent.scales is not None,
+        }
+        if latent.ivf is not None:
+            _save_array(directory, 'latent.ivf.centroids', latent.ivf.centroids)
+            _save_array(directory, 'latent.ivf.offsets', latent.ivf.offsets)
+            _save_array(directory, 'latent.ivf.rows', latent.ivf.rows)
+            latent_info['ivf_lists'] = len(latent.ivf)
+
+    terms = sorted(vectorizer.vocabulary_, key=vectorizer.vocabulary_.get)
+    StringTable.from_strings(terms).save(directory, 'tfidf.vocabulary')
+    _save_array(directory, 'tfidf.idf', vectorizer.idf_)
+
+    manifest = {
+        'format': ARTIFACT_FORMAT,
+        'created_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'movies': len(df_movies),
+        'neighbors': int(neighbor_index.k),
+        'neighbor_scores': {
+            'dtype': neighbor_scores.dtype.name, 'scaled': neighbor_index.score_scales is not None,
+        },
+        'has_movie_ids': 'id' in df_movies,
+        'has_checksums': has_checksums,
+        'has_tfidf_matrix': tfidf_matrix is not None,
+        'has_tfidf_rows': tfidf_matrix is not None,
+        'has_bitmaps': True,
+        'latent': latent_info,
+        'tfidf_params': _vectorizer_params(vectorizer),
+        'build': build_info or {'mode': 'full'},
+    }
+    # The manifest is written last, a directory without one is incomplete
+    with open(os.path.join(directory, MANIFEST_FILENAME), 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def load_artifacts(directory=None, mmap=True):
+    """
+    Open the artifacts in `directory` (the published version by default). Arrays
+    are memory-mapped read-only, so this only reads the manifest and the array
+    headers, and checks file sizes against the manifest.
+    """
+    ranking_index = get_ranking_index()
+    directory = directory or get_current_dir()
+    with open(os.path.join(directory, MANIFEST_FILENAME), 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    if manifest.get('format') != ARTIFACT_FORMAT:
+        raise ValueError(f"Unsupported artifact format: {manifest.get('format')}")
+    for name, expected in manifest.get('files', {}).items():
+        if os.path.getsize(os.path.join(directory, name)) != expected['size']:
+            raise ValueError(f"Artifact {name} does not match the manifest")
+
+    movies = {column: StringTable.load(directory, f'movies.{column}', mmap) for column in MOVIE_COLUMNS}
+    title_order = _load_array(directory, 'movies.title_order', mmap)
+    movie_ids = _load_array(directory, 'movies.id', mmap) if manifest.get('has_movie_ids') else None
+    checksums = _load_array(directory, 'movies.checksum', mmap) if manifest.get('has_checksums') else None
+    neighbors = NeighborIndex(
+        _load_array(directory, 'neighbors.ids', mmap),
+        _load_array(directory, 'neighbors.scores', mmap),
+        _load_array(directory, 'neighbors.score_scales', mmap)
+        if manifest.get('neighbor_scores', {}).get('scaled') else None,
+    )
+    inverted = {}
+    for column in INDEXED_COLUMNS:
+        inverted[column] = InvertedIndex(
+            StringTable.load(directory, f'index.{column}.keys', mmap),
+            _load_array(directory, f'index.{column}.offsets', mmap),
+            _load_array(directory, f'index.{column}.postings', mmap),
+        )
+        if manifest.get('has_bitmaps'):
+            inverted[column].bitmap_positions = _load_array(directory, f'index.{column}.bitmap_positions', mmap)
+            inverted[column].bitmaps = _load_array(directory, f'index.{column}.bitmaps', mmap)
+    vectorizer_parts = (
+        manifest['tfidf_params'],
+        StringTable.load(directory, 'tfidf.vocabulary', mmap),
+        _load_array(directory, 'tfidf.idf', mmap),
+    )
+    term_postings = None
+    if manifest.get('has_tfidf_matrix'):
+        term_postings = sparse.csr_matrix(
+            (
+                _load_array(directory, 'tfidf.postings.data', mmap),
+                _load_array(directory, 'tfidf.postings.indices', mmap),
+                _load_array(directory, 'tfidf.postings.indptr', mmap),
+            ),
+            shape=(len(vectorizer_parts[1]), len(movies['title'])),
+            copy=False,
+        )
+    tfidf_rows = None
+    if manifest.get('has_tfidf_rows'):
+        tfidf_rows = sparse.csr_matrix(
+            (
+                _load_array(directory, 'tfidf.rows.data', mmap),
+                _load_array(directory, 'tfidf.rows.indices', mmap),
+                _load_array(directory, 'tfidf.rows.indptr', mmap),
+            ),
+            shape=(len(movies['title']), len(vectorizer_parts[1])),
+            copy=False,
+        )
+    latent = None
+    if manifest.get('latent'):
+        ivf = None
+        if manifest['latent'].get('ivf_lists'):
+            ivf = IVFIndex(
+                _load_array(directory, 'latent.ivf.centroids', mmap),
+                _load_array(directory, 'latent.ivf.offsets', mmap),
+                _load_array(directory, 'latent.ivf.rows', mmap),
+            )
+        latent = LatentIndex(
+            _load_array(directory, 'latent.vectors', mmap),
+            _load_array(directory, 'latent.components', mmap),
+            manifest['latent']['explained_variance'],
+            ivf,
+            _load_array(directory, 'latent.scales', mmap) if manifest['latent'].get('scaled') else None,
+        )
+    return ModelArtifacts(
+        directory, manifest, movies, title_order, movie_ids, checksums, neighbors, inverted, vectorizer_parts,
+        term_postings, latent, tfidf_rows, ranking_index
+    )
+
+
+def _file_checksum(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _artifact_files(directory):
+    for dirpath, _, filenames in os.walk(directory):
+        for filename in filenames:
+            name = os.path.relpath(os.path.join(dirpath, filename), directory).replace(os.sep, '/')
+            if name != MANIFEST_FILENAME:
+                yield name
+
+
+@contextmanager
+def new_artifact_version(root=None):
+    """
+    Yield a staging directory to write a new version into. When the block
+    completes the version is published; when it raises, the staging directory
+    is removed and the current version stays untouched.
+    """
+    root = root or get_artifacts_dir()
+    version = datetime.now().strftime('%Y%m%dT%H%M%S%f')
+    staging = os.path.join(root, VERSIONS_DIRNAME, f'.{version}.tmp')
+    os.makedirs(staging)
+    try:
+        yield staging
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    publish_version(staging, version, root)
+
+
+def publish_version(staging, version, root=None):
+    """
+    Record the checksum of every file in the manifest, move the staging directory
+    to versions/<version> and atomically point CURRENT at it.
+    """
+    root = root or get_artifacts_dir()
+    manifest_path = os.path.join(staging, MANIFEST_FILENAME)
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        manifest = json.load(f)
+    manifest['version'] = version
+    manifest['files'] = {}
+    for name in sorted(_artifact_files(staging)):
+        path = os.path.join(staging, name)
+        manifest['files'][name] = {'size': os.path.getsize(path), 'sha256': _file_checksum(path)}
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+
+    os.rename(staging, get_version_dir(version, root))
+    pointer_tmp = os.path.join(root, f'{CURRENT_FILENAME}.tmp{os.getpid()}')
+    with open(pointer_tmp, 'w', encoding='utf-8') as f:
+        f.write(version)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(pointer_tmp, os.path.join(root, CURRENT_FILENAME))
+    prune_versions(root)
+    return version
+
+
+def prune_versions(root=None, keep=KEEP_VERSIONS):
+    """
+    Delete all but the `keep` newest published versions, never the current one.
+    Workers still mapping a deleted version keep working until they swap.
+    """
+    root = root or get_artifacts_dir()
+    current = current_version(root)
+    versions = sorted(
+        name for name in os.listdir(os.path.join(root, VERSIONS_DIRNAME)) if not name.startswith('.')
+    )
+    for name in versions[:-keep] if keep else versions:
+        if name != current:
+            shutil.rmtree(get_version_dir(name, root), ignore_errors=True)
+
+
+def verify_artifacts(directory=None):
+    """
+    Compare every file of a version with the checksums of its manifest.
+    Returns the list of problems found (empty when the version is intact).
+    """
+    directory = directory or get_current_dir()
+    with open(os.path.join(directory, MANIFEST_FILENAME), 'r', encoding='utf-8') as f:
+        files = json.load(f).get('files')
+    if files is None:
+        return ["The manifest has no checksums (written before versioned artifacts)."]
+    problems = []
+    for name, expected in files.items():
+        path = os.path.join(directory, name)
+        if not os.path.exists(path):
+            problems.append(f"{name} is missing")
+        elif _file_checksum(path) != expected['sha256']:
+            problems.append(f"{name} does not match its checksum")
+    return problems
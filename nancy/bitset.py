@@ -0,0 +1,141 @@
+# nancy/bitset.py
+"""
+Sets of movie rows for combining genre, actor and director constraints.
+
+As in roaring bitmaps, a set is held either as a sorted row array, when it is
+small (most actors and directors), or as a packed bitmap of N bits, when it is
+large (most genres). Intersections, unions and differences are vectorized numpy
+operations on whichever forms the operands have, so combining a few constraints
+costs microseconds: sparse sets are tested against bitmaps row by row, and two
+bitmaps are combined 8 rows per byte.
+"""
+import numpy as np
+
+# A set of more than N / DENSE_RATIO rows takes less room as a bitmap (1 bit per
+# movie) than as int32 rows (32 bits per member)
+DENSE_RATIO = 32
+
+_EMPTY_ROWS = np.empty(0, dtype=np.int32)
+
+
+def is_dense(count, n_rows):
+    return count * DENSE_RATIO > n_rows
+
+
+def rows_to_bits(rows, n_rows):
+    mask = np.zeros(n_rows, dtype=bool)
+    mask[rows] = True
+    return np.packbits(mask)
+
+
+class RowSet:
+    """
+    Immutable set of rows among `n_rows` movies, stored as sorted `rows` or as
+    packed `bits` (np.packbits order), never both.
+    """
+
+    __slots__ = ('n_rows', 'rows', 'bits')
+
+    def __init__(self, n_rows, rows=None, bits=None):
+        self.n_rows = n_rows
+        self.rows = rows
+        self.bits = bits
+
+    @classmethod
+    def from_rows(cls, rows, n_rows):
+        """
+        Set of the given sorted, duplicate-free rows, as a bitmap when that is smaller.
+        """
+        rows = np.asarray(rows, dtype=np.int32)
+        if is_dense(len(rows), n_rows):
+            return cls(n_rows, bits=rows_to_bits(rows, n_rows))
+        return cls(n_rows, rows=rows)
+
+    @classmethod
+    def empty(cls, n_rows):
+        return cls(n_rows, rows=_EMPTY_ROWS)
+
+    @property
+    def is_dense(self):
+        return self.bits is not None
+
+    def to_rows(self):
+        if self.bits is None:
+            return self.rows
+        return np.flatnonzero(np.unpackbits(self.bits, count=self.n_rows)).astype(np.int32)
+
+    def to_bits(self):
+        if self.bits is None:
+            return rows_to_bits(self.rows, self.n_rows)
+        return self.bits
+
+    def __len__(self):
+        if self.bits is None:
+            return len(self.rows)
+        return int(np.unpackbits(self.bits, count=self.n_rows).sum())
+
+    def __bool__(self):
+        return bool(len(self.rows)) if self.bits is None else bool(self.bits.any())
+
+    def contains(self, rows):
+        """
+        Boolean array telling which of the `rows` are in the set.
+        """
+        rows = np.asarray(rows, dtype=np.intp)
+        if self.bits is None:
+            return np.isin(rows, self.rows, assume_unique=True)
+        return ((self.bits[rows >> 3] >> (7 - (rows & 7))) & 1).astype(bool)
+
+    def __and__(self, other):
+        if self.bits is None:
+            if other.bits is None:
+                return RowSet(self.n_rows, rows=np.intersect1d(self.rows, other.rows, assume_unique=True))
+            return RowSet(self.n_rows, rows=self.rows[other.contains(self.rows)])
+        if other.bits is None:
+            return other & self
+        return RowSet(self.n_rows, bits=self.bits & other.bits)
+
+    def __or__(self, other):
+        if self.bits is None and other.bits is None:
+            return RowSet.from_rows(np.union1d(self.rows, other.rows), self.n_rows)
+        return RowSet(self.n_rows, bits=self.to_bits() | other.to_bits())
+
+    def __sub__(self, other):
+        if self.bits is None:
+            return RowSet(self.n_rows, rows=self.rows[~other.contains(self.rows)])
+        return RowSet(self.n_rows, bits=self.bits & ~other.to_bits())
+
+    def __invert__(self):
+        bits = ~self.to_bits()
+        # Clear the padding bits past the last movie
+        padding = len(bits) * 8 - self.n_rows
+        if padding:
+            bits[-1] &= np.uint8(0xFF << padding & 0xFF)
+        return RowSet(self.n_rows, bits=bits)
+
+
+def all_of(row_sets, n_rows):
+    """
+    Intersection of the sets, smallest first so sparse sets shrink the work early.
+    Every movie when there are none.
+    """
+    if not row_sets:
+        return ~RowSet.empty(n_rows)
+    # Bitmaps last, their size is not known without counting bits
+    ordered = sorted(row_sets, key=lambda row_set: len(row_set.rows) if row_set.bits is None else n_rows + 1)
+    result = ordered[0]
+    for row_set in ordered[1:]:
+        if not result:
+            break
+        result = result & row_set
+    return result
+
+
+def any_of(row_sets, n_rows):
+    """
+    Union of the sets, empty when there are none.
+    """
+    result = RowSet.empty(n_rows)
+    for row_set in row_sets:
+        result = result | row_set
+    return result
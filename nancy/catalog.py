@@ -0,0 +1,223 @@
+# nancy/catalog.py
+import threading
+import time
+from functools import cached_property
+
+import numpy as np
+import pandas as pd
+from django.db.models import Count, F, Max
+
+from .bitset import RowSet
+from .lexicon import EntityLexicon
+from .matching import EntityMatcher
+from .models import CatalogVersion, Movie
+from .trigram import TrigramIndex
+
+# Primary key of the CatalogVersion row. The counters live in the database, not in
+# Django's cache (a per-process LocMemCache), so a change made by any process (a
+# management command, another web worker) is seen by every worker.
+CATALOG_VERSION_ID = 1
+
+# Columns copied from the Movie table into the snapshot
+CATALOG_FIELDS = ('id', 'title', 'description', 'genres', 'actors', 'directors')
+# Rows fetched per round trip when streaming the Movie table
+DEFAULT_CHUNK_SIZE = 2000
+
+
+def stream_columns(queryset, fields, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Read `fields` of the rows of `queryset`, in id order, into one preallocated
+    array per field. Rows are streamed with iterator() so the ORM never holds the
+    whole result, and no list of row tuples is built.
+
+    Only rows up to the largest id at call time are read, so concurrent inserts
+    cannot overflow the buffers.
+    """
+    bounds = queryset.aggregate(count=Count('id'), max_id=Max('id'))
+    count = bounds['count']
+    columns = {field: np.empty(count, dtype=np.int64 if field == 'id' else object) for field in fields}
+    arrays = [columns[field] for field in fields]
+    rows = queryset.filter(id__lte=bounds['max_id'] or 0).order_by('id').values_list(*fields)
+
+    filled = 0
+    for values in rows.iterator(chunk_size=chunk_size):
+        if filled == count:
+            break
+        for array, value in zip(arrays, values):
+            array[filled] = value
+        filled += 1
+    # Rows deleted in the meantime leave the end of the buffers unused
+    return {field: array[:filled] for field, array in columns.items()}
+
+
+def stream_descriptions(ids, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Yield the description of every movie in `ids` (sorted), in that order, reading
+    them from the database in chunks. Movies deleted since `ids` was read yield ''.
+    """
+    if not len(ids):
+        return
+    rows = (
+        Movie.objects.filter(id__gte=ids[0], id__lte=ids[-1]).order_by('id')
+        .values_list('id', 'description').iterator(chunk_size=chunk_size)
+    )
+    position = 0
+    for movie_id, description in rows:
+        while position < len(ids) and ids[position] < movie_id:
+            yield ''
+            position += 1
+        if position < len(ids) and ids[position] == movie_id:
+            yield description or ''
+            position += 1
+    for _ in range(position, len(ids)):
+        yield ''
+
+
+def normalize_titles(titles):
+    """
+    Vectorized normalize_string over a Series of titles.
+    """
+    return titles.str.replace('-', '', regex=False).str.lower()
+
+
+def get_catalog_counters():
+    """
+    Return (version, generation) of the catalog, creating the counters if needed.
+    Snapshots can be extended in place while the generation is unchanged.
+    """
+    counters = CatalogVersion.objects.filter(pk=CATALOG_VERSION_ID).values_list('version', 'generation').first()
+    if counters is None:
+        # Seed the counters from the clock so a reset (e.g. a new database) never
+        # hands out a version an old snapshot or persisted lexicon was built with.
+        seed = int(time.time() * 1000)
+        row, _ = CatalogVersion.objects.get_or_create(
+            pk=CATALOG_VERSION_ID, defaults={'version': seed, 'generation': seed},
+        )
+        counters = row.version, row.generation
+    return counters
+
+
+def get_catalog_version():
+    """
+    Return the current catalog version, initializing the counters if needed.
+    """
+    return get_catalog_counters()[0]
+
+
+def bump_catalog_version(appended_only=False):
+    """
+    Mark the catalog as changed so snapshots are refreshed on next access.
+    Pass `appended_only=True` when movies were only added, which lets snapshots
+    load just the new rows instead of rebuilding.
+
+    Both counters move in one UPDATE, inside the caller's transaction if any.
+    """
+    updates = {'version': F('version') + 1}
+    if not appended_only:
+        updates['generation'] = F('generation') + 1
+    if not CatalogVersion.objects.filter(pk=CATALOG_VERSION_ID).update(**updates):
+        get_catalog_counters()
+        CatalogVersion.objects.filter(pk=CATALOG_VERSION_ID).update(**updates)
+
+
+class CatalogSnapshot:
+    """
+    Immutable, in-process view of the Movie table used to serve requests.
+    """
+
+    def __init__(self, version, generation, df_movies, lexicon, matcher):
+        self.version = version
+        self.generation = generation
+        self.df_movies = df_movies
+        self.lexicon = lexicon
+        self.matcher = matcher
+        self.titles = df_movies['title'].to_numpy()
+        self.max_id = int(df_movies['id'].max()) if len(df_movies) else 0
+        self.built_at = time.time()
+
+    def __len__(self):
+        return len(self.df_movies)
+
+    @cached_property
+    def title_trigrams(self):
+        """
+        Trigram index over the lexicon's normalized titles, built on first fuzzy
+        lookup and kept for as long as this catalog version is served.
+        """
+        return TrigramIndex(self.lexicon.titles)
+
+    def entity_rows(self, field, value):
+        """
+        Rows of the movies whose `field` contains `value`, scanning the snapshot.
+        Only used when the model artifacts (and their inverted index) are unavailable.
+        """
+        return np.flatnonzero(self.df_movies[field].str.contains(value, case=False, na=False, regex=False))
+
+    def entity_set(self, field, value):
+        return RowSet.from_rows(self.entity_rows(field, value), len(self.df_movies))
+
+    @staticmethod
+    def _load_movies(queryset):
+        df_movies = pd.DataFrame(stream_columns(queryset, CATALOG_FIELDS), columns=list(CATALOG_FIELDS), copy=False)
+        # Normalized titles are used for every title lookup, compute them once
+        df_movies['normalized_title'] = normalize_titles(df_movies['title'])
+        return df_movies
+
+    @classmethod
+    def build(cls, version, generation):
+        """
+        Load the Movie table into a DataFrame with its lexicon and entity matcher.
+        """
+        df_movies = cls._load_movies(Movie.objects.all())
+        lexicon = EntityLexicon.for_catalog(version, df_movies)
+        matcher = EntityMatcher.from_lexicon(lexicon)
+        return cls(version, generation, df_movies, lexicon, matcher)
+
+    def extend(self, version):
+        """
+        Return a new snapshot with the movies added since this one was built.
+        The lexicon is copied and only the matcher's small delta is rebuilt.
+        Falls back to a full rebuild when the table no longer lines up with the snapshot.
+        """
+        new_movies = self._load_movies(Movie.objects.filter(id__gt=self.max_id))
+        if Movie.objects.count() != len(self.df_movies) + len(new_movies):
+            # Rows disappeared without a signal (e.g. a rolled back transaction)
+            return CatalogSnapshot.build(version, self.generation)
+        lexicon = self.lexicon.copy(version)
+        new_entries = []
+        for title, actors, directors in zip(new_movies['title'], new_movies['actors'], new_movies['directors']):
+            new_entries.extend(lexicon.add_movie(title, actors, directors))
+
+        df_movies = pd.concat([self.df_movies, new_movies], ignore_index=True)
+        matcher = self.matcher.extended(lexicon, new_entries)
+        return CatalogSnapshot(version, self.generation, df_movies, lexicon, matcher)
+
+
+_snapshot = None
+_snapshot_lock = threading.Lock()
+
+
+def get_catalog():
+    """
+    Return the catalog snapshot for the current catalog version.
+
+    The snapshot is refreshed only when the version counter has moved since it was
+    built; otherwise the same object is shared by every request in the process.
+    When only movies were appended since, the snapshot is extended rather than rebuilt.
+    """
+    global _snapshot
+    # Read the counters before querying so a change made while the snapshot is
+    # being built is picked up by the next request instead of being masked.
+    version, generation = get_catalog_counters()
+    snapshot = _snapshot
+    if snapshot is not None and snapshot.version == version:
+        return snapshot
+
+    with _snapshot_lock:
+        # Another thread may have refreshed it while we were waiting
+        if _snapshot is None or _snapshot.version != version:
+            if _snapshot is not None and _snapshot.generation == generation:
+                _snapshot = _snapshot.extend(version)
+            else:
+                _snapshot = CatalogSnapshot.build(version, generation)
+        return _snapshot
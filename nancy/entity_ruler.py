@@ -0,0 +1,87 @@
+# nancy/entity_ruler.py
+"""
+Catalog-aware entity ruler for the SpaCy pipeline.
+
+The pretrained NER of ``en_core_web_sm`` misses many titles and lower-cased names,
+which sends parsing to the slower automaton and fuzzy fallbacks. The ruler knows
+every title, actor and director of the catalog, so SpaCy tags them in the same pass
+as the rest of the pipeline. The pipeline, ruler included, is written with
+``nlp.to_disk`` next to the model artifacts and loaded once by the registry.
+"""
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+RULER_NAME = 'catalog_ruler'
+CATALOG_PIPELINE_DIRNAME = 'nlp'
+
+# Lexicon kind -> (entity label, entity id) of the ruler patterns
+RULER_LABELS = {
+    'titles': ('MOVIE', 'title'),
+    'actors': ('PERSON', 'actor'),
+    'directors': ('PERSON', 'director'),
+}
+RULER_IDS = {ent_id for _, ent_id in RULER_LABELS.values()}
+
+
+def get_catalog_pipeline_dir(artifacts_dir=None):
+    if artifacts_dir is None:
+        from .artifacts import get_current_dir
+        artifacts_dir = get_current_dir()
+    return os.path.join(artifacts_dir, CATALOG_PIPELINE_DIRNAME)
+
+
+def ruler_patterns(lexicon, stop_words=()):
+    """
+    Yield EntityRuler phrase patterns for every entity of the lexicon. Both the
+    canonical spelling and the normalized one ("spiderman") are matched.
+    """
+    seen = set()
+    for kind, (label, ent_id) in RULER_LABELS.items():
+        for normalized, canonical in getattr(lexicon, kind).items():
+            for text in (canonical, normalized):
+                key = (label, ent_id, text.lower())
+                # Titles such as "Up" or "Her" would fire on ordinary words
+                if key in seen or text.lower() in stop_words:
+                    continue
+                seen.add(key)
+                yield {'label': label, 'pattern': text, 'id': ent_id}
+
+
+def add_catalog_ruler(nlp, lexicon):
+    """
+    Add (or replace) the catalog ruler of `nlp`, ahead of the statistical NER so
+    the NER keeps the catalog entities and only labels the rest of the text.
+    """
+    if RULER_NAME in nlp.pipe_names:
+        nlp.remove_pipe(RULER_NAME)
+    position = {'before': 'ner'} if 'ner' in nlp.pipe_names else {}
+    ruler = nlp.add_pipe(
+        'entity_ruler', name=RULER_NAME, config={'phrase_matcher_attr': 'LOWER'}, **position
+    )
+    ruler.add_patterns(list(ruler_patterns(lexicon, nlp.Defaults.stop_words)))
+    return ruler
+
+
+def save_catalog_pipeline(lexicon, directory=None, nlp=None):
+    """
+    Add the catalog ruler to `nlp` (by default a fresh copy of the pretrained
+    pipeline) and serialize the whole pipeline to `directory`.
+    """
+    if nlp is None:
+        import spacy
+        from .registry import SPACY_MODEL
+        nlp = spacy.load(SPACY_MODEL)
+    directory = directory or get_catalog_pipeline_dir()
+    ruler = add_catalog_ruler(nlp, lexicon)
+    nlp.to_disk(directory)
+    logger.info(f"Saved SpaCy pipeline with {len(ruler)} catalog patterns to {directory}")
+    return len(ruler)
+
+
+def has_catalog_entities(doc):
+    """
+    Whether the catalog ruler tagged anything in `doc`.
+    """
+    return any(ent.ent_id_ in RULER_IDS for ent in doc.ents)
@@ -0,0 +1,89 @@
+# nancy/inverted_index.py
+from bisect import bisect_left
+
+import numpy as np
+
+from .bitset import RowSet, any_of, is_dense, rows_to_bits
+from .lexicon import normalize_string, split_names
+
+EMPTY_POSTINGS = np.empty(0, dtype=np.int32)
+
+
+class InvertedIndex:
+    """
+    Maps each normalized value of a movie field (a genre, an actor, a director) to the
+    sorted array of movie rows carrying it.
+
+    Stored CSR-style: `keys` is sorted, and the rows of keys[i] are
+    postings[offsets[i]:offsets[i + 1]]. Keys carried by many movies can also
+    have a precomputed bitmap: bitmaps[j] for the key at bitmap_positions[j].
+    """
+
+    def __init__(self, keys, offsets, postings, bitmap_positions=None, bitmaps=None):
+        self.keys = keys
+        self.offsets = offsets
+        self.postings = postings
+        self.bitmap_positions = bitmap_positions if bitmap_positions is not None else EMPTY_POSTINGS
+        self.bitmaps = bitmaps
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _rows_at(self, position):
+        return self.postings[self.offsets[position]:self.offsets[position + 1]]
+
+    def _row_set_at(self, position, n_rows):
+        j = bisect_left(self.bitmap_positions, position)
+        if j < len(self.bitmap_positions) and self.bitmap_positions[j] == position:
+            return RowSet(n_rows, bits=self.bitmaps[j])
+        return RowSet.from_rows(self._rows_at(position), n_rows)
+
+    def row_set(self, key, n_rows):
+        """
+        RowSet of the movies carrying an already normalized key.
+        """
+        position = bisect_left(self.keys, key)
+        if position < len(self.keys) and self.keys[position] == key:
+            return self._row_set_at(position, n_rows)
+        return RowSet.empty(n_rows)
+
+    def row_set_containing(self, term, n_rows):
+        """
+        RowSet of the movies carrying any key containing `term`, e.g. 'fiction' for
+        'science fiction'. Only meant for fields with few keys, such as genres.
+        """
+        return any_of([self._row_set_at(i, n_rows) for i, key in enumerate(self.keys) if term in key], n_rows)
+
+    def dense_bitmaps(self, n_rows):
+        """
+        Positions of the keys carried by enough movies to be stored as bitmaps, and
+        their packed bitmaps as a (keys, ceil(n_rows / 8)) array.
+        """
+        counts = np.diff(self.offsets)
+        positions = np.flatnonzero(is_dense(counts, n_rows)).astype(np.int32)
+        bitmaps = np.zeros((len(positions), (n_rows + 7) // 8), dtype=np.uint8)
+        for j, position in enumerate(positions):
+            bitmaps[j] = rows_to_bits(self._rows_at(position), n_rows)
+        return positions, bitmaps
+
+    @classmethod
+    def build(cls, values):
+        """
+        Build the index from one field value per movie row (e.g. "Action, Comedy").
+        """
+        rows_by_key = {}
+        for row, value in enumerate(values):
+            for name in split_names(value):
+                rows = rows_by_key.setdefault(normalize_string(name), [])
+                # A name repeated within one value must not add the row twice
+                if not rows or rows[-1] != row:
+                    rows.append(row)
+
+        keys = sorted(rows_by_key)
+        offsets = np.zeros(len(keys) + 1, dtype=np.int64)
+        np.cumsum([len(rows_by_key[key]) for key in keys], out=offsets[1:])
+        postings = np.fromiter(
+            (row for key in keys for row in rows_by_key[key]), dtype=np.int32, count=int(offsets[-1])
+        )
+        return cls(keys, offsets, postings)
+
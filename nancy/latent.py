@@ -0,0 +1,125 @@
+# nancy/latent.py
+"""
+Latent semantic index: the TF-IDF space projected to a few hundred dense dimensions.
+
+The TF-IDF matrix has one dimension per vocabulary term. A TruncatedSVD projection
+to ~128-256 dimensions keeps most of its variance, and with L2-normalized rows a
+query is scored against the whole catalog with a single dense matrix-vector product.
+"""
+import numpy as np
+from sklearn.decomposition import TruncatedSVD
+from sklearn.preprocessing import normalize
+
+from .quantize import dequantize, dot, quantize
+from .ranking import top_k
+
+DEFAULT_LATENT_DIMS = 192
+
+
+
+def clamp_dims(dims, n_features):
+    # TruncatedSVD needs fewer components than features
+    return max(1, min(dims, n_features - 1))
+
+
+class LatentIndex:
+    """
+    L2-normalized float32 movie vectors (N, d), C-contiguous, and the (d, V)
+    projection mapping TF-IDF vectors into the same space. An optional IVFIndex
+    generates candidates instead of scoring every movie. The vectors may be
+    stored quantized (see nancy.quantize), with per-row `scales` for int8.
+    """
+
+    def __init__(self, vectors, components, explained_variance=None, ivf=None, scales=None):
+        self.vectors = vectors
+        self.components = components
+        self.explained_variance = explained_variance
+        self.ivf = ivf
+        self.scales = scales
+
+    def __len__(self):
+        return self.vectors.shape[0]
+
+    @property
+    def dims(self):
+        return self.vectors.shape[1]
+
+    @classmethod
+    def build(cls, tfidf_matrix, dims=DEFAULT_LATENT_DIMS, random_state=0):
+        dims = clamp_dims(dims, tfidf_matrix.shape[1])
+        svd = TruncatedSVD(n_components=dims, random_state=random_state)
+        vectors = svd.fit_transform(tfidf_matrix)
+        return cls(
+            np.ascontiguousarray(normalize(vectors), dtype=np.float32),
+            np.ascontiguousarray(svd.components_, dtype=np.float32),
+            float(svd.explained_variance_ratio_.sum()),
+        )
+
+    def updated(self, tfidf_matrix, changed):
+        """
+        Index over `tfidf_matrix` (same vocabulary), whose first rows are the movies
+        indexed here: the `changed` rows (including every new one) are projected
+        with the existing components and the other vectors are kept, in float32.
+        The IVF lists keep their centroids. The explained variance is the one of
+        the original fit.
+        """
+        vectors = np.empty((tfidf_matrix.shape[0], self.dims), dtype=np.float32)
+        vectors[:len(self)] = dequantize(self.vectors, self.scales)
+        changed = np.asarray(changed, dtype=np.intp)
+        if len(changed):
+            vectors[changed] = self.project(tfidf_matrix[changed])
+        ivf = self.ivf.updated(vectors, changed) if self.ivf is not None else None
+        return LatentIndex(vectors, self.components, self.explained_variance, ivf)
+
+    def quantized(self, mode):
+        """
+        Copy of the index with its vectors stored as `mode` (float16 or int8).
+        """
+        vectors, scales = quantize(self.vectors, mode)
+        return LatentIndex(vectors, self.components, self.explained_variance, self.ivf, scales)
+
+    def vector_rows(self, rows):
+        """
+        Float32 vectors of the given movie rows.
+        """
+        return dequantize(self.vectors, self.scales, rows)
+
+    def score(self, vector, rows=None):
+        """
+        Dot products of `vector` with every movie vector, or with the given rows.
+        """
+        return dot(self.vectors, vector, self.scales, rows)
+
+    def project(self, tfidf_matrix):
+        """
+        L2-normalized latent vectors of TF-IDF rows (new movies, or a query).
+        """
+        return np.ascontiguousarray(normalize(tfidf_matrix @ self.components.T), dtype=np.float32)
+
+    def rank(self, vector, k, exclude=None, probes=None, candidates=None):
+        """
+        Rank movies by their cosine similarity to a latent `vector`. Only the
+        `candidates` rows are scored when given; otherwise, with an IVF index and
+        `probes` set, only the movies of the `probes` closest lists are, and every
+        movie is without. Returns (rows, scores), best first.
+        """
+        norm = np.linalg.norm(vector)
+        if not norm:
+            return np.empty(0, dtype=np.intp), np.empty(0, dtype=np.float64)
+        vector = (vector / norm).astype(np.float32)
+        if candidates is not None:
+            if exclude is not None:
+                candidates = candidates[~np.isin(candidates, exclude)]
+            positions, scores = top_k(self.score(vector, candidates), k)
+            return candidates[positions], scores
+        if self.ivf is not None and probes:
+            return self.ivf.search(self, vector, k, probes, exclude=exclude)
+        return top_k(self.score(vector), k, exclude=exclude)
+
+
+def postings_nbytes(tfidf_matrix):
+    """
+    Size of the TF-IDF matrix as stored in the artifacts: float32 scores and int32
+    movie rows per nonzero, plus an int64 offset per term.
+    """
+    return tfidf_matrix.nnz * 8 + (tfidf_matrix.shape[1] + 1) * 8
@@ -0,0 +1,123 @@
+# nancy/lexicon.py
+import json
+import os
+import re
+
+# Actors and directors are stored as free text, split them by comma, 'and', or '&'
+NAME_SPLIT_PATTERN = re.compile(r',|\band\b|\&')
+
+LEXICON_FILENAME = 'lexicon.json'
+
+
+def normalize_string(s):
+    """
+    Normalize a string by removing hyphens and converting to lowercase.
+    """
+    return s.replace('-', '').lower()
+
+
+def split_names(value):
+    """
+    Split an actors/directors field into stripped, non-empty names.
+    """
+    # Missing values come through pandas as NaN
+    if not isinstance(value, str):
+        return []
+    return [name.strip() for name in NAME_SPLIT_PATTERN.split(value) if name.strip()]
+
+
+def get_lexicon_path(artifacts_dir=None):
+    """
+    Lexicon saved by regenerate_models with an artifact version (the published one by default).
+    """
+    if artifacts_dir is None:
+        from .artifacts import get_current_dir
+        artifacts_dir = get_current_dir()
+    return os.path.join(artifacts_dir, LEXICON_FILENAME)
+
+
+class EntityLexicon:
+    """
+    Maps normalized titles, actor names and director names to their canonical form.
+
+    The first spelling seen for a normalized name wins, which matches the order the
+    catalog snapshot lists movies in.
+    """
+    KINDS = ('titles', 'actors', 'directors')
+
+    def __init__(self, version, titles=None, actors=None, directors=None):
+        self.version = version
+        self.titles = titles if titles is not None else {}
+        self.actors = actors if actors is not None else {}
+        self.directors = directors if directors is not None else {}
+
+    def add_movie(self, title, actors=None, directors=None):
+        """
+        Register the entities of a single movie.
+        Returns the (kind, normalized, canonical) entries that were not known before.
+        """
+        added = []
+        names_by_kind = (
+            ('titles', [title] if title else []),
+            ('actors', split_names(actors)),
+            ('directors', split_names(directors)),
+        )
+        for kind, names in names_by_kind:
+            entries = getattr(self, kind)
+            for name in names:
+                normalized = normalize_string(name)
+                if normalized not in entries:
+                    entries[normalized] = name
+                    added.append((kind, normalized, name))
+        return added
+
+    def copy(self, version):
+        return EntityLexicon(version, dict(self.titles), dict(self.actors), dict(self.directors))
+
+    @classmethod
+    def from_dataframe(cls, version, df_movies):
+        lexicon = cls(version)
+        for title, actors, directors in zip(df_movies['title'], df_movies['actors'], df_movies['directors']):
+            lexicon.add_movie(title, actors, directors)
+        return lexicon
+
+    def to_dict(self):
+        return {
+            'version': self.version,
+            'titles': self.titles,
+            'actors': self.actors,
+            'directors': self.directors,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['version'], data['titles'], data['actors'], data['directors'])
+
+    def save(self, path):
+        """
+        Write the lexicon to disk atomically so readers never see a partial file.
+        """
+        tmp_path = f'{path}.tmp{os.getpid()}'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls.from_dict(json.load(f))
+
+    @classmethod
+    def for_catalog(cls, version, df_movies, path=None):
+        """
+        Return the lexicon for a catalog version, reusing the one saved with the
+        model artifacts when it was built for the same version and building it in
+        memory otherwise. Nothing is written: requests only read the file.
+        """
+        try:
+            lexicon = cls.load(path or get_lexicon_path())
+            if lexicon.version == version:
+                return lexicon
+        except (OSError, ValueError, KeyError):
+            pass
+        return cls.from_dataframe(version, df_movies)
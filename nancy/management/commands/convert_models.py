@@ -0,0 +1,81 @@
+# nancy/management/commands/convert_models.py
+import os
+import pickle
+
+import numpy as np
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from scipy import sparse
+
+from nancy.artifacts import current_version, get_artifacts_dir, new_artifact_version, write_artifacts
+from nancy.catalog import get_catalog_version
+from nancy.entity_ruler import get_catalog_pipeline_dir, save_catalog_pipeline
+from nancy.lexicon import EntityLexicon, get_lexicon_path, normalize_string
+from nancy.neighbors import DEFAULT_NEIGHBORS, build_neighbor_index, neighbor_index_from_blocks
+
+
+class Command(BaseCommand):
+    help = 'Convert the legacy pickled models (df_movies.pkl, tfidf_vectorizer.pkl, cosine_sim.pkl) to memory-mapped artifacts.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--source', default=os.path.join(settings.BASE_DIR, 'nancy', 'ml_models'),
+            help='Directory holding the pickled models.'
+        )
+        parser.add_argument(
+            '--neighbors', type=int, default=DEFAULT_NEIGHBORS,
+            help=f'Number of similar movies kept per movie (default: {DEFAULT_NEIGHBORS}).'
+        )
+
+    def handle(self, *args, **kwargs):
+        source = kwargs['source']
+        k = kwargs['neighbors']
+
+        def load_pickle(filename):
+            path = os.path.join(source, filename)
+            if not os.path.exists(path):
+                raise CommandError(f"Missing model file: {path}")
+            with open(path, 'rb') as f:
+                return pickle.load(f)
+
+        self.stdout.write("Loading pickled models...")
+        df_movies = load_pickle('df_movies.pkl').reset_index(drop=True)
+        tfidf = load_pickle('tfidf_vectorizer.pkl')
+        if 'normalized_title' not in df_movies:
+            df_movies['normalized_title'] = df_movies['title'].map(normalize_string)
+
+        # The TF-IDF matrix of the descriptions is stored for free-text search
+        tfidf_matrix = sparse.csr_matrix(tfidf.transform(df_movies['description'].fillna('')))
+
+        cosine_path = os.path.join(source, 'cosine_sim.pkl')
+        if os.path.exists(cosine_path):
+            self.stdout.write("Reducing cosine_sim.pkl to a top-K neighbor index...")
+            cosine_sim = load_pickle('cosine_sim.pkl')
+            neighbor_index = neighbor_index_from_blocks(
+                cosine_sim.shape[0], lambda start, end: np.asarray(cosine_sim[start:end]), k=k
+            )
+        else:
+            # The dense matrix is often too large to keep around, rebuild from the descriptions
+            self.stdout.write("cosine_sim.pkl not found, rebuilding the neighbor index from descriptions...")
+            neighbor_index = build_neighbor_index(tfidf_matrix, k=k)
+
+        artifacts_dir = get_artifacts_dir()
+        self.stdout.write(f"Writing model artifacts to a new version in {artifacts_dir}...")
+        with new_artifact_version(artifacts_dir) as version_dir:
+            write_artifacts(version_dir, df_movies, tfidf, neighbor_index, tfidf_matrix=tfidf_matrix)
+            self._save_catalog_pipeline(df_movies, version_dir)
+        self.stdout.write(self.style.SUCCESS(
+            f"Converted models for {len(df_movies)} movies, version {current_version(artifacts_dir)} is now current."
+        ))
+
+    def _save_catalog_pipeline(self, df_movies, artifacts_dir):
+        lexicon = EntityLexicon.from_dataframe(get_catalog_version(), df_movies)
+        # Saved with the version, so requests only ever read it
+        lexicon.save(get_lexicon_path(artifacts_dir))
+        self.stdout.write("Saving the SpaCy pipeline with the catalog entity ruler...")
+        try:
+            patterns = save_catalog_pipeline(lexicon, get_catalog_pipeline_dir(artifacts_dir))
+        except OSError as e:
+            self.stdout.write(self.style.WARNING(f"Skipped the catalog entity ruler: {e}"))
+            return
+        self.stdout.write(f"Entity ruler saved with {patterns} patterns.")
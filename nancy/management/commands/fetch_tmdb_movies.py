@@ -3,6 +3,7 @@ import requests
 import pandas as pd
 from django.core.management.base import BaseCommand
 from tqdm import tqdm
+from nancy.catalog import bump_catalog_version
 from nancy.models import Movie
 from django.conf import settings
 import os
@@ -92,4 +93,6 @@ class Command(BaseCommand):
 
         # Bulk create
         Movie.objects.bulk_create(movies_to_create)
+        # bulk_create does not send post_save, so invalidate the catalog snapshot explicitly
+        bump_catalog_version(appended_only=True)
         self.stdout.write(self.style.SUCCESS(f"Added {len(movies_to_create)} new movies to the database."))
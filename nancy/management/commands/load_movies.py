@@ -1,21 +1,33 @@
 # nancy/management/commands/load_movies.py
-import pickle
 from django.core.management.base import BaseCommand
-from django.conf import settings
-import os
+from nancy.artifacts import get_current_dir, load_artifacts, verify_artifacts
+
 
 class Command(BaseCommand):
     help = 'Load pre-trained ML models into the application.'
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify', action='store_true',
+            help='Also compare every artifact file with the checksums recorded in the manifest.'
+        )
+
     def handle(self, *args, **kwargs):
-        model_files = ['cosine_sim.pkl', 'df_movies.pkl', 'indices.pkl', 'tfidf_vectorizer.pkl']
-        missing_files = []
-        for file in model_files:
-            file_path = os.path.join(settings.BASE_DIR, 'nancy', 'ml_models', file)
-            if not os.path.exists(file_path):
-                missing_files.append(file)
+        artifacts_dir = get_current_dir()
+        try:
+            artifacts = load_artifacts(artifacts_dir)
+        except (OSError, ValueError, KeyError) as e:
+            self.stdout.write(self.style.ERROR(f"Could not open model artifacts in {artifacts_dir}: {e}"))
+            return
+
+        if kwargs['verify']:
+            problems = verify_artifacts(artifacts_dir)
+            for problem in problems:
+                self.stdout.write(self.style.ERROR(problem))
+            if problems:
+                return
 
-        if missing_files:
-            self.stdout.write(self.style.ERROR(f"Missing model files: {', '.join(missing_files)}"))
-        else:
-            self.stdout.write(self.style.SUCCESS("All pre-trained model files are present."))
+        self.stdout.write(self.style.SUCCESS(
+            f"All pre-trained model artifacts are present (version {artifacts.version}, {len(artifacts)} movies, "
+            f"{artifacts.neighbors.k} neighbors per movie)."
+        ))
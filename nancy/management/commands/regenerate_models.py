@@ -1,61 +1,340 @@
 # nancy/management/commands/regenerate_models.py
+import time
+
+from django.conf import settings
 from django.core.management.base import BaseCommand
 from nancy.models import Movie
+import numpy as np
 import pandas as pd
-import pickle
+from scipy import sparse
 from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-from django.conf import settings
-import os
+from nancy.ann import IVFIndex, default_n_lists, evaluate
+from nancy.artifacts import (
+    CHECKSUM_COLUMNS,
+    current_version,
+    get_artifacts_dir,
+    get_current_dir,
+    load_artifacts,
+    movie_checksum,
+    new_artifact_version,
+    write_artifacts,
+)
+from nancy.catalog import (
+    DEFAULT_CHUNK_SIZE,
+    get_catalog_version,
+    normalize_titles,
+    stream_columns,
+    stream_descriptions,
+)
+from nancy.entity_ruler import get_catalog_pipeline_dir, save_catalog_pipeline
+from nancy.latent import LatentIndex, clamp_dims, postings_nbytes
+from nancy.lexicon import EntityLexicon, get_lexicon_path
+from nancy.neighbors import DEFAULT_BLOCK_SIZE, DEFAULT_NEIGHBORS, build_neighbor_index, update_neighbor_index
+from nancy.quantize import QUANTIZE_MODES, QUANTIZE_NONE, dequantize, rank_agreement
+
+# Movie columns held in memory, descriptions are streamed to the vectorizer instead
+METADATA_FIELDS = ('id', 'title', 'genres', 'actors', 'directors')
+
+
+def _nbytes(values, scales):
+    return values.nbytes + (scales.nbytes if scales is not None else 0)
 
-def normalize_string(s):
-    """
-    Normalize a string by removing hyphens and converting to lowercase.
-    """
-    return s.replace('-', '').lower()
 
 class Command(BaseCommand):
     help = 'Regenerate similarity matrices for movie recommendations.'
 
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--neighbors', type=int, default=DEFAULT_NEIGHBORS,
+            help=f'Number of similar movies kept per movie (default: {DEFAULT_NEIGHBORS}).'
+        )
+        parser.add_argument(
+            '--block-size', type=int, default=DEFAULT_BLOCK_SIZE,
+            help=f'Rows scored at once while building the neighbor index (default: {DEFAULT_BLOCK_SIZE}).'
+        )
+        parser.add_argument(
+            '--workers', type=int, default=1,
+            help='Processes scoring blocks in parallel during a full rebuild (default: 1).'
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=DEFAULT_CHUNK_SIZE,
+            help=f'Rows fetched per database round trip (default: {DEFAULT_CHUNK_SIZE}).'
+        )
+        parser.add_argument(
+            '--latent-dims', type=int, default=getattr(settings, 'NANCY_LATENT_DIMS', 0),
+            help='Also build a latent (TruncatedSVD) index with this many dimensions, 0 to skip it '
+                 '(default: the NANCY_LATENT_DIMS setting).'
+        )
+        parser.add_argument(
+            '--ann-lists', type=int, default=getattr(settings, 'NANCY_ANN_LISTS', 0),
+            help='IVF lists of the approximate neighbor index built over the latent vectors, 0 for the square '
+                 'root of the number of movies, -1 to skip it (default: the NANCY_ANN_LISTS setting).'
+        )
+        parser.add_argument(
+            '--quantize', choices=QUANTIZE_MODES, default=getattr(settings, 'NANCY_QUANTIZE', QUANTIZE_NONE),
+            help='Store neighbor scores and latent vectors as float16 or per-row scaled int8 '
+                 '(default: the NANCY_QUANTIZE setting).'
+        )
+        parser.add_argument(
+            '--quantize-min-overlap', type=float, default=getattr(settings, 'NANCY_QUANTIZE_MIN_OVERLAP', 0.95),
+            help='Keep the latent vectors in full precision when the top-10 of the quantized vectors shares '
+                 'less than this share of movies with full precision (default: the NANCY_QUANTIZE_MIN_OVERLAP setting).'
+        )
+        parser.add_argument(
+            '--eval-queries', type=int, default=200,
+            help='Movies used as queries to compare the approximate index and quantized vectors with exact search '
+                 '(default: 200).'
+        )
+        parser.add_argument(
+            '--incremental', action='store_true',
+            help='Keep the fitted TF-IDF vocabulary and only rescore new or changed movies. The latent '
+                 'components and IVF centroids are kept too, only those movies are projected and assigned. '
+                 'Falls back to a full rebuild when that is not possible (e.g. after deletions). '
+                 'Run a full rebuild periodically so the vocabulary and the latent space pick up new words.'
+        )
+
     def handle(self, *args, **kwargs):
+        start = time.perf_counter()
+        chunk_size = kwargs['chunk_size']
+        # Read before the movies, a change made meanwhile makes the saved lexicon look stale, not current
+        catalog_version = get_catalog_version()
         self.stdout.write("Loading movies from the database...")
-        movies_qs = Movie.objects.all()
-        movies_data = list(movies_qs.values())
-        df_movies = pd.DataFrame(movies_data)
+        df_movies = pd.DataFrame(stream_columns(Movie.objects.all(), METADATA_FIELDS, chunk_size), copy=False)
 
         # Normalize movie titles
-        df_movies['normalized_title'] = df_movies['title'].apply(lambda x: normalize_string(x.lower()))
+        df_movies['normalized_title'] = normalize_titles(df_movies['title'])
+
+        # Descriptions are read in a second pass, straight into the vectorizer;
+        # the per-movie checksums are filled in as they go by
+        checksums = np.zeros(len(df_movies), dtype=np.uint64)
+        descriptions = self._descriptions(df_movies, checksums, chunk_size)
+
+        artifacts_dir = get_artifacts_dir()
+        built = None
+        if kwargs['incremental']:
+            built = self._build_incremental(
+                df_movies, descriptions, checksums, artifacts_dir, kwargs['neighbors'], kwargs['block_size'],
+                kwargs['latent_dims']
+            )
+        if built is None:
+            built = self._build_full(
+                df_movies, descriptions, checksums, kwargs['neighbors'], kwargs['block_size'], kwargs['workers']
+            )
+        df_movies, tfidf, tfidf_matrix, neighbor_index, build_info, latent = built
+        if kwargs['latent_dims'] <= 0:
+            latent = None
+        elif latent is None:
+            latent = self._build_latent(tfidf_matrix, kwargs['latent_dims'])
+        if latent is not None:
+            ann_lists = kwargs['ann_lists']
+            if ann_lists < 0:
+                latent.ivf = None
+            elif latent.ivf is None or (ann_lists and ann_lists != len(latent.ivf)):
+                latent.ivf = self._build_ann(latent, ann_lists, kwargs['eval_queries'])
+        if kwargs['quantize'] != QUANTIZE_NONE:
+            neighbor_index, latent = self._quantize(
+                neighbor_index, latent, kwargs['quantize'], kwargs['quantize_min_overlap'], kwargs['eval_queries']
+            )
+
+        # Save the models as memory-mappable arrays in a new version, published once complete
+        self.stdout.write(f"Saving model artifacts to a new version in {artifacts_dir}...")
+        with new_artifact_version(artifacts_dir) as version_dir:
+            write_artifacts(
+                version_dir, df_movies, tfidf, neighbor_index, build_info=build_info, tfidf_matrix=tfidf_matrix,
+                latent=latent
+            )
+            self._save_catalog_pipeline(df_movies, version_dir, catalog_version)
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Successfully regenerated similarity matrices ({build_info['mode']}, "
+            f"{time.perf_counter() - start:.1f}s), version {current_version(artifacts_dir)} is now current."
+        ))
 
+    @staticmethod
+    def _descriptions(df_movies, checksums, chunk_size):
+        """
+        Yield the description of every movie of `df_movies`, in row order, and store
+        each movie's checksum in `checksums` on the way.
+        """
+        columns = [df_movies[column].to_numpy() if column != 'description' else None for column in CHECKSUM_COLUMNS]
+        for row, description in enumerate(stream_descriptions(df_movies['id'].to_numpy(), chunk_size)):
+            checksums[row] = movie_checksum(
+                description if column is None else column[row] for column in columns
+            )
+            yield description
+
+    def _build_full(self, df_movies, descriptions, checksums, k, block_size, workers):
         self.stdout.write("Generating TF-IDF matrix...")
         tfidf = TfidfVectorizer(stop_words='english')
-        df_movies['description'] = df_movies['description'].fillna('')
-        tfidf_matrix = tfidf.fit_transform(df_movies['description'])
+        tfidf_matrix = tfidf.fit_transform(descriptions)
+        df_movies['checksum'] = checksums
+
+        n_blocks = -(-len(df_movies) // block_size)
+        self.stdout.write(f"Building top-{k} neighbor index in {n_blocks} blocks with {workers} worker(s)...")
+        build_start = time.perf_counter()
+        done = 0
+
+        def progress(start, end, seconds):
+            nonlocal done
+            done += 1
+            self.stdout.write(f"  block {done}/{n_blocks}: rows {start}-{end - 1} in {seconds:.2f}s")
+
+        neighbor_index = build_neighbor_index(
+            tfidf_matrix, k=k, block_size=block_size, workers=workers, progress=progress
+        )
+        build_seconds = time.perf_counter() - build_start
+        self.stdout.write(f"Neighbor index built in {build_seconds:.1f}s.")
+        build_info = {'mode': 'full', 'workers': workers, 'seconds': round(build_seconds, 3)}
+        return df_movies, tfidf, tfidf_matrix, neighbor_index, build_info, None
+
+    def _build_incremental(self, df_movies, descriptions, checksums, artifacts_dir, k, block_size, latent_dims):
+        """
+        Update the current artifacts for the new and changed movies, or return None
+        (after saying why) when a full rebuild is needed. The latent index is
+        updated as well when it has the requested dimensions, and left to be
+        fitted again (None) otherwise.
+        """
+        try:
+            base = load_artifacts(get_current_dir(artifacts_dir))
+        except (OSError, ValueError, KeyError) as e:
+            self.stdout.write(self.style.WARNING(f"No usable artifacts ({e}), running a full rebuild."))
+            return None
+        if base.movie_ids is None or base.tfidf_rows is None or base.neighbors.k != k:
+            self.stdout.write(self.style.WARNING(
+                "The current artifacts have no movie ids, no stored TF-IDF rows or another neighbor count, "
+                "running a full rebuild."
+            ))
+            return None
+
+        old_ids = np.asarray(base.movie_ids)
+        ids = df_movies['id'].to_numpy()
+        deleted = int((~np.isin(old_ids, ids)).sum())
+        if deleted:
+            self.stdout.write(self.style.WARNING(f"{deleted} movies were deleted, running a full rebuild."))
+            return None
+
+        # Row of every movie in the current artifacts, -1 for new movies
+        old_rows = pd.Series(np.arange(len(old_ids)), index=old_ids).reindex(ids).fillna(-1).to_numpy(dtype=np.intp)
+        # Every description is read for its checksum, only the new and changed ones are kept
+        changed_descriptions = {}
+        for row, description in enumerate(descriptions):
+            old_row = old_rows[row]
+            if old_row < 0 or (base.checksums is not None and checksums[row] != base.checksums[old_row]):
+                changed_descriptions[row] = description
+        df_movies['checksum'] = checksums
+
+        # Keep the rows of the current artifacts in place and append the new movies
+        row_by_id = pd.Series(np.arange(len(df_movies)), index=ids)
+        order = np.concatenate([row_by_id.loc[old_ids].to_numpy(), np.flatnonzero(old_rows < 0)])
+        df_movies = df_movies.iloc[order].reset_index(drop=True)
+        positions = np.empty(len(order), dtype=np.intp)
+        positions[order] = np.arange(len(order))
+        changed_rows = np.fromiter(changed_descriptions, dtype=np.intp, count=len(changed_descriptions))
+        changed_rows = changed_rows[np.argsort(positions[changed_rows])]
+        changed = positions[changed_rows]
+        self.stdout.write(f"{len(changed)} new or changed movies out of {len(df_movies)}.")
+
+        self.stdout.write("Transforming their descriptions with the fitted TF-IDF vocabulary...")
+        tfidf = base.vectorizer
+        changed_matrix = sparse.csr_matrix((0, base.tfidf_rows.shape[1]))
+        if len(changed_rows):
+            changed_matrix = tfidf.transform(changed_descriptions[row] for row in changed_rows)
+        # The stored rows of the untouched movies, the freshly transformed ones for the others
+        source_rows = np.arange(len(df_movies))
+        source_rows[changed] = len(old_ids) + np.arange(len(changed))
+        tfidf_matrix = sparse.vstack([base.tfidf_rows, changed_matrix], format='csr')[source_rows]
+
+        self.stdout.write(f"Updating the affected top-{k} neighbor lists...")
+        neighbor_index = update_neighbor_index(
+            base.neighbors.dequantized(), tfidf_matrix, changed, block_size=block_size
+        )
+        build_info = {
+            'mode': 'incremental',
+            'base_created_at': base.manifest.get('created_at'),
+            'changed_movies': int(len(changed)),
+        }
 
-        self.stdout.write("Calculating cosine similarity...")
-        cosine_sim = cosine_similarity(tfidf_matrix, tfidf_matrix)
+        latent = None
+        if latent_dims > 0 and base.latent is not None:
+            if base.latent.dims == clamp_dims(latent_dims, tfidf_matrix.shape[1]):
+                self.stdout.write(f"Projecting them with the current {base.latent.dims} latent dimensions...")
+                latent = base.latent.updated(tfidf_matrix, changed)
+            else:
+                self.stdout.write(self.style.WARNING(
+                    f"The current latent index has {base.latent.dims} dimensions, fitting a new one."
+                ))
+        return df_movies, tfidf, tfidf_matrix, neighbor_index, build_info, latent
 
-        self.stdout.write("Creating indices mapping...")
-        indices = pd.Series(df_movies.index, index=df_movies['normalized_title']).drop_duplicates()
+    def _build_latent(self, tfidf_matrix, dims):
+        self.stdout.write(f"Projecting the TF-IDF matrix to {dims} latent dimensions...")
+        build_start = time.perf_counter()
+        latent = LatentIndex.build(tfidf_matrix, dims)
+        postings_bytes = postings_nbytes(tfidf_matrix)
+        saved = postings_bytes - latent.vectors.nbytes
+        self.stdout.write(
+            f"Latent index built in {time.perf_counter() - build_start:.1f}s: {latent.dims} dimensions keep "
+            f"{latent.explained_variance:.1%} of the variance, {latent.vectors.nbytes / 2**20:.1f} MiB of movie "
+            f"vectors against {postings_bytes / 2**20:.1f} MiB of TF-IDF postings "
+            f"({'saves' if saved >= 0 else 'costs'} {abs(saved) / 2**20:.1f} MiB)."
+        )
+        return latent
 
-        # Define model directory
-        model_dir = os.path.join(settings.BASE_DIR, 'nancy', 'ml_models')
-        os.makedirs(model_dir, exist_ok=True)
+    def _build_ann(self, latent, n_lists, eval_queries):
+        n_lists = n_lists or default_n_lists(len(latent))
+        self.stdout.write(f"Clustering the latent vectors into {n_lists} IVF lists...")
+        build_start = time.perf_counter()
+        ivf = IVFIndex.build(latent.vectors, n_lists)
+        self.stdout.write(f"Approximate neighbor index built in {time.perf_counter() - build_start:.1f}s.")
 
-        # Save the models
-        self.stdout.write("Saving cosine_sim.pkl...")
-        with open(os.path.join(model_dir, 'cosine_sim.pkl'), 'wb') as f:
-            pickle.dump(cosine_sim, f)
+        if eval_queries > 0:
+            queries = self._eval_queries(len(latent), eval_queries)
+            self.stdout.write(f"Recall@10 against exact search over {len(queries)} movies:")
+            self.stdout.write(f"  {'probes':>8} {'recall@10':>10} {'ms/query':>9}")
+            for row in evaluate(ivf, latent, queries, k=10):
+                probes = 'exact' if row['probes'] is None else row['probes']
+                self.stdout.write(f"  {probes:>8} {row['recall']:>10.3f} {row['ms']:>9.3f}")
+            self.stdout.write("Set NANCY_ANN_PROBES to the fewest probes with an acceptable recall.")
+        return ivf
 
-        self.stdout.write("Saving df_movies.pkl...")
-        with open(os.path.join(model_dir, 'df_movies.pkl'), 'wb') as f:
-            pickle.dump(df_movies, f)
+    def _quantize(self, neighbor_index, latent, mode, min_overlap, eval_queries):
+        quantized = neighbor_index.quantized(mode)
+        # Neighbor lists keep their stored order, only their scores lose precision
+        error = np.abs(dequantize(quantized.scores, quantized.score_scales) - neighbor_index.scores).max(initial=0)
+        self.stdout.write(
+            f"Neighbor scores stored as {mode}: {neighbor_index.scores.nbytes / 2**20:.1f} MiB -> "
+            f"{_nbytes(quantized.scores, quantized.score_scales) / 2**20:.1f} MiB, largest score error {error:.4f}."
+        )
+        if latent is None:
+            return quantized, latent
 
-        self.stdout.write("Saving indices.pkl...")
-        with open(os.path.join(model_dir, 'indices.pkl'), 'wb') as f:
-            pickle.dump(indices, f)
+        quantized_latent = latent.quantized(mode)
+        queries = self._eval_queries(len(latent), max(eval_queries, 1))
+        agreement = rank_agreement(latent.vectors, quantized_latent.vectors, quantized_latent.scales, queries)
+        self.stdout.write(
+            f"Latent vectors as {mode}: {latent.vectors.nbytes / 2**20:.1f} MiB -> "
+            f"{_nbytes(quantized_latent.vectors, quantized_latent.scales) / 2**20:.1f} MiB. Against full precision "
+            f"over {len(queries)} movies: top-10 overlap {agreement['overlap']:.3f}, identical top-10 order "
+            f"{agreement['same_order']:.1%}, largest score error {agreement['max_error']:.4f}."
+        )
+        if agreement['overlap'] < min_overlap:
+            self.stdout.write(self.style.WARNING(
+                f"Top-10 overlap is below {min_overlap}, keeping the latent vectors in full precision."
+            ))
+            return quantized, latent
+        return quantized, quantized_latent
 
-        self.stdout.write("Saving tfidf_vectorizer.pkl...")
-        with open(os.path.join(model_dir, 'tfidf_vectorizer.pkl'), 'wb') as f:
-            pickle.dump(tfidf, f)
+    @staticmethod
+    def _eval_queries(n_rows, count):
+        return np.random.default_rng(0).choice(n_rows, min(count, n_rows), replace=False)
 
-        self.stdout.write(self.style.SUCCESS('Successfully regenerated similarity matrices.'))
+    def _save_catalog_pipeline(self, df_movies, artifacts_dir, catalog_version):
+        lexicon = EntityLexicon.from_dataframe(catalog_version, df_movies)
+        # Saved with the version, so requests only ever read it
+        lexicon.save(get_lexicon_path(artifacts_dir))
+        self.stdout.write("Saving the SpaCy pipeline with the catalog entity ruler...")
+        try:
+            patterns = save_catalog_pipeline(lexicon, get_catalog_pipeline_dir(artifacts_dir))
+        except OSError as e:
+            self.stdout.write(self.style.WARNING(f"Skipped the catalog entity ruler: {e}"))
+            return
+        self.stdout.write(f"Entity ruler saved with {patterns} patterns.")
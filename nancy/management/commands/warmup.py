@@ -0,0 +1,30 @@
+# nancy/management/commands/warmup.py
+from django.core.management.base import BaseCommand, CommandError
+
+from nancy.registry import registry
+
+
+class Command(BaseCommand):
+    help = 'Load the SpaCy pipeline and model artifacts and report how long each took.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'resources', nargs='*',
+            help=f"Resources to load, any of {', '.join(registry.names())} (default: all)."
+        )
+
+    def handle(self, *args, **kwargs):
+        names = kwargs['resources'] or registry.names()
+        unknown = set(names) - set(registry.names())
+        if unknown:
+            raise CommandError(f"Unknown resources: {', '.join(sorted(unknown))}")
+
+        statuses = registry.warm_up(names)
+        for name in names:
+            resource_status = statuses[name]
+            if resource_status['loaded']:
+                self.stdout.write(self.style.SUCCESS(f"{name}: loaded in {resource_status['load_seconds']:.3f}s"))
+            elif resource_status['error']:
+                self.stdout.write(self.style.ERROR(f"{name}: {resource_status['error']}"))
+            else:
+                self.stdout.write(f"{name}: not loaded")
@@ -0,0 +1,162 @@
+# nancy/matching.py
+from collections import deque
+
+
+def _is_word_char(ch):
+    return ch.isalnum() or ch == '_'
+
+
+class AhoCorasick:
+    """
+    Aho-Corasick automaton that finds every occurrence of a set of patterns in a
+    single left-to-right pass over the text, independent of how many patterns exist.
+    """
+
+    def __init__(self, patterns=()):
+        # Node 0 is the root. Each node keeps its outgoing edges, failure link,
+        # the payloads of patterns ending there and a link to the next node on
+        # its failure chain that ends a pattern.
+        self._goto = [{}]
+        self._fail = [0]
+        self._depth = [0]
+        self._payloads = [None]
+        self._output_link = [0]
+        self._built = True
+        self.pattern_count = 0
+        for pattern, payload in patterns:
+            self.add(pattern, payload)
+
+    def __len__(self):
+        return self.pattern_count
+
+    def add(self, pattern, payload=None):
+        """
+        Add a pattern. Failure links are recomputed lazily on the next search.
+        """
+        if not pattern:
+            return
+        node = 0
+        for ch in pattern:
+            next_node = self._goto[node].get(ch)
+            if next_node is None:
+                next_node = len(self._goto)
+                self._goto.append({})
+                self._fail.append(0)
+                self._depth.append(self._depth[node] + 1)
+                self._payloads.append(None)
+                self._output_link.append(0)
+                self._goto[node][ch] = next_node
+            node = next_node
+        if self._payloads[node] is None:
+            self._payloads[node] = []
+            self.pattern_count += 1
+        self._payloads[node].append(payload)
+        self._built = False
+
+    def build(self):
+        """
+        Compute failure and output links with a breadth-first walk of the trie.
+        """
+        goto, fail, payloads, output_link = self._goto, self._fail, self._payloads, self._output_link
+        queue = deque()
+        for child in goto[0].values():
+            fail[child] = 0
+            output_link[child] = 0
+            queue.append(child)
+
+        while queue:
+            node = queue.popleft()
+            for ch, child in goto[node].items():
+                queue.append(child)
+                state = fail[node]
+                while state and ch not in goto[state]:
+                    state = fail[state]
+                fail[child] = goto[state].get(ch, 0)
+                suffix = fail[child]
+                output_link[child] = suffix if payloads[suffix] is not None else output_link[suffix]
+        self._built = True
+
+    def iter_matches(self, text, whole_words=False):
+        """
+        Yield (start, end, payload) for every pattern occurrence in `text`.
+        With `whole_words`, matches touching a letter or digit on either side are skipped.
+        """
+        if not self._built:
+            self.build()
+        goto, fail, payloads, output_link, depth = (
+            self._goto, self._fail, self._payloads, self._output_link, self._depth
+        )
+        text_length = len(text)
+        node = 0
+        for i, ch in enumerate(text):
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+
+            match = node if payloads[node] is not None else output_link[node]
+            while match:
+                start, end = i + 1 - depth[match], i + 1
+                if not whole_words or (
+                    (start == 0 or not _is_word_char(text[start - 1]))
+                    and (end == text_length or not _is_word_char(text[end]))
+                ):
+                    for payload in payloads[match]:
+                        yield start, end, payload
+                match = output_link[match]
+
+
+class EntityMatcher:
+    """
+    Finds every known title, actor and director inside a normalized query.
+
+    Newly added entities go into a small delta automaton so that appending movies
+    to the catalog does not rebuild the automaton for the whole catalog; the delta
+    is folded into the base once it grows past a fraction of it.
+    """
+    # Rebuild the base automaton when the delta holds more than this share of its patterns
+    MERGE_RATIO = 0.1
+    MIN_MERGE_SIZE = 1000
+
+    def __init__(self, base, delta_entries=()):
+        self.base = base
+        self.delta_entries = tuple(delta_entries)
+        self.delta = AhoCorasick(
+            (normalized, (kind, canonical)) for kind, normalized, canonical in self.delta_entries
+        )
+        self.delta.build()
+
+    @staticmethod
+    def lexicon_patterns(lexicon):
+        for kind in lexicon.KINDS:
+            for normalized, canonical in getattr(lexicon, kind).items():
+                yield normalized, (kind, canonical)
+
+    @classmethod
+    def from_lexicon(cls, lexicon):
+        base = AhoCorasick(cls.lexicon_patterns(lexicon))
+        base.build()
+        return cls(base)
+
+    def extended(self, lexicon, new_entries):
+        """
+        Return a matcher that also knows `new_entries`, an iterable of
+        (kind, normalized, canonical) tuples already added to `lexicon`.
+        """
+        delta_entries = self.delta_entries + tuple(new_entries)
+        if len(delta_entries) > max(self.MIN_MERGE_SIZE, self.MERGE_RATIO * len(self.base)):
+            return self.from_lexicon(lexicon)
+        # The base automaton is shared, only the small delta is rebuilt
+        return EntityMatcher(self.base, delta_entries)
+
+    def find(self, text, whole_words=False):
+        """
+        Return a dict mapping each entity kind to the canonical names found in `text`,
+        in order of first appearance.
+        """
+        found = {}
+        for automaton in (self.base, self.delta):
+            for _, _, (kind, canonical) in automaton.iter_matches(text, whole_words=whole_words):
+                names = found.setdefault(kind, [])
+                if canonical not in names:
+                    names.append(canonical)
+        return found
@@ -19,3 +19,15 @@ class RecommendationRequest(models.Model):
 
     def __str__(self):
         return f"Recommendation Request at {self.timestamp}"
+
+class CatalogVersion(models.Model):
+    """
+    Single row holding the catalog counters, shared by every process through the database.
+    `version` moves on every change to the Movie table, `generation` only on changes
+    other than appending movies (updates and deletes).
+    """
+    version = models.BigIntegerField()
+    generation = models.BigIntegerField()
+
+    def __str__(self):
+        return f"Catalog version {self.version} (generation {self.generation})"
@@ -0,0 +1,198 @@
+# nancy/neighbors.py
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from scipy import sparse
+from sklearn.metrics.pairwise import cosine_similarity
+from sklearn.preprocessing import normalize
+
+from .quantize import dequantize, quantize
+from .ranking import top_k_batch
+
+# Neighbors kept per movie and rows scored at once while building the index
+DEFAULT_NEIGHBORS = 50
+DEFAULT_BLOCK_SIZE = 1024
+
+# Padding id for movies with fewer than K other movies to point at
+NO_NEIGHBOR = -1
+
+
+class NeighborIndex:
+    """
+    The K most similar movies of every movie, stored as two fixed-width (N, K) arrays:
+    neighbor row ids (int32) and their cosine scores (float32), best first.
+
+    Memory grows as N x K instead of the N x N of a dense similarity matrix.
+    Scores may be stored quantized (see nancy.quantize), with per-row
+    `score_scales` for int8.
+    """
+
+    def __init__(self, ids, scores, score_scales=None):
+        self.ids = ids
+        self.scores = scores
+        self.score_scales = score_scales
+
+    def __len__(self):
+        return self.ids.shape[0]
+
+    @property
+    def k(self):
+        return self.ids.shape[1]
+
+    def neighbors(self, rows, k=None, exclude=None):
+        """
+        Return the best `k` neighbors of each row in `rows` as a list of
+        (ids, scores) array pairs, skipping padding and any id in `exclude`.
+        """
+        k = self.k if k is None else k
+        ids = self.ids[rows]
+        scores = dequantize(self.scores, self.score_scales, rows)
+        valid = ids != NO_NEIGHBOR
+        if exclude is not None:
+            valid &= ~np.isin(ids, np.asarray(list(exclude)))
+        # Rows are sorted best first, so keeping the first k valid entries is enough
+        valid &= np.cumsum(valid, axis=1) <= k
+        return [(ids[row][valid[row]], scores[row][valid[row]]) for row in range(ids.shape[0])]
+
+    def quantized(self, mode):
+        """
+        Copy of the index with its scores stored as `mode` (float16 or int8).
+        """
+        scores, scales = quantize(self.scores, mode)
+        return NeighborIndex(self.ids, scores, scales)
+
+    def dequantized(self):
+        """
+        Copy of the index with float32 scores.
+        """
+        return NeighborIndex(self.ids, dequantize(self.scores, self.score_scales))
+
+
+def neighbor_index_from_blocks(n_rows, score_block, k=DEFAULT_NEIGHBORS, block_size=DEFAULT_BLOCK_SIZE, progress=None):
+    """
+    Build a NeighborIndex from `score_block(start, end)`, which returns the dense
+    similarity rows start..end against all N movies.
+
+    Each block is reduced to its top-k right away, so peak memory is
+    block_size x N rather than N x N. `progress(start, end, seconds)` is called
+    after every block.
+    """
+    k_kept = max(0, min(k, n_rows - 1))
+    ids = np.full((n_rows, k), NO_NEIGHBOR, dtype=np.int32)
+    scores = np.zeros((n_rows, k), dtype=np.float32)
+
+    for start in range(0, n_rows, block_size):
+        block_start = time.perf_counter()
+        end = min(start + block_size, n_rows)
+        ids[start:end, :k_kept], scores[start:end, :k_kept] = _block_top_k(score_block(start, end), start, k_kept)
+        if progress is not None:
+            progress(start, end, time.perf_counter() - block_start)
+    return NeighborIndex(ids, scores)
+
+
+def _block_top_k(block, start, k):
+    block = np.array(block, dtype=np.float64)
+    # A movie is not its own neighbor
+    rows = np.arange(block.shape[0])
+    block[rows, rows + start] = -np.inf
+    return top_k_batch(block, k)
+
+
+def _dot_block(normalized, start, end):
+    block = normalized[start:end] @ normalized.T
+    return block.toarray() if sparse.issparse(block) else block
+
+
+# Row-normalized matrix shared by the worker processes of a parallel build
+_worker_matrix = None
+
+
+def _init_worker(normalized):
+    global _worker_matrix
+    _worker_matrix = normalized
+
+
+def _worker_block(task):
+    start, end, k = task
+    block_start = time.perf_counter()
+    ids, scores = _block_top_k(_dot_block(_worker_matrix, start, end), start, k)
+    return start, end, ids.astype(np.int32), scores.astype(np.float32), time.perf_counter() - block_start
+
+
+def build_neighbor_index(matrix, k=DEFAULT_NEIGHBORS, block_size=DEFAULT_BLOCK_SIZE, workers=1, progress=None):
+    """
+    Build a NeighborIndex from a (sparse) feature matrix such as the TF-IDF matrix,
+    using cosine similarity.
+
+    Rows are L2-normalized once, then scored block by block as dot products. With
+    `workers` > 1 the blocks are spread over a process pool; each worker receives
+    the matrix once and only sends back the top-k of its blocks, so peak memory is
+    about workers x block_size x N. `progress(start, end, seconds)` is called for
+    every block, in block order.
+    """
+    normalized = normalize(matrix)
+    n_rows = normalized.shape[0]
+    if workers <= 1:
+        return neighbor_index_from_blocks(
+            n_rows, lambda start, end: _dot_block(normalized, start, end), k=k, block_size=block_size,
+            progress=progress
+        )
+
+    k_kept = max(0, min(k, n_rows - 1))
+    ids = np.full((n_rows, k), NO_NEIGHBOR, dtype=np.int32)
+    scores = np.zeros((n_rows, k), dtype=np.float32)
+    tasks = [(start, min(start + block_size, n_rows), k_kept) for start in range(0, n_rows, block_size)]
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(normalized,)) as executor:
+        for start, end, block_ids, block_scores, seconds in executor.map(_worker_block, tasks):
+            ids[start:end, :k_kept], scores[start:end, :k_kept] = block_ids, block_scores
+            if progress is not None:
+                progress(start, end, seconds)
+    return NeighborIndex(ids, scores)
+
+
+def update_neighbor_index(index, matrix, changed_rows, block_size=DEFAULT_BLOCK_SIZE):
+    """
+    Return the NeighborIndex of `matrix` given `index`, built for its first
+    len(index) rows, when only the rows in `changed_rows` differ: the movies added
+    at the end of the matrix plus any earlier movie whose features changed.
+
+    Changed rows and rows whose current list points at a changed movie are scored
+    against every movie again. Every other row keeps its list and only has it
+    merged with its scores against the changed movies, which costs N x C instead
+    of N x N.
+    """
+    n_rows, n_old, k = matrix.shape[0], len(index), index.k
+    changed = np.unique(np.asarray(list(changed_rows), dtype=np.intp))
+    ids = np.full((n_rows, k), NO_NEIGHBOR, dtype=np.int32)
+    scores = np.zeros((n_rows, k), dtype=np.float32)
+    ids[:n_old], scores[:n_old] = index.ids, index.scores
+    if not changed.size:
+        return NeighborIndex(ids, scores)
+
+    # A list holding a changed movie may have lost its true K-th neighbor
+    stale = np.flatnonzero(np.isin(index.ids, changed[changed < n_old]).any(axis=1))
+    rebuilt = np.union1d(changed, stale)
+    merged = np.setdiff1d(np.arange(n_old), rebuilt)
+    k_kept = max(0, min(k, n_rows - 1))
+
+    for start in range(0, len(merged), block_size):
+        rows = merged[start:start + block_size]
+        candidate_ids = np.hstack([index.ids[rows], np.broadcast_to(changed, (len(rows), len(changed)))])
+        candidate_scores = np.hstack([
+            np.asarray(index.scores[rows], dtype=np.float64), cosine_similarity(matrix[rows], matrix[changed])
+        ])
+        candidate_scores[candidate_ids == NO_NEIGHBOR] = -np.inf
+        # A movie is not its own neighbor
+        candidate_scores[candidate_ids == rows[:, None]] = -np.inf
+        positions, top_scores = top_k_batch(candidate_scores, k_kept)
+        top_ids = np.take_along_axis(candidate_ids, positions, axis=1)
+        top_ids[np.isneginf(top_scores)] = NO_NEIGHBOR
+        ids[rows, :k_kept], scores[rows, :k_kept] = top_ids, np.where(np.isneginf(top_scores), 0, top_scores)
+
+    for start in range(0, len(rebuilt), block_size):
+        rows = rebuilt[start:start + block_size]
+        block = cosine_similarity(matrix[rows], matrix)
+        block[np.arange(len(rows)), rows] = -np.inf
+        ids[rows, :k_kept], scores[rows, :k_kept] = top_k_batch(block, k_kept)
+    return NeighborIndex(ids, scores)
@@ -1,15 +1,85 @@
 # nancy/nlp_utils.py
-import spacy
-from fuzzywuzzy import process
-from nltk.corpus import stopwords
 import re
-from .models import Movie
+from functools import lru_cache
+from fuzzywuzzy import process
+from .entity_ruler import has_catalog_entities
+from .lexicon import normalize_string
+from .query_cache import query_cache
+from .registry import registry
 import logging
 
 logger = logging.getLogger(__name__)
 
-# Initialize SpaCy model
-nlp = spacy.load('en_core_web_sm')
+# Number of queries SpaCy processes per batch in parse_queries
+DEFAULT_PIPE_BATCH_SIZE = 32
+
+# Minimum fuzzywuzzy score for a query to be taken as a misspelt title
+FUZZY_TITLE_THRESHOLD = 90
+
+# Words turning the genre, actor or director right after them into a must-not
+# constraint ("a horror movie without Tom Hardy")
+NEGATION_WORDS = frozenset(['no', 'not', 'without', 'except', 'excluding', 'minus'])
+# The only words allowed between a negation and the entity it applies to ("without any", "not starring")
+NEGATION_BRIDGING_WORDS = frozenset(['starring', 'with', 'by', 'any'])
+# Conjunction passing a negation on to the next entity ("without Tom Hardy or Christian Bale")
+NEGATION_CONJUNCTION = 'or'
+
+
+def query_words(text):
+    """
+    Lowercase words and punctuation marks of `text`, as separate tokens.
+    """
+    return re.findall(r"\w+|[^\w\s]", text.lower())
+
+
+def is_negated(preceding_words, entity_words=frozenset()):
+    """
+    Whether the entity right after `preceding_words` (words and punctuation marks,
+    as separate tokens) is negated. Only a negation right before it counts, with
+    at most bridging words in between; any other word or punctuation mark ends the
+    search, except "or" after another entity (made of `entity_words`), which
+    carries that entity's negation over.
+    """
+    in_conjunction = False
+    for word in reversed(preceding_words):
+        if in_conjunction and word in entity_words:
+            continue
+        in_conjunction = False
+        if word in NEGATION_WORDS:
+            return True
+        if word == NEGATION_CONJUNCTION:
+            in_conjunction = True
+        elif word not in NEGATION_BRIDGING_WORDS:
+            return False
+    return False
+
+
+def is_negated_in(query_normalized, name, entity_words=frozenset()):
+    """
+    Whether the first occurrence of `name` in the normalized query is negated.
+    """
+    words = query_words(query_normalized)
+    name_words = query_words(normalize_string(name))
+    for start in range(len(words) - len(name_words) + 1):
+        if words[start:start + len(name_words)] == name_words:
+            return is_negated(words[:start], entity_words)
+    return False
+
+
+def split_negated(names, query_normalized, entity_words=frozenset()):
+    """
+    Split entity names into the ones the query asks for and the ones it rules out.
+    """
+    excluded = [name for name in names if is_negated_in(query_normalized, name, entity_words)]
+    return [name for name in names if name not in excluded], excluded
+
+
+def get_nlp():
+    """
+    Return the SpaCy pipeline, loading it on first use.
+    """
+    return registry.get('nlp')
+
 
 # Define genres list
 GENRES_LIST = [
@@ -34,111 +104,161 @@ GENRE_VARIATIONS = {
     # Add more variations as needed
 }
 
-# Stopwords
-STOP_WORDS = set(stopwords.words('english'))
+# Distinct unknown tokens whose fuzzy genre match is remembered, per process
+GENRE_CACHE_SIZE = 4096
+
+
+def _near_misses(word):
+    """
+    Spellings one deletion or one swap of adjacent letters away from `word`.
+    """
+    deletions = {word[:i] + word[i + 1:] for i in range(len(word))}
+    swaps = {word[:i] + word[i + 1] + word[i] + word[i + 2:] for i in range(len(word) - 1)}
+    return (deletions | swaps) - {word}
 
 
-def normalize_string(s):
+class GenreResolver:
     """
-    Normalize a string by removing hyphens and converting to lowercase.
+    Resolves query tokens to genres with one dictionary lookup for the genres, their
+    variations and their common misspellings, all computed once up front. Other
+    tokens are fuzzy-matched once and remembered in a bounded LRU cache.
     """
-    return s.replace('-', '').lower()
 
+    def __init__(self, genres, variations, threshold=80, cache_size=GENRE_CACHE_SIZE):
+        self.genres = list(genres)
+        self.threshold = threshold
+        self.table = {}
+        for genre in self.genres:
+            for spelling in _near_misses(genre):
+                closest = self._fuzzy_match(spelling)
+                if closest:
+                    self.table.setdefault(spelling, closest)
+        # Exact genres and explicit variations take precedence over misspellings
+        self.table.update((genre, genre) for genre in self.genres)
+        self.table.update(variations)
+        self._genre_set = set(self.genres)
+        self._cached_fuzzy_match = lru_cache(maxsize=cache_size)(self._fuzzy_match)
+        self.table_hits = 0
+
+    def _fuzzy_match(self, text):
+        match, score = process.extractOne(text, self.genres)
+        if score >= self.threshold:
+            return match
+        return None
+
+    def resolve(self, lemma, text):
+        """
+        Genre of a token given its lowercase lemma and text, or None.
+        """
+        if lemma in self._genre_set:
+            self.table_hits += 1
+            return lemma
+        genre = self.table.get(text)
+        if genre is not None:
+            self.table_hits += 1
+            return genre
+        return self._cached_fuzzy_match(text)
+
+    def stats(self):
+        info = self._cached_fuzzy_match.cache_info()
+        return {
+            'table_size': len(self.table),
+            'table_hits': self.table_hits,
+            'cache_hits': info.hits,
+            'cache_misses': info.misses,
+            'cache_size': info.currsize,
+        }
+
+
+def get_genre_resolver():
+    """
+    Return the genre resolver, building its table on first use.
+    """
+    return registry.get('genres')
 
-def get_closest_genre(token_text, threshold=80):
-    match, score = process.extractOne(token_text, GENRES_LIST)
-    if score >= threshold:
-        return match
-    return None
+
+def clean_query(query):
+    """
+    Strip surrounding whitespace and trailing punctuation before running SpaCy.
+    """
+    return query.strip().rstrip('.!?')
 
 
-def enhanced_parse_query(query, df_movies):
+def enhanced_parse_query(query, catalog):
     """
     Enhanced NLP parsing using SpaCy's NER and fuzzy matching to extract genres, specific movie names, actors, and directors.
+    `catalog` is the CatalogSnapshot returned by nancy.catalog.get_catalog().
     """
+    return parse_queries([query], catalog)[0]
+
+
+def parse_queries(queries, catalog, batch_size=DEFAULT_PIPE_BATCH_SIZE):
+    """
+    Parse several queries at once. SpaCy processes them together through nlp.pipe,
+    which is much faster than one nlp() call per query. Results keep the input order.
+
+    Parsed queries are cached per catalog and models version, only the queries
+    missing from the cache (each distinct one once) go through SpaCy.
+    """
+    keys, parsed_by_key = query_cache.get_many(queries, catalog)
+    missing = {}
+    for key, query in zip(keys, queries):
+        if key not in parsed_by_key:
+            missing.setdefault(key, query)
+
+    if missing:
+        docs = get_nlp().pipe((clean_query(query) for query in missing.values()), batch_size=batch_size)
+        parsed = {key: parse_doc(query, doc, catalog) for (key, query), doc in zip(missing.items(), docs)}
+        query_cache.set_many(parsed)
+        parsed_by_key.update(parsed)
+    return [parsed_by_key[key] for key in keys]
+
+
+def parse_doc(query, doc, catalog):
+    """
+    Extract the entities of `query` given its SpaCy `doc`.
+    """
+    lexicon = catalog.lexicon
+
     # Initialize lists to hold extracted entities
     genres = []
+    excluded_genres = []
     specific_movies = []
     actors = []
     directors = []
 
     # Normalize the entire query
     query_normalized = normalize_string(query)
-    query_clean = query.strip().rstrip('.!?')
-
-    # Use SpaCy for NER
-    doc = nlp(query_clean)
 
-    # Preprocess: create sets for titles, actors, directors for fast lookup
-    # Normalize movie titles by removing hyphens and lowercasing
-    movie_titles_normalized = set(normalize_string(title) for title in df_movies['title'].str.lower())
-
-    # Use regex to split actors and directors by comma, 'and', or '&'
-    split_pattern = r',|\band\b|\&'
-
-    # Split and normalize director names, filtering out empty strings
-    director_names = re.split(split_pattern, ', '.join(df_movies['directors'].dropna()))
-    director_names = [name.strip() for name in director_names if name.strip()]
-    director_names_normalized = set(normalize_string(name) for name in director_names)
-
-    # Split and normalize actor names, filtering out empty strings
-    actor_names = re.split(split_pattern, ', '.join(df_movies['actors'].dropna()))
-    actor_names = [name.strip() for name in actor_names if name.strip()]
-    actor_names_normalized = set(normalize_string(name) for name in actor_names)
-
-    # Extract entities recognized by SpaCy
+    # Extract entities recognized by SpaCy, resolving their proper casing through the lexicon
     for ent in doc.ents:
         ent_text_normalized = normalize_string(ent.text)
 
         # Check if the entity is a movie title
-        if ent_text_normalized in movie_titles_normalized:
-            # Find the actual title with proper casing
-            original_title = df_movies[df_movies['title'].str.lower() == ent.text.lower()].iloc[0]['title']
+        original_title = lexicon.titles.get(ent_text_normalized)
+        if original_title:
             specific_movies.append(original_title)
 
         # Check if the entity is a director
-        if ent_text_normalized in director_names_normalized:
-            # Find the actual name with proper casing
-            original_director = next((name for name in director_names if normalize_string(name) == ent_text_normalized),
-                                     None)
-            if original_director and original_director not in directors:
-                directors.append(original_director)
+        original_director = lexicon.directors.get(ent_text_normalized)
+        if original_director and original_director not in directors:
+            directors.append(original_director)
 
         # Check if the entity is an actor
-        if ent_text_normalized in actor_names_normalized:
-            # Find the actual name with proper casing
-            original_actor = next((name for name in actor_names if normalize_string(name) == ent_text_normalized), None)
-            if original_actor and original_actor not in actors:
-                actors.append(original_actor)
+        original_actor = lexicon.actors.get(ent_text_normalized)
+        if original_actor and original_actor not in actors:
+            actors.append(original_actor)
+
+    # The fuzzy title fallback below is only needed when the catalog entity ruler found nothing
+    ruler_found = has_catalog_entities(doc)
 
     # Secondary matching: Find actors, directors, and movies in the query even if SpaCy missed them
-    # This ensures that entities like "tom hardy" are detected regardless of casing or hyphens
-    if not actors:
-        for actor_normalized in actor_names_normalized:
-            if actor_normalized in query_normalized:
-                # Find the actual name with proper casing
-                original_actor = next((name for name in actor_names if normalize_string(name) == actor_normalized),
-                                      None)
-                if original_actor and original_actor not in actors:
-                    actors.append(original_actor)
-
-    if not directors:
-        for director_normalized in director_names_normalized:
-            if director_normalized in query_normalized:
-                # Find the actual name with proper casing
-                original_director = next(
-                    (name for name in director_names if normalize_string(name) == director_normalized), None)
-                if original_director and original_director not in directors:
-                    directors.append(original_director)
-
-    if not specific_movies:
-        for movie_normalized in movie_titles_normalized:
-            if movie_normalized in query_normalized:
-                # Find the actual title with proper casing
-                actual_title = \
-                df_movies[df_movies['title'].str.lower().apply(normalize_string) == movie_normalized].iloc[0]['title']
-                if actual_title not in specific_movies:
-                    specific_movies.append(actual_title)
+    # This ensures that entities like "tom hardy" are detected regardless of casing or hyphens.
+    # The catalog's automaton finds every known name in one pass over the normalized query. It
+    # always runs, as it knows the movies added since the ruler was saved with the models.
+    found = catalog.matcher.find(query_normalized)
+    for names, kind in ((actors, 'actors'), (directors, 'directors'), (specific_movies, 'titles')):
+        names.extend(name for name in found.get(kind, []) if name not in names)
 
     # Additionally, perform exact and fuzzy matching for movie titles in the query
     # This helps in cases where SpaCy fails to recognize the movie title as an entity
@@ -147,50 +267,57 @@ def enhanced_parse_query(query, df_movies):
     phrase_normalized = normalize_string(phrase)
 
     # Exact match
-    exact_matches = df_movies[df_movies['title'].str.lower().apply(normalize_string).isin([phrase_normalized])]
-    for title in exact_matches['title'].tolist():
-        if title not in specific_movies:
-            specific_movies.append(title)
-
-    # Fuzzy match (threshold can be adjusted)
-    fuzzy_matches = process.extract(phrase_normalized, movie_titles_normalized, limit=1)
-    for match, score in fuzzy_matches:
-        if score >= 90:
-            # Find the actual title with proper casing
-            actual_title = df_movies[df_movies['title'].str.lower().apply(normalize_string) == match].iloc[0]['title']
-            if actual_title not in specific_movies:
-                specific_movies.append(actual_title)
+    exact_title = lexicon.titles.get(phrase_normalized)
+    if exact_title and exact_title not in specific_movies:
+        specific_movies.append(exact_title)
+
+    # Fuzzy match (threshold can be adjusted), only scoring the titles sharing trigrams with the phrase
+    match = None if ruler_found else catalog.title_trigrams.extract_one(phrase_normalized, FUZZY_TITLE_THRESHOLD)
+    if match:
+        # Find the actual title with proper casing
+        actual_title = lexicon.titles[match]
+        if actual_title not in specific_movies:
+            specific_movies.append(actual_title)
 
     # Extract genres based on predefined list with genre_variations
+    genre_resolver = get_genre_resolver()
+    genre_tokens = []
     for token in doc:
         if token.is_stop or token.is_punct or token.like_num or len(token.text) < 3:
             continue  # Skip unwanted tokens
         if token.pos_ not in ['ADJ', 'NOUN']:
             continue  # Only consider adjectives and nouns
 
-        lemma = token.lemma_.lower()
-        if lemma in GENRES_LIST:
-            genres.append(lemma)
-        elif token.text.lower() in GENRE_VARIATIONS:
-            mapped_genre = GENRE_VARIATIONS[token.text.lower()]
-            genres.append(mapped_genre)
-        else:
-            # Apply fuzzy matching
-            closest_genre = get_closest_genre(token.text.lower())
-            if closest_genre:
-                genres.append(closest_genre)
+        # Exact genres, variations and misspellings come from a lookup table,
+        # anything else is fuzzy matched at most once per process
+        genre = genre_resolver.resolve(token.lemma_.lower(), token.text.lower())
+        if genre:
+            genre_tokens.append((token.i, genre))
+
+    # Negations stop at other entities, so they are resolved once every entity is known
+    entity_words = {doc[i].lower_ for i, _ in genre_tokens}
+    for name in actors + directors + specific_movies:
+        entity_words.update(query_words(normalize_string(name)))
+    for i, genre in genre_tokens:
+        preceding = [t.lower_ for t in doc[:i]]
+        (excluded_genres if is_negated(preceding, entity_words) else genres).append(genre)
 
     # Remove duplicates
-    genres = list(set(genres))
+    genres = list(set(genres) - set(excluded_genres))
+    excluded_genres = list(set(excluded_genres))
     specific_movies = list(set(specific_movies))
-    actors = list(set(actors))
-    directors = list(set(directors))
+    actors, excluded_actors = split_negated(list(set(actors)), query_normalized, entity_words)
+    directors, excluded_directors = split_negated(list(set(directors)), query_normalized, entity_words)
 
+    # Named genres, actors and directors are must constraints, the exclude_* ones must-not constraints
     parsed = {
         'genres': genres,
         'specific_movies': specific_movies,
         'actors': actors,
-        'directors': directors
+        'directors': directors,
+        'exclude_genres': excluded_genres,
+        'exclude_actors': excluded_actors,
+        'exclude_directors': excluded_directors,
     }
 
     # Log the parsed result for debugging
@@ -0,0 +1,97 @@
+# nancy/quantize.py
+"""
+Reduced-precision storage of latent vectors and neighbor scores.
+
+Ranking only needs a few significant digits, so the artifacts can hold float16
+values, or int8 values with one float32 scale per row (value * scale restores
+the row). Rows are dequantized to float32 block by block when scored, so the full
+precision array is never materialized.
+"""
+import numpy as np
+
+from .ranking import top_k
+
+QUANTIZE_NONE = 'none'
+QUANTIZE_FLOAT16 = 'float16'
+QUANTIZE_INT8 = 'int8'
+QUANTIZE_MODES = (QUANTIZE_NONE, QUANTIZE_FLOAT16, QUANTIZE_INT8)
+
+# Rows dequantized at once while scoring, small enough for the block to stay in cache
+DEQUANTIZE_BLOCK_SIZE = 1024
+
+
+def quantize(array, mode):
+    """
+    Return (values, scales) for a 2-D float array; scales is None unless mode is int8.
+    """
+    array = np.asarray(array, dtype=np.float32)
+    if mode == QUANTIZE_NONE:
+        return array, None
+    if mode == QUANTIZE_FLOAT16:
+        return array.astype(np.float16), None
+    if mode == QUANTIZE_INT8:
+        scales = np.abs(array).max(axis=1) / 127
+        scales[scales == 0] = 1
+        values = np.rint(array / scales[:, None]).astype(np.int8)
+        return values, scales.astype(np.float32)
+    raise ValueError(f"Unknown quantization: {mode}")
+
+
+def dequantize(values, scales=None, rows=None):
+    """
+    Float32 copy of `values` (or of the given rows of it).
+    """
+    if rows is not None:
+        values = values[rows]
+        scales = scales[rows] if scales is not None else None
+    dequantized = np.asarray(values, dtype=np.float32)
+    if scales is not None:
+        dequantized = dequantized * scales[:, None]
+    return dequantized
+
+
+def dot(values, vector, scales=None, rows=None):
+    """
+    Scores of a float32 `vector` against every row of `values` (or the given rows),
+    converting DEQUANTIZE_BLOCK_SIZE rows at a time into a reused float32 buffer.
+    Float32 values are scored directly. Row scales are applied to the scores,
+    not to the rows.
+    """
+    if rows is not None:
+        values = values[rows]
+        scales = scales[rows] if scales is not None else None
+    if values.dtype == np.float32:
+        scores = values @ vector
+    else:
+        scores = np.empty(len(values), dtype=np.float32)
+        buffer = np.empty((min(len(values), DEQUANTIZE_BLOCK_SIZE), values.shape[1]), dtype=np.float32)
+        for start in range(0, len(values), DEQUANTIZE_BLOCK_SIZE):
+            block = values[start:start + DEQUANTIZE_BLOCK_SIZE]
+            converted = buffer[:len(block)]
+            np.copyto(converted, block, casting='unsafe')
+            scores[start:start + len(block)] = converted @ vector
+    return scores * scales if scales is not None else scores
+
+
+def rank_agreement(reference, values, scales, queries, k=10):
+    """
+    Compare the top-k of every query row of `reference` (full precision, rows
+    L2-normalized) with the top-k computed from the quantized rows. Returns the
+    mean overlap of the two top-k sets, the share of queries ranked in exactly
+    the same order, and the largest score error.
+    """
+    overlaps, same_order, max_error = [], 0, 0.0
+    for row in queries:
+        vector = np.asarray(reference[row], dtype=np.float32)
+        exact = reference @ vector
+        approximate = dot(values, vector, scales)
+        expected, _ = top_k(exact, k, exclude=[row])
+        found, _ = top_k(approximate, k, exclude=[row])
+        overlaps.append(len(np.intersect1d(found, expected)) / max(len(expected), 1))
+        same_order += int(np.array_equal(found, expected))
+        max_error = max(max_error, float(np.abs(exact - approximate).max()))
+    return {
+        'overlap': float(np.mean(overlaps)),
+        'same_order': same_order / len(queries),
+        'max_error': max_error,
+    }
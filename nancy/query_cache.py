@@ -0,0 +1,111 @@
+# nancy/query_cache.py
+"""
+Cache of parsed queries and seeded recommendation results.
+
+Traffic is very repetitive, so the `parsed` dict of a query is kept in a Django
+cache (``NANCY_QUERY_CACHE_ALIAS``, a bounded LRU with a TTL by default) and
+shared by every process using the same backend. Keys include the catalog version
+and the version of the model artifacts the process serves, so adding movies or
+swapping in regenerated models makes old entries unreachable; they then age out
+through the TTL and LRU eviction.
+
+Recommendations are only cached when the client passes a `seed`, as they are
+then a pure function of the parsed entities, the seed and the limit.
+"""
+import hashlib
+import threading
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .registry import registry
+
+DEFAULT_QUERY_CACHE_ALIAS = 'nancy-queries'
+QUERY_CACHE_PREFIX = 'nancy:parsed'
+RECOMMENDATION_CACHE_PREFIX = 'nancy:recommended'
+# Models version of the keys while no versioned artifacts are loaded
+NO_MODELS_VERSION = 'none'
+
+
+def normalize_query(query):
+    """
+    Lowercase the query and collapse whitespace and trailing punctuation, so
+    "Tom Hardy movies!" and "tom hardy  movies" share an entry.
+    """
+    return ' '.join(query.strip().rstrip('.!?').lower().split())
+
+
+def get_models_version():
+    """
+    Version of the model artifacts loaded in this process (from their manifest),
+    so it changes exactly when ModelReloader swaps in a new version.
+    """
+    artifacts = registry.peek('artifacts')
+    return (artifacts.version if artifacts is not None else None) or NO_MODELS_VERSION
+
+
+class QueryCache:
+    """
+    Values stored in a Django cache under versioned keys, with per-process
+    hit/miss counters. Used for parsed queries and for recommendation results.
+    """
+
+    def __init__(self, prefix=QUERY_CACHE_PREFIX, alias=None):
+        self.prefix = prefix
+        self.alias = alias
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @property
+    def cache(self):
+        return caches[self.alias or getattr(settings, 'NANCY_QUERY_CACHE_ALIAS', DEFAULT_QUERY_CACHE_ALIAS)]
+
+    def key(self, text, catalog_version, models_version):
+        # Hash the text so keys stay short and free of spaces (memcached rejects both)
+        digest = hashlib.sha1(text.encode('utf-8')).hexdigest()
+        return f'{self.prefix}:{catalog_version}:{models_version}:{digest}'
+
+    def _count(self, hits, misses):
+        with self._lock:
+            self.hits += hits
+            self.misses += misses
+
+    def get_many(self, queries, catalog):
+        """
+        Return the list of keys for `queries` and a dict of the cached parsed
+        results by key.
+        """
+        models_version = get_models_version()
+        keys = [self.key(normalize_query(query), catalog.version, models_version) for query in queries]
+        found = self.cache.get_many(set(keys))
+        hits = sum(1 for key in keys if key in found)
+        self._count(hits, len(keys) - hits)
+        return keys, found
+
+    def set_many(self, values_by_key):
+        self.cache.set_many(values_by_key)
+
+    def get(self, text, catalog):
+        """
+        Return the key for `text` and the cached value, or None.
+        """
+        key = self.key(text, catalog.version, get_models_version())
+        value = self.cache.get(key)
+        self._count(int(value is not None), int(value is None))
+        return key, value
+
+    def set(self, key, value):
+        self.cache.set(key, value)
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / total if total else None,
+        }
+
+
+query_cache = QueryCache()
+recommendation_cache = QueryCache(RECOMMENDATION_CACHE_PREFIX)
@@ -0,0 +1,68 @@
+# nancy/ranking.py
+import numpy as np
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+# Values of the NANCY_RANKING_INDEX setting: the sparse TF-IDF postings or the latent vectors
+RANKING_TFIDF = 'tfidf'
+RANKING_LATENT = 'latent'
+RANKING_INDEXES = (RANKING_TFIDF, RANKING_LATENT)
+
+
+def get_ranking_index():
+    """
+    The NANCY_RANKING_INDEX setting, checked once when the app starts and when artifacts are loaded.
+    """
+    ranking_index = getattr(settings, 'NANCY_RANKING_INDEX', RANKING_TFIDF)
+    if ranking_index not in RANKING_INDEXES:
+        raise ImproperlyConfigured(
+            f"NANCY_RANKING_INDEX must be one of {', '.join(RANKING_INDEXES)}, not {ranking_index!r}"
+        )
+    return ranking_index
+
+
+def top_k_batch(score_rows, k, exclude=None):
+    """
+    Select the k highest scores of every row of a 2-D score array.
+
+    Uses argpartition so each row costs O(n) instead of a full sort. Results are
+    ordered best first and ties are broken by the lower column index, so the same
+    scores always give the same ranking. Columns listed in `exclude` (e.g. the seed
+    movies themselves) are never returned.
+
+    Returns a (ids, scores) pair of arrays shaped (rows, k'), with k' <= k.
+    """
+    scores = np.array(score_rows, dtype=np.float64, ndmin=2)
+    n_rows, n_cols = scores.shape
+    excluded = np.unique(np.asarray(list(exclude) if exclude is not None else [], dtype=np.intp))
+    if excluded.size:
+        scores[:, excluded] = -np.inf
+
+    k = min(k, n_cols - excluded.size)
+    if k <= 0 or n_rows == 0:
+        return np.empty((n_rows, 0), dtype=np.intp), np.empty((n_rows, 0), dtype=np.float64)
+
+    # Value of the k-th best score of every row, found in linear time
+    if k < n_cols:
+        partition = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        kth_scores = np.take_along_axis(scores, partition, axis=1).min(axis=1)
+    else:
+        kth_scores = scores.min(axis=1)
+
+    # Everything scoring at least the k-th value is a candidate; only ties make
+    # this more than k entries, so the per-row sort below stays tiny.
+    candidates = scores >= kth_scores[:, None]
+    ids = np.empty((n_rows, k), dtype=np.intp)
+    for row in range(n_rows):
+        columns = np.flatnonzero(candidates[row])
+        order = np.lexsort((columns, -scores[row, columns]))[:k]
+        ids[row] = columns[order]
+    return ids, np.take_along_axis(scores, ids, axis=1)
+
+
+def top_k(scores, k, exclude=None):
+    """
+    Single-row version of top_k_batch. Returns (ids, scores) 1-D arrays.
+    """
+    ids, top_scores = top_k_batch(np.asarray(scores)[None, :], k, exclude=exclude)
+    return ids[0], top_scores[0]
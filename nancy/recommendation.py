@@ -1,100 +1,180 @@
 # nancy/recommendation.py
-import pickle
-from django.conf import settings
-import os
-from .models import Movie
-import pandas as pd
-from .nlp_utils import normalize_string
+from .bitset import RowSet, all_of, any_of
+from .lexicon import normalize_string
+from .query_cache import recommendation_cache
+from .registry import registry
+import json
+import logging
 import random
+import numpy as np
 
-# Initialize a dictionary to hold models
-MODELS = {}
+logger = logging.getLogger(__name__)
 
-def load_models():
+
+def get_artifacts():
     """
-    Load pre-trained models from the ml_models directory.
+    Return the pre-trained model artifacts, opening them on first use.
+    Returns None when they are not available so callers can degrade gracefully.
     """
-    model_dir = os.path.join(settings.BASE_DIR, 'nancy', 'ml_models')
     try:
-        with open(os.path.join(model_dir, 'cosine_sim.pkl'), 'rb') as f:
-            MODELS['cosine_sim'] = pickle.load(f)
-        with open(os.path.join(model_dir, 'df_movies.pkl'), 'rb') as f:
-            MODELS['df_movies'] = pickle.load(f)
-        with open(os.path.join(model_dir, 'indices.pkl'), 'rb') as f:
-            MODELS['indices'] = pickle.load(f)
-        with open(os.path.join(model_dir, 'tfidf_vectorizer.pkl'), 'rb') as f:
-            MODELS['tfidf'] = pickle.load(f)
-        print("Pre-trained models loaded successfully.")
+        return registry.get('artifacts')
     except Exception as e:
-        print(f"Error loading models: {e}")
+        logger.error(f"Error loading models: {e}")
+        return None
+
+
+# Number of similar movies taken for every seed movie named in the query
+SEED_NEIGHBORS = 10
+# Number of movies picked per genre, actor and director constraint in the query
+ENTITY_PICKS = 10
+
+# Parsed query keys and the movie field each of them is matched against: the
+# movies must match the first ones (must constraints) and none of the exclude_* ones
+ENTITY_FIELDS = (
+    ('genres', 'genres'),
+    ('actors', 'actors'),
+    ('directors', 'directors'),
+)
+EXCLUDE_FIELDS = (
+    ('exclude_genres', 'genres'),
+    ('exclude_actors', 'actors'),
+    ('exclude_directors', 'directors'),
+)
+# Parsed query keys that determine the recommendations
+ENTITY_KEYS = (
+    'genres', 'specific_movies', 'actors', 'directors', 'exclude_genres', 'exclude_actors', 'exclude_directors'
+)
+
+# How recommendations were found: from the parsed entities, or by matching the
+# query text against movie descriptions when it names none
+MODE_ENTITIES = 'entities'
+MODE_DESCRIPTION = 'description'
+RECOMMENDATION_MODES = (MODE_ENTITIES, MODE_DESCRIPTION)
+
+
+def _pick_random(rows, count, rng=random):
+    """
+    Pick up to `count` random entries of a row array without copying or shuffling it.
+    Only the `count` sampled positions are drawn, whatever the number of rows.
+    """
+    if len(rows) <= count:
+        return rows
+    return rows[sorted(rng.sample(range(len(rows)), count))]
 
-# Load models when the module is imported
-load_models()
 
-def generate_recommendations(parsed_query):
+def constraint_levels(includes, excludes, n_rows):
+    """
+    Resolve must (`includes`) and must-not (`excludes`) constraints, given as
+    RowSets, into the candidate movies from best to worst: the movies matching
+    every include, or when there are none, those matching all includes but one,
+    then all but two, and so on. Excluded movies are never candidates.
+    """
+    excluded = any_of(excludes, n_rows)
+    strict = all_of(includes, n_rows) - excluded
+    if strict or len(includes) < 2:
+        return [strict]
+    union = (any_of(includes, n_rows) - excluded).to_rows()
+    matched = np.sum([row_set.contains(union) for row_set in includes], axis=0)
+    return [RowSet(n_rows, rows=union[matched == level]) for level in range(len(includes) - 1, 0, -1)]
+
+
+def generate_recommendations(parsed_query, catalog, neighbors_per_seed=SEED_NEIGHBORS, seed=None):
     """
     Generates a list of recommended movies based on the parsed query.
-    Introduces randomness to provide varied recommendations.
+    Introduces randomness to provide varied recommendations; pass `seed` to make
+    the picks repeatable for a given catalog and set of models.
+
+    Several seed movies are matched together, against the centroid of their TF-IDF
+    vectors, rather than by merging each seed's own neighbor list.
+
+    Genre, actor and director constraints are resolved with the row sets of the
+    model artifacts' inverted index; the catalog snapshot is scanned instead when no
+    artifacts are available. Only movies matching every named genre, actor and
+    director, and none of the excluded ones, are picked (falling back to those
+    matching the most of them when none match all), ranked by similarity to the
+    named movies if any, at random otherwise. With only exclusions, the picks are
+    made among every movie not excluded.
     """
-    recommendations = set()
-
-    # Recommend based on specific movies
-    specific_movies = parsed_query.get('specific_movies', [])
-    if specific_movies and all(k in MODELS for k in ('cosine_sim', 'df_movies', 'indices')):
-        cosine_sim = MODELS['cosine_sim']
-        df_movies = MODELS['df_movies']
-        indices = MODELS['indices']
-        for movie in specific_movies:
-            movie_normalized = normalize_string(movie)
-            if movie_normalized in indices:
-                idx = indices[movie_normalized]
-                sim_scores = list(enumerate(cosine_sim[idx]))
-                sim_scores = sorted(sim_scores, key=lambda x: x[1], reverse=True)
-                sim_scores = sim_scores[1:11]  # Exclude the movie itself
-                for i, score in sim_scores:
-                    recommendations.add(df_movies.iloc[i]['title'])
-
-    # Recommend based on genres with randomness
-    genres = parsed_query.get('genres', [])
-    if genres and 'df_movies' in MODELS:
-        df_movies = MODELS['df_movies']
-        for genre in genres:
-            genre_recs = df_movies[df_movies['genres'].str.contains(genre, case=False, na=False)]['title'].tolist()
-            if genre_recs:
-                # Shuffle the list to introduce randomness
-                random.shuffle(genre_recs)
-                # Select a subset (e.g., first 10 after shuffling)
-                selected_genre_recs = genre_recs[:10]
-                recommendations.update(selected_genre_recs)
-
-    # Recommend based on actors with randomness
-    actors = parsed_query.get('actors', [])
-    if actors and 'df_movies' in MODELS:
-        df_movies = MODELS['df_movies']
-        for actor in actors:
-            actor_recs = df_movies[df_movies['actors'].str.contains(actor, case=False, na=False)]['title'].tolist()
-            if actor_recs:
-                # Shuffle the list to introduce randomness
-                random.shuffle(actor_recs)
-                # Select a subset (e.g., first 10 after shuffling)
-                selected_actor_recs = actor_recs[:10]
-                recommendations.update(selected_actor_recs)
-
-    # Recommend based on directors with randomness
-    directors = parsed_query.get('directors', [])
-    if directors and 'df_movies' in MODELS:
-        df_movies = MODELS['df_movies']
-        for director in directors:
-            director_recs = df_movies[df_movies['directors'].str.contains(director, case=False, na=False)]['title'].tolist()
-            if director_recs:
-                # Shuffle the list to introduce randomness
-                random.shuffle(director_recs)
-                # Select a subset (e.g., first 10 after shuffling)
-                selected_director_recs = director_recs[:10]
-                recommendations.update(selected_director_recs)
+    rng = random.Random(seed) if seed is not None else random
+    # Ordered, duplicate-free collection of recommended titles
+    recommendations = {}
+
+    # Recommend based on specific movies (sorted, as parsing returns them in set order)
+    specific_movies = sorted(parsed_query.get('specific_movies', []))
+    artifacts = get_artifacts()
+    source = artifacts if artifacts is not None else catalog
+    n_rows = len(source.titles)
+    excludes = [
+        source.entity_set(field, value) for key, field in EXCLUDE_FIELDS for value in sorted(parsed_query.get(key, []))
+    ]
+    excluded = any_of(excludes, n_rows)
 
+    seed_indices = []
+    if specific_movies and artifacts is not None:
+        seed_indices = [
+            index for index in (artifacts.title_index(normalize_string(movie)) for movie in specific_movies)
+            if index is not None
+        ]
+        if len(seed_indices) > 1 and artifacts.has_vectors:
+            # Movies similar to all the seeds together, ranked in one pass against their centroid
+            neighbor_ids, _ = artifacts.similar_to_seeds(seed_indices, neighbors_per_seed * len(seed_indices))
+            neighbor_lists = [neighbor_ids]
+        else:
+            # Precomputed top-K lists, never returning a seed itself
+            neighbors = artifacts.neighbors.neighbors(seed_indices, neighbors_per_seed, exclude=seed_indices)
+            neighbor_lists = [neighbor_ids for neighbor_ids, _ in neighbors]
+        for neighbor_ids in neighbor_lists:
+            neighbor_ids = neighbor_ids[~excluded.contains(neighbor_ids)]
+            recommendations.update(dict.fromkeys(artifacts.titles[i] for i in neighbor_ids))
+
+    # Recommend movies satisfying the genre, actor and director constraints
+    includes = [
+        source.entity_set(field, value) for key, field in ENTITY_FIELDS for value in sorted(parsed_query.get(key, []))
+    ]
+    remaining = ENTITY_PICKS * max(len(includes), 1)
+    for candidates in (constraint_levels(includes, excludes, n_rows) if includes or excludes else []):
+        if remaining <= 0:
+            break
+        rows = []
+        if seed_indices and artifacts.has_vectors:
+            rows, _ = artifacts.similar_to_seeds(seed_indices, remaining, candidates=candidates)
+        if not len(rows):
+            rows = _pick_random(candidates.to_rows(), remaining, rng)
+        recommendations.update(dict.fromkeys(source.titles[i] for i in rows))
+        remaining -= len(rows)
 
     for movie in specific_movies:
-        recommendations.discard(movie)
+        recommendations.pop(movie, None)
 
     return list(recommendations)
+
+
+def recommend(parsed_query, catalog, limit, seed=None):
+    """
+    Return the first `limit` recommendations for a parsed query.
+
+    With a `seed` the result only depends on the parsed entities, the seed and the
+    limit (for a given catalog and models version), so it is served from the
+    recommendation cache when the same combination was asked for before.
+    """
+    if seed is None:
+        return generate_recommendations(parsed_query, catalog)[:limit]
+
+    entities = {key: sorted(parsed_query.get(key, [])) for key in ENTITY_KEYS}
+    key, recommendations = recommendation_cache.get(json.dumps([entities, seed, limit], sort_keys=True), catalog)
+    if recommendations is None:
+        recommendations = generate_recommendations(parsed_query, catalog, seed=seed)[:limit]
+        recommendation_cache.set(key, recommendations)
+    return recommendations
+
+
+def search_descriptions(query, limit):
+    """
+    Titles of the movies whose description best matches the free-text query,
+    best first. Empty when no artifacts are available or nothing matches.
+    """
+    artifacts = get_artifacts()
+    if artifacts is None:
+        return []
+    rows, _ = artifacts.search(query, limit)
+    return [artifacts.titles[row] for row in rows]
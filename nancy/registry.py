@@ -0,0 +1,267 @@
+# nancy/registry.py
+"""
+Lazily loaded resources of the recommender (spaCy pipeline, genre table, model artifacts).
+
+Nothing is loaded at import time, so management commands such as ``migrate`` do not
+pay for models they never use. Resources load on first use, or up front through
+``warm_up()`` (the ``warmup`` command, or ``NANCY_WARM_UP_ON_START`` for servers).
+"""
+import logging
+import threading
+import time
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+SPACY_MODEL = 'en_core_web_sm'
+
+
+class LazyResource:
+    """
+    A resource built by `loader` on first access, remembering how long that took.
+    """
+
+    # Seconds to wait before trying again after a failed load
+    RETRY_SECONDS = 30
+
+    def __init__(self, name, loader):
+        self.name = name
+        self.loader = loader
+        self.loaded = False
+        self.load_seconds = None
+        self.error = None
+        self._value = None
+        self._exception = None
+        self._failed_at = None
+        self._lock = threading.Lock()
+
+    def get(self):
+        if self.loaded:
+            return self._value
+        with self._lock:
+            if not self.loaded:
+                # Do not hit a missing file on every request, re-raise the last failure for a while
+                if self._failed_at is not None and time.monotonic() - self._failed_at < self.RETRY_SECONDS:
+                    raise self._exception
+                start = time.perf_counter()
+                try:
+                    self._value = self.loader()
+                except Exception as e:
+                    self.error = f"{type(e).__name__}: {e}"
+                    self._exception = e
+                    self._failed_at = time.monotonic()
+                    raise
+                self.load_seconds = time.perf_counter() - start
+                self.error = None
+                self._exception = None
+                self._failed_at = None
+                self.loaded = True
+                logger.info(f"Loaded {self.name} in {self.load_seconds:.3f}s")
+        return self._value
+
+    def peek(self):
+        """
+        The loaded value, or None, without triggering a load.
+        """
+        return self._value if self.loaded else None
+
+    def replace(self, value):
+        """
+        Swap in a new value. Callers holding the old one keep using it until they
+        fetch the resource again, i.e. until their next request.
+        """
+        with self._lock:
+            self._value = value
+            self.error = None
+            self._exception = None
+            self._failed_at = None
+            self.loaded = True
+
+    def status(self):
+        status = {
+            'loaded': self.loaded,
+            'load_seconds': self.load_seconds,
+            'error': self.error,
+        }
+        # Resources keeping counters (e.g. cache hits) report them as well
+        if self.loaded and hasattr(self._value, 'stats'):
+            status['stats'] = self._value.stats()
+        return status
+
+
+class ResourceRegistry:
+    """
+    Named collection of LazyResource objects.
+    """
+
+    def __init__(self):
+        self._resources = {}
+
+    def register(self, name, loader):
+        self._resources[name] = LazyResource(name, loader)
+
+    def get(self, name):
+        return self._resources[name].get()
+
+    def peek(self, name):
+        return self._resources[name].peek()
+
+    def replace(self, name, value):
+        self._resources[name].replace(value)
+
+    def names(self):
+        return list(self._resources)
+
+    def warm_up(self, names=None):
+        """
+        Load the given resources (all by default). Failures are logged, not raised,
+        and show up in status().
+        """
+        for name in names or self.names():
+            try:
+                self.get(name)
+            except Exception as e:
+                logger.error(f"Could not load {name}: {e}")
+        return self.status()
+
+    def status(self):
+        return {name: resource.status() for name, resource in self._resources.items()}
+
+    def is_ready(self):
+        return all(resource.loaded for resource in self._resources.values())
+
+
+def _load_nlp():
+    import os
+    import spacy
+    from .entity_ruler import get_catalog_pipeline_dir
+    # Prefer the pipeline saved with the catalog entity ruler by regenerate_models
+    pipeline_dir = get_catalog_pipeline_dir()
+    if os.path.isdir(pipeline_dir):
+        return spacy.load(pipeline_dir)
+    return spacy.load(SPACY_MODEL)
+
+
+def _load_genres():
+    from .nlp_utils import GENRE_VARIATIONS, GENRES_LIST, GenreResolver
+    return GenreResolver(GENRES_LIST, GENRE_VARIATIONS)
+
+
+def _load_artifacts():
+    from .artifacts import load_artifacts
+    return load_artifacts()
+
+
+registry = ResourceRegistry()
+registry.register('nlp', _load_nlp)
+registry.register('genres', _load_genres)
+registry.register('artifacts', _load_artifacts)
+
+
+# Seconds between two checks for a newly published artifact version
+MODELS_CHECK_INTERVAL = 5.0
+
+
+class ModelReloader:
+    """
+    Swaps the artifacts (and the SpaCy pipeline saved with them) of a registry to
+    the published version once regenerate_models has switched the CURRENT pointer.
+
+    check() is cheap and meant to be called at the start of every request. The
+    new version is loaded and warmed up in a background thread while requests keep
+    using the old one, and the next check() swaps it in, so there is no restart
+    and no cold start.
+    """
+
+    def __init__(self, registry, root=None, interval=None):
+        self.registry = registry
+        self.root = root
+        self.interval = interval
+        self._checked_at = None
+        self._failed_version = None
+        self._pending = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def check(self):
+        # The reload thread publishes under the same lock, so a load is swapped in exactly once
+        with self._lock:
+            pending, self._pending = self._pending, None
+        if pending is not None:
+            self._swap(*pending)
+
+        interval = self.interval if self.interval is not None else getattr(
+            settings, 'NANCY_MODELS_CHECK_INTERVAL', MODELS_CHECK_INTERVAL
+        )
+        now = time.monotonic()
+        if self._checked_at is not None and now - self._checked_at < interval:
+            return
+        self._checked_at = now
+
+        from .artifacts import current_version
+        loaded = self.registry.peek('artifacts')
+        version = current_version(self.root)
+        # Artifacts not loaded yet will load the current version on first use
+        if loaded is None or version is None or version in (loaded.version, self._failed_version):
+            return
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self.reload, args=(version,), name='nancy-model-reload', daemon=True
+                )
+                self._thread.start()
+
+    def reload(self, version):
+        import os
+        from .artifacts import get_version_dir, load_artifacts
+        from .entity_ruler import get_catalog_pipeline_dir
+        directory = get_version_dir(version, self.root)
+        start = time.perf_counter()
+        try:
+            artifacts = load_artifacts(directory)
+            nlp = None
+            pipeline_dir = get_catalog_pipeline_dir(directory)
+            # A pipeline that was never loaded will be loaded from the new version anyway
+            if self.registry.peek('nlp') is not None and os.path.isdir(pipeline_dir):
+                import spacy
+                nlp = spacy.load(pipeline_dir)
+                nlp('warm up')
+        except Exception as e:
+            logger.error(f"Could not load artifact version {version}: {e}")
+            self._failed_version = version
+            return
+        logger.info(f"Loaded artifact version {version} in {time.perf_counter() - start:.3f}s")
+        with self._lock:
+            self._pending = (version, artifacts, nlp)
+
+    def _swap(self, version, artifacts, nlp):
+        if nlp is not None:
+            self.registry.replace('nlp', nlp)
+        # Cached queries and recommendations are keyed on the version of the
+        # artifacts (see nancy.query_cache), so this also moves them to a new namespace
+        self.registry.replace('artifacts', artifacts)
+        logger.info(f"Swapped to artifact version {version}")
+
+
+reloader = ModelReloader(registry)
+
+
+def refresh_models():
+    """
+    Pick up a newly published artifact version, see ModelReloader.
+    """
+    reloader.check()
+
+
+def warm_up(names=None):
+    return registry.warm_up(names)
+
+
+def warm_up_on_start():
+    """
+    Start warming every resource in a background thread when NANCY_WARM_UP_ON_START
+    is set. Called from the WSGI/ASGI entry points, so management commands never do it.
+    """
+    if getattr(settings, 'NANCY_WARM_UP_ON_START', False):
+        threading.Thread(target=warm_up, name='nancy-warm-up', daemon=True).start()
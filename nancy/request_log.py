@@ -0,0 +1,153 @@
+# nancy/request_log.py
+"""
+Write-behind logging of RecommendationRequest rows.
+
+Answering a request used to include a synchronous INSERT, which on SQLite waits for
+the database write lock. Records are now queued in memory and a background thread
+inserts them with bulk_create once enough of them are waiting or a few seconds
+have passed. The queue is bounded: when the database cannot keep up, new records
+are dropped and counted instead of slowing requests down. Whatever is queued is
+flushed when the process exits.
+"""
+import atexit
+import logging
+import queue
+import threading
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from .models import RecommendationRequest
+
+logger = logging.getLogger(__name__)
+
+# Defaults for the NANCY_REQUEST_LOG_* settings
+DEFAULT_MAX_QUEUE = 10000
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_FLUSH_INTERVAL = 2.0
+
+
+class RequestLogWriter:
+    """
+    Bounded in-memory queue of RecommendationRequest objects flushed in bulk.
+    """
+
+    def __init__(self, max_queue=DEFAULT_MAX_QUEUE, batch_size=DEFAULT_BATCH_SIZE,
+                 flush_interval=DEFAULT_FLUSH_INTERVAL, buffered=True):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.buffered = buffered
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._wake = threading.Event()
+        self._flush_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._thread = None
+        self._thread_lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls):
+        return cls(
+            max_queue=getattr(settings, 'NANCY_REQUEST_LOG_MAX_QUEUE', DEFAULT_MAX_QUEUE),
+            batch_size=getattr(settings, 'NANCY_REQUEST_LOG_BATCH_SIZE', DEFAULT_BATCH_SIZE),
+            flush_interval=getattr(settings, 'NANCY_REQUEST_LOG_FLUSH_INTERVAL', DEFAULT_FLUSH_INTERVAL),
+            buffered=getattr(settings, 'NANCY_REQUEST_LOG_BUFFERED', True),
+        )
+
+    def log(self, query, limit, recommendations):
+        """
+        Record an answered request. Never raises and never waits for the database
+        when buffering is on.
+        """
+        self.log_many([RecommendationRequest(
+            query=query,
+            limit=limit,
+            recommendations=', '.join(recommendations)
+        )])
+
+    def log_many(self, records):
+        if not records:
+            return
+        if not self.buffered:
+            self._write(records)
+            return
+
+        for record in records:
+            try:
+                self._queue.put_nowait(record)
+            except queue.Full:
+                with self._stats_lock:
+                    self.dropped += 1
+        self._ensure_started()
+        if self._queue.qsize() >= self.batch_size:
+            self._wake.set()
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._thread_lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='nancy-request-log', daemon=True)
+                self._thread.start()
+                atexit.register(self.flush)
+
+    def _run(self):
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+            # The thread owns a database connection, do not let it go stale
+            close_old_connections()
+
+    def flush(self):
+        """
+        Insert everything queued so far, batch_size rows per statement.
+        """
+        with self._flush_lock:
+            while True:
+                batch = []
+                while len(batch) < self.batch_size:
+                    try:
+                        batch.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                if not batch:
+                    return
+                self._write(batch)
+
+    def _write(self, records):
+        try:
+            RecommendationRequest.objects.bulk_create(records)
+        except Exception as e:
+            logger.error(f"Could not log {len(records)} recommendation requests: {e}")
+            with self._stats_lock:
+                self.failed += len(records)
+        else:
+            with self._stats_lock:
+                self.written += len(records)
+
+    def stats(self):
+        return {
+            'queued': self._queue.qsize(),
+            'written': self.written,
+            'dropped': self.dropped,
+            'failed': self.failed,
+        }
+
+
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def get_request_log():
+    """
+    Return the process-wide request log writer, configured from the settings.
+    """
+    global _writer
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = RequestLogWriter.from_settings()
+    return _writer
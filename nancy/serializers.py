@@ -1,6 +1,8 @@
 # nancy/serializers.py
 from rest_framework import serializers
 from .models import Movie
+from .nlp_utils import DEFAULT_PIPE_BATCH_SIZE
+from .recommendation import RECOMMENDATION_MODES
 
 class MovieSerializer(serializers.ModelSerializer):
     class Meta:
@@ -18,11 +20,57 @@ class RecommendationRequestSerializer(serializers.Serializer):
         min_value=1,
         help_text="Number of recommendations to return. Defaults to 10."
     )
+    seed = serializers.IntegerField(
+        required=False,
+        min_value=0,
+        help_text="Seed for the random picks. The same query, seed and limit return the same (cached) recommendations; "
+                  "use a different seed for a different selection."
+    )
 
 class RecommendationResponseSerializer(serializers.Serializer):
     query = serializers.CharField()
     limit = serializers.IntegerField()
+    seed = serializers.IntegerField(required=False)
     parsed = serializers.DictField(
         child=serializers.ListField(child=serializers.CharField())
     )
     recommendations = serializers.ListField(child=serializers.CharField())
+    mode = serializers.ChoiceField(
+        choices=RECOMMENDATION_MODES,
+        help_text="'entities' when recommendations come from the parsed entities, "
+                  "'description' when the query was matched against movie descriptions instead."
+    )
+
+class BatchRecommendationRequestSerializer(serializers.Serializer):
+    queries = serializers.ListField(
+        child=serializers.CharField(),
+        min_length=1,
+        max_length=100,
+        help_text="User queries for movie recommendations, answered in the same order."
+    )
+    limit = serializers.IntegerField(
+        required=False,
+        default=10,
+        min_value=1,
+        help_text="Number of recommendations to return per query. Defaults to 10."
+    )
+    batch_size = serializers.IntegerField(
+        required=False,
+        default=DEFAULT_PIPE_BATCH_SIZE,
+        min_value=1,
+        max_value=1000,
+        help_text=f"Number of queries SpaCy parses per batch. Defaults to {DEFAULT_PIPE_BATCH_SIZE}."
+    )
+
+class BatchRecommendationResultSerializer(serializers.Serializer):
+    query = serializers.CharField()
+    parsed = serializers.DictField(
+        child=serializers.ListField(child=serializers.CharField())
+    )
+    recommendations = serializers.ListField(child=serializers.CharField())
+    mode = serializers.ChoiceField(choices=RECOMMENDATION_MODES, required=False)
+    detail = serializers.CharField(required=False)
+
+class BatchRecommendationResponseSerializer(serializers.Serializer):
+    limit = serializers.IntegerField()
+    results = BatchRecommendationResultSerializer(many=True)
@@ -0,0 +1,23 @@
+# nancy/signals.py
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .catalog import bump_catalog_version
+from .models import Movie
+
+
+@receiver(post_save, sender=Movie)
+def movie_saved(sender, instance, created, **kwargs):
+    """
+    Invalidate the catalog snapshot whenever a movie is created or updated.
+    New movies only extend the snapshot, updates force a rebuild.
+    """
+    bump_catalog_version(appended_only=created)
+
+
+@receiver(post_delete, sender=Movie)
+def movie_deleted(sender, instance, **kwargs):
+    """
+    Invalidate the catalog snapshot whenever a movie is removed.
+    """
+    bump_catalog_version()
@@ -1,9 +1,73 @@
 # nancy/tests.py
-from django.test import TestCase
+import io
+import os
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+import spacy
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from fuzzywuzzy import process
+from scipy import sparse
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.metrics.pairwise import cosine_similarity
 from django.urls import reverse
 from rest_framework import status
 from rest_framework.test import APIClient
-from .models import Movie
+from .artifacts import (
+    current_version,
+    get_current_dir,
+    load_artifacts,
+    new_artifact_version,
+    prune_versions,
+    verify_artifacts,
+    write_artifacts,
+)
+from .bitset import RowSet, all_of, any_of
+from .catalog import get_catalog, get_catalog_version, stream_columns, stream_descriptions
+from .entity_ruler import add_catalog_ruler, has_catalog_entities, save_catalog_pipeline
+from .inverted_index import InvertedIndex
+from .ann import IVFIndex, evaluate
+from .latent import LatentIndex
+from .lexicon import LEXICON_FILENAME, EntityLexicon, get_lexicon_path, normalize_string
+from .nlp_utils import (
+    GENRE_VARIATIONS,
+    GENRES_LIST,
+    GenreResolver,
+    is_negated,
+    parse_doc,
+    parse_queries,
+    query_words,
+)
+from .query_cache import QueryCache, get_models_version, recommendation_cache
+from .recommendation import constraint_levels, generate_recommendations
+from .matching import AhoCorasick
+from .models import CatalogVersion, Movie, RecommendationRequest
+from .neighbors import build_neighbor_index, update_neighbor_index
+from .quantize import dequantize, quantize, rank_agreement
+from .ranking import top_k, top_k_batch
+from .registry import ModelReloader, ResourceRegistry
+from .request_log import RequestLogWriter
+from .trigram import TrigramIndex
+
+# Lexicon read by catalog snapshots, instead of the one of the repository's published artifacts
+LEXICON_DIR = tempfile.mkdtemp()
+
+
+def setUpModule():
+    patcher = mock.patch(
+        'nancy.lexicon.get_lexicon_path',
+        lambda artifacts_dir=None: os.path.join(artifacts_dir or LEXICON_DIR, LEXICON_FILENAME),
+    )
+    patcher.start()
+    unittest.addModuleCleanup(patcher.stop)
+    unittest.addModuleCleanup(shutil.rmtree, LEXICON_DIR, ignore_errors=True)
 
 class RecommendMoviesAPITest(TestCase):
     def setUp(self):
@@ -42,3 +106,831 @@ class RecommendMoviesAPITest(TestCase):
         response = self.client.post(self.url, data=self.invalid_payload, format='json')
         self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
         self.assertIn('error', response.data)
+
+
+class CatalogSnapshotTest(TestCase):
+    def setUp(self):
+        Movie.objects.create(
+            title="Snapshot Movie",
+            description="A movie used to test catalog snapshots.",
+            genres="drama",
+            actors="Actor A",
+            directors="Director X"
+        )
+
+    def test_snapshot_is_reused_until_catalog_changes(self):
+        snapshot = get_catalog()
+        self.assertIs(get_catalog(), snapshot)
+        self.assertEqual(len(snapshot), 1)
+
+        Movie.objects.create(title="Another Snapshot Movie")
+        rebuilt = get_catalog()
+        self.assertIsNot(rebuilt, snapshot)
+        self.assertNotEqual(rebuilt.version, snapshot.version)
+        self.assertEqual(len(rebuilt), 2)
+        # Requests never write the lexicon, regenerate_models does
+        self.assertEqual(os.listdir(LEXICON_DIR), [])
+
+    def test_deleting_a_movie_bumps_the_version(self):
+        version = get_catalog_version()
+        Movie.objects.all().delete()
+        self.assertNotEqual(get_catalog_version(), version)
+        self.assertEqual(len(get_catalog()), 0)
+
+    def test_version_is_kept_in_the_database(self):
+        # Another worker only shares the database, not this process's cache
+        version = get_catalog_version()
+        cache.clear()
+        self.assertEqual(get_catalog_version(), version)
+        self.assertEqual(CatalogVersion.objects.get().version, version)
+
+        Movie.objects.create(title="Appended Snapshot Movie")
+        self.assertEqual(CatalogVersion.objects.get().version, version + 1)
+
+
+class CatalogStreamingTest(TestCase):
+    def test_columns_and_descriptions_stay_aligned(self):
+        heat = Movie.objects.create(title="Heat", description="A heist.", actors="Al Pacino")
+        venom = Movie.objects.create(title="Venom", actors="Tom Hardy")
+        locke = Movie.objects.create(title="Locke", description="A drive.")
+
+        columns = stream_columns(Movie.objects.all(), ('id', 'title', 'actors'), chunk_size=2)
+        self.assertEqual(columns['id'].tolist(), [heat.id, venom.id, locke.id])
+        self.assertEqual(columns['actors'].tolist(), ["Al Pacino", "Tom Hardy", None])
+
+        venom.delete()
+        self.assertEqual(list(stream_descriptions(columns['id'], chunk_size=2)), ["A heist.", "", "A drive."])
+
+
+class EntityLexiconTest(TestCase):
+    def test_resolves_normalized_names_to_canonical_form(self):
+        lexicon = EntityLexicon(1)
+        lexicon.add_movie("Spider-Man", "Tobey Maguire, Kirsten Dunst", "Sam Raimi & Someone Else")
+        lexicon.add_movie("Spiderman", "tobey maguire", None)
+
+        self.assertEqual(lexicon.titles['spiderman'], "Spider-Man")
+        self.assertEqual(lexicon.actors['tobey maguire'], "Tobey Maguire")
+        self.assertEqual(lexicon.directors['someone else'], "Someone Else")
+
+    def test_persisted_lexicon_is_reused_for_the_same_version(self):
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            path = os.path.join(tmp_dir, 'lexicon.json')
+            built = EntityLexicon(7, titles={'heat': 'Heat'})
+            built.save(path)
+
+            self.assertEqual(EntityLexicon.for_catalog(7, None, path=path).titles, {'heat': 'Heat'})
+
+
+class EntityMatcherTest(TestCase):
+    def test_automaton_matches_plain_substring_search(self):
+        patterns = ['tom hardy', 'tom', 'hardy', 'spiderman', 'man', 'spiderman 2', 'he']
+        automaton = AhoCorasick((pattern, pattern) for pattern in patterns)
+        text = 'hey nancy, tom hardy movies like spiderman 2'
+
+        found = {payload for _, _, payload in automaton.iter_matches(text)}
+        self.assertEqual(found, {pattern for pattern in patterns if pattern in text})
+
+        whole_words = {payload for _, _, payload in automaton.iter_matches(text, whole_words=True)}
+        self.assertEqual(whole_words, {'tom hardy', 'tom', 'hardy', 'spiderman', 'spiderman 2'})
+
+    def test_new_movies_extend_the_snapshot_matcher(self):
+        Movie.objects.create(title="Venom", actors="Tom Hardy")
+        snapshot = get_catalog()
+        Movie.objects.create(title="Locke", actors="Tom Hardy, Olivia Colman", directors="Steven Knight")
+
+        extended = get_catalog()
+        self.assertEqual(extended.generation, snapshot.generation)
+        self.assertIs(extended.matcher.base, snapshot.matcher.base)
+        found = extended.matcher.find('locke with olivia colman by steven knight')
+        self.assertEqual(found, {'titles': ['Locke'], 'actors': ['Olivia Colman'], 'directors': ['Steven Knight']})
+
+
+class CatalogEntityRulerTest(TestCase):
+    def setUp(self):
+        self.lexicon = EntityLexicon(1)
+        self.lexicon.add_movie('Spider-Man', 'Tobey Maguire', 'Sam Raimi')
+        self.lexicon.add_movie('Her', 'Joaquin Phoenix', 'Spike Jonze')
+
+    def test_ruler_tags_catalog_entities(self):
+        nlp = spacy.blank('en')
+        add_catalog_ruler(nlp, self.lexicon)
+        doc = nlp('movies like spiderman with TOBEY MAGUIRE for her')
+
+        self.assertTrue(has_catalog_entities(doc))
+        self.assertEqual(
+            [(ent.text, ent.label_, ent.ent_id_) for ent in doc.ents],
+            [('spiderman', 'MOVIE', 'title'), ('TOBEY MAGUIRE', 'PERSON', 'actor')],
+        )
+        self.assertFalse(has_catalog_entities(nlp('something else')))
+
+    def test_saved_pipeline_is_used_for_parsing(self):
+        catalog = mock.Mock(lexicon=self.lexicon)
+        catalog.matcher.find.return_value = {}
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            save_catalog_pipeline(self.lexicon, tmp_dir, nlp=spacy.blank('en'))
+            nlp = spacy.load(tmp_dir)
+
+        query = 'directed by sam raimi'
+        parsed = parse_doc(query, nlp(query), catalog)
+        self.assertEqual(parsed['directors'], ['Sam Raimi'])
+        # The ruler found the entity, so the fuzzy title fallback was skipped
+        catalog.title_trigrams.extract_one.assert_not_called()
+
+    def test_entities_added_after_the_ruler_was_saved_are_found(self):
+        Movie.objects.create(title="Venom", actors="Tom Hardy")
+        nlp = spacy.blank('en')
+        add_catalog_ruler(nlp, get_catalog().lexicon)
+        Movie.objects.create(title="Inception", actors="Leonardo DiCaprio")
+        catalog = get_catalog()
+
+        query = 'tom hardy or leonardo dicaprio movies'
+        parsed = parse_doc(query, nlp(query), catalog)
+        self.assertEqual(sorted(parsed['actors']), ['Leonardo DiCaprio', 'Tom Hardy'])
+        query = 'venom and inception'
+        parsed = parse_doc(query, nlp(query), catalog)
+        self.assertEqual(sorted(parsed['specific_movies']), ['Inception', 'Venom'])
+
+
+class TrigramIndexTest(TestCase):
+    def setUp(self):
+        self.titles = ['inception', 'interstellar', 'the dark knight', 'spiderman', 'up']
+        self.index = TrigramIndex(self.titles)
+
+    def test_candidates_share_trigrams_with_the_query(self):
+        candidates = self.index.candidates('movies like the dark knigt')
+        self.assertEqual(candidates[0], 'the dark knight')
+        self.assertNotIn('spiderman', candidates)
+        self.assertEqual(self.index.candidates('xyz'), [])
+
+    def test_same_matches_as_scoring_every_title(self):
+        for query in ('movies like inception', 'intersteller', 'spidermann', 'a funny comedy'):
+            expected = process.extract(query, self.titles, limit=1)
+            expected = expected[0][0] if expected[0][1] >= 90 else None
+            self.assertEqual(self.index.extract_one(query, 90), expected)
+
+
+class GenreResolverTest(TestCase):
+    def setUp(self):
+        self.resolver = GenreResolver(GENRES_LIST, GENRE_VARIATIONS, cache_size=2)
+
+    def test_same_genres_as_fuzzy_matching_every_token(self):
+        for text in ('horror', 'thrilling', 'comdy', 'thirller', 'westerns', 'movie', 'actor'):
+            # Fuzzy matching every token against the genre list, as parsing used to
+            match, score = process.extractOne(text, GENRES_LIST)
+            expected = GENRE_VARIATIONS.get(text) or (match if score >= 80 else None)
+            self.assertEqual(self.resolver.resolve(text, text), expected, text)
+
+    def test_unknown_tokens_are_scored_once(self):
+        self.resolver.resolve('comedy', 'comedies')
+        self.resolver.resolve('movie', 'movies')
+        self.resolver.resolve('movie', 'movies')
+        self.resolver.resolve('mystery', 'mysteries')
+        stats = self.resolver.stats()
+        self.assertEqual(stats['table_hits'], 2)
+        self.assertEqual((stats['cache_hits'], stats['cache_misses']), (1, 1))
+        self.assertGreater(stats['table_size'], len(GENRES_LIST))
+
+
+class QueryCacheTest(TestCase):
+    def setUp(self):
+        Movie.objects.create(title="Venom", description="A symbiote hero.", actors="Tom Hardy")
+        self.query_cache = QueryCache()
+        self.query_cache.cache.clear()
+        self.nlp = mock.Mock(wraps=spacy.blank('en'))
+        for target, value in (('nancy.nlp_utils.get_nlp', mock.Mock(return_value=self.nlp)),
+                              ('nancy.nlp_utils.query_cache', self.query_cache)):
+            patcher = mock.patch(target, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_repeated_queries_skip_spacy(self):
+        catalog = get_catalog()
+        first = parse_queries(['Tom Hardy movies', 'tom hardy  movies!'], catalog)
+        second = parse_queries(['TOM HARDY MOVIES'], catalog)
+
+        self.assertEqual(first, [second[0], second[0]])
+        self.assertEqual(second[0]['actors'], ['Tom Hardy'])
+        self.assertEqual(self.nlp.pipe.call_count, 1)
+        self.assertEqual(self.query_cache.stats(), {'hits': 1, 'misses': 2, 'hit_ratio': 1 / 3})
+
+    def test_new_models_version_invalidates_entries(self):
+        catalog = get_catalog()
+        parse_queries(['tom hardy movies'], catalog)
+        # Another artifact version swapped in by the reloader
+        with mock.patch('nancy.query_cache.registry.peek', return_value=mock.Mock(version='20260101-000000')):
+            parse_queries(['tom hardy movies'], catalog)
+        self.assertEqual(self.nlp.pipe.call_count, 2)
+
+
+class SeededRecommendationsTest(TestCase):
+    def setUp(self):
+        for i in range(15):
+            Movie.objects.create(title=f"Hardy {i}", description="A film.", actors="Tom Hardy")
+        recommendation_cache.cache.clear()
+        for target, value in (('nancy.nlp_utils.get_nlp', spacy.blank('en')),
+                              ('nancy.views.get_request_log', RequestLogWriter(buffered=False))):
+            patcher = mock.patch(target, return_value=value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def recommend(self, **payload):
+        response = APIClient().post(reverse('recommend-movies'), data={"query": "tom hardy movies", **payload}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response.data
+
+    def test_same_seed_returns_the_cached_page(self):
+        hits = recommendation_cache.hits
+        first = self.recommend(seed=7, limit=5)
+        self.assertEqual(first['seed'], 7)
+        self.assertEqual(len(first['recommendations']), 5)
+        self.assertEqual(self.recommend(seed=7, limit=5)['recommendations'], first['recommendations'])
+        self.assertEqual(recommendation_cache.hits, hits + 1)
+
+        pages = {tuple(self.recommend(seed=seed)['recommendations']) for seed in range(5)}
+        self.assertGreater(len(pages), 1)
+
+    def test_negative_seed_is_rejected(self):
+        response = APIClient().post(reverse('recommend-movies'), data={"query": "tom hardy", "seed": -1}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class RequestLogWriterTest(TestCase):
+    def test_records_are_written_in_bulk_on_flush(self):
+        writer = RequestLogWriter(max_queue=3, batch_size=2, flush_interval=60)
+        with mock.patch.object(RequestLogWriter, '_ensure_started'):
+            for i in range(4):
+                writer.log(f'query {i}', 10, ['Venom', 'Heat'])
+        self.assertEqual(RecommendationRequest.objects.count(), 0)
+
+        writer.flush()
+        self.assertEqual(RecommendationRequest.objects.count(), 3)
+        self.assertEqual(RecommendationRequest.objects.first().recommendations, 'Venom, Heat')
+        self.assertEqual(writer.stats(), {'queued': 0, 'written': 3, 'dropped': 1, 'failed': 0})
+
+    def test_database_errors_are_counted_not_raised(self):
+        writer = RequestLogWriter(buffered=False)
+        with mock.patch.object(RecommendationRequest.objects, 'bulk_create', side_effect=RuntimeError('locked')):
+            writer.log('query', 10, ['Venom'])
+        self.assertEqual(writer.stats()['failed'], 1)
+
+
+class TopKTest(TestCase):
+    def test_matches_a_full_sort_and_breaks_ties_by_index(self):
+        rng = np.random.default_rng(0)
+        # Round the scores so plenty of ties straddle the k-th position
+        scores = np.round(rng.random((5, 200)), 1)
+        ids, top_scores = top_k_batch(scores, 10, exclude=[3, 7])
+
+        for row in range(scores.shape[0]):
+            expected = sorted((i for i in range(200) if i not in (3, 7)), key=lambda i: (-scores[row, i], i))[:10]
+            self.assertEqual(ids[row].tolist(), expected)
+            self.assertEqual(top_scores[row].tolist(), scores[row, expected].tolist())
+
+    def test_k_larger_than_the_catalog(self):
+        ids, _ = top_k([0.2, 0.9, 0.5], 10, exclude=[1])
+        self.assertEqual(ids.tolist(), [2, 0])
+
+
+class NeighborIndexTest(TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(1)
+        self.matrix = sparse.random(60, 40, density=0.2, format='csr', random_state=rng)
+
+    def test_blocked_build_matches_the_dense_matrix(self):
+        index = build_neighbor_index(self.matrix, k=5, block_size=7)
+        dense = cosine_similarity(self.matrix)
+
+        for row in range(dense.shape[0]):
+            expected_ids, expected_scores = top_k(dense[row], 5, exclude=[row])
+            self.assertEqual(index.ids[row].tolist(), expected_ids.tolist())
+            np.testing.assert_allclose(index.scores[row], expected_scores, rtol=1e-6)
+
+    def test_parallel_build_matches_the_serial_build(self):
+        blocks = []
+        serial = build_neighbor_index(self.matrix, k=5, block_size=16)
+        parallel = build_neighbor_index(
+            self.matrix, k=5, block_size=16, workers=2, progress=lambda start, end, seconds: blocks.append((start, end))
+        )
+        np.testing.assert_array_equal(parallel.ids, serial.ids)
+        np.testing.assert_array_equal(parallel.scores, serial.scores)
+        self.assertEqual(blocks, [(0, 16), (16, 32), (32, 48), (48, 60)])
+
+    def test_neighbors_skip_excluded_ids_and_padding(self):
+        index = build_neighbor_index(self.matrix[:3], k=5)
+        self.assertEqual(index.ids[0, 2:].tolist(), [-1, -1, -1])
+
+        (ids, scores), = index.neighbors([0], k=5, exclude=[1])
+        self.assertEqual(ids.tolist(), [2])
+        self.assertEqual(len(scores), 1)
+
+
+class IncrementalRegenerationTest(TestCase):
+    def test_updated_index_matches_a_full_build(self):
+        rng = np.random.default_rng(2)
+        matrix = sparse.random(70, 40, density=0.2, format='csr', random_state=rng)
+        old_matrix = matrix[:60].tolil()
+        # Row 3 changes after the old index was built, rows 60+ are new
+        old_matrix[3] = sparse.random(1, 40, density=0.2, random_state=rng).toarray()
+        old_index = build_neighbor_index(old_matrix.tocsr(), k=5)
+
+        index = update_neighbor_index(old_index, matrix, [3, *range(60, 70)], block_size=16)
+        expected = build_neighbor_index(matrix, k=5)
+        np.testing.assert_array_equal(index.ids, expected.ids)
+        np.testing.assert_allclose(index.scores, expected.scores, rtol=1e-6)
+
+    def test_command_only_rescores_new_and_changed_movies(self):
+        for title, description in (('Heat', 'a heist in los angeles'), ('Venom', 'a symbiote hero'),
+                                   ('Ronin', 'a heist in paris'), ('Locke', 'a man drives at night')):
+            Movie.objects.create(title=title, description=description)
+
+        with tempfile.TemporaryDirectory() as tmp_dir, \
+                mock.patch('nancy.management.commands.regenerate_models.get_artifacts_dir', return_value=tmp_dir):
+            call_command('regenerate_models', neighbors=2, stdout=io.StringIO())
+            Movie.objects.create(title='Thief', description='a heist by a safecracker')
+            Movie.objects.filter(title='Locke').update(description='a heist at night')
+            call_command('regenerate_models', neighbors=2, incremental=True, stdout=io.StringIO())
+            artifacts = load_artifacts(get_current_dir(tmp_dir))
+
+            self.assertEqual(artifacts.manifest['build']['mode'], 'incremental')
+            self.assertEqual(artifacts.manifest['build']['changed_movies'], 2)
+            self.assertEqual(list(artifacts.titles), ['Heat', 'Venom', 'Ronin', 'Locke', 'Thief'])
+            (ids, _), = artifacts.neighbors.neighbors([4], k=1)
+            self.assertIn(artifacts.titles[ids[0]], ('Heat', 'Ronin', 'Locke'))
+
+            # Stored rows for the untouched movies, transformed ones for the others
+            descriptions = [Movie.objects.get(title=title).description for title in artifacts.titles]
+            np.testing.assert_allclose(
+                artifacts.tfidf_rows.toarray(), artifacts.vectorizer.transform(descriptions).toarray(), rtol=1e-6
+            )
+
+            lexicon = EntityLexicon.load(get_lexicon_path(get_current_dir(tmp_dir)))
+            self.assertEqual(lexicon.version, get_catalog_version())
+            self.assertEqual(lexicon.titles['thief'], 'Thief')
+
+    def test_command_keeps_the_latent_components(self):
+        for title, description in (('Heat', 'a heist in los angeles'), ('Venom', 'a symbiote hero'),
+                                   ('Ronin', 'a heist in paris'), ('Locke', 'a man drives at night')):
+            Movie.objects.create(title=title, description=description)
+
+        with tempfile.TemporaryDirectory() as tmp_dir, \
+                mock.patch('nancy.management.commands.regenerate_models.get_artifacts_dir', return_value=tmp_dir):
+            options = {'neighbors': 2, 'latent_dims': 3, 'ann_lists': 2, 'eval_queries': 0, 'stdout': io.StringIO()}
+            call_command('regenerate_models', **options)
+            base = load_artifacts(get_current_dir(tmp_dir)).latent
+            Movie.objects.create(title='Thief', description='a heist by a safecracker')
+            call_command('regenerate_models', incremental=True, **options)
+            latent = load_artifacts(get_current_dir(tmp_dir)).latent
+
+            np.testing.assert_array_equal(latent.components, base.components)
+            np.testing.assert_array_equal(latent.ivf.centroids, base.ivf.centroids)
+            np.testing.assert_array_equal(latent.vectors[:4], base.vectors)
+            self.assertEqual(len(latent), 5)
+
+
+class ModelArtifactsTest(TestCase):
+    def test_round_trip_through_memory_mapped_arrays(self):
+        df_movies = pd.DataFrame({
+            'id': [3, 1, 2],
+            'title': ['Spider-Man', 'Amélie', 'Heat'],
+            'description': ['a spider hero', 'a shy waitress in paris', 'a heist in los angeles'],
+            'genres': ['Action', 'Romance', None],
+            'actors': ['Tobey Maguire', 'Audrey Tautou', 'Al Pacino, Robert De Niro'],
+            'directors': ['Sam Raimi', 'Jean-Pierre Jeunet', 'Michael Mann'],
+        })
+        df_movies['normalized_title'] = df_movies['title'].map(normalize_string)
+        tfidf = TfidfVectorizer(stop_words='english')
+        tfidf_matrix = tfidf.fit_transform(df_movies['description'])
+        neighbor_index = build_neighbor_index(tfidf_matrix, k=2)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            write_artifacts(tmp_dir, df_movies, tfidf, neighbor_index, tfidf_matrix=tfidf_matrix)
+            artifacts = load_artifacts(tmp_dir)
+
+            self.assertEqual(list(artifacts.titles), ['Spider-Man', 'Amélie', 'Heat'])
+            self.assertEqual(artifacts.movies['genres'][2], '')
+            self.assertEqual(artifacts.title_index('spiderman'), 0)
+            self.assertEqual(artifacts.title_index('heat'), 2)
+            self.assertIsNone(artifacts.title_index('alien'))
+            self.assertIsInstance(artifacts.neighbors.ids, np.memmap)
+            np.testing.assert_array_equal(artifacts.neighbors.ids, neighbor_index.ids)
+            self.assertEqual((artifacts.vectorizer.transform(['heist']) != tfidf.transform(['heist'])).nnz, 0)
+            self.assertEqual(artifacts.entity_set('actors', 'Robert De Niro').to_rows().tolist(), [2])
+
+            rows, scores = artifacts.search('a heist with a spider', 3)
+            expected = cosine_similarity(tfidf.transform(['a heist with a spider']), tfidf_matrix)[0]
+            self.assertEqual(rows.tolist(), [0, 2])
+            np.testing.assert_allclose(scores, expected[[0, 2]], rtol=1e-6)
+            self.assertEqual(len(artifacts.search('nothing relevant', 3)[0]), 0)
+
+    def test_multi_seed_scoring_matches_the_centroid(self):
+        descriptions = ['space war', 'space opera war', 'war at sea', 'a quiet space station', 'cooking show']
+        df_movies = pd.DataFrame({
+            'title': ['A', 'B', 'C', 'D', 'E'], 'description': descriptions,
+            'genres': '', 'actors': '', 'directors': '',
+        })
+        df_movies['normalized_title'] = df_movies['title'].map(normalize_string)
+        tfidf = TfidfVectorizer()
+        tfidf_matrix = tfidf.fit_transform(descriptions)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            write_artifacts(
+                tmp_dir, df_movies, tfidf, build_neighbor_index(tfidf_matrix, k=2), tfidf_matrix=tfidf_matrix
+            )
+            artifacts = load_artifacts(tmp_dir)
+            self.assertEqual(artifacts.tfidf_rows.shape, tfidf_matrix.shape)
+            for weights in (None, [3.0, 1.0]):
+                rows, scores = artifacts.similar_to_seeds([0, 2], 5, weights=weights)
+                combined = np.average(tfidf_matrix[[0, 2]].toarray(), axis=0, weights=weights)
+                expected = cosine_similarity(combined[None, :], tfidf_matrix)[0]
+                self.assertNotIn(0, rows)
+                self.assertNotIn(2, rows)
+                self.assertNotIn(4, rows)
+                self.assertEqual(rows.tolist(), sorted([1, 3], key=lambda row: -expected[row]))
+                np.testing.assert_allclose(scores, expected[rows], rtol=1e-5)
+
+            # Artifacts written before the movie rows were stored rank the same
+            artifacts.tfidf_rows = None
+            rows, scores = artifacts.similar_to_seeds([0, 2], 5)
+            expected_rows, expected_scores = load_artifacts(tmp_dir).similar_to_seeds([0, 2], 5)
+            self.assertEqual(rows.tolist(), expected_rows.tolist())
+            np.testing.assert_allclose(scores, expected_scores, rtol=1e-5)
+
+    def test_latent_index_is_selected_by_the_ranking_setting(self):
+        descriptions = ['space war', 'space opera war', 'war at sea', 'a quiet space station', 'cooking show']
+        df_movies = pd.DataFrame({
+            'title': ['A', 'B', 'C', 'D', 'E'], 'description': descriptions,
+            'genres': '', 'actors': '', 'directors': '',
+        })
+        df_movies['normalized_title'] = df_movies['title'].map(normalize_string)
+        tfidf = TfidfVectorizer()
+        tfidf_matrix = tfidf.fit_transform(descriptions)
+        # As many dimensions as movies keep all the variance, so cosines are preserved
+        latent = LatentIndex.build(tfidf_matrix, dims=5)
+        latent.ivf = IVFIndex.build(latent.vectors, n_lists=2)
+        self.assertEqual(latent.vectors.dtype, np.float32)
+        self.assertTrue(latent.vectors.flags['C_CONTIGUOUS'])
+        np.testing.assert_allclose(np.linalg.norm(latent.vectors, axis=1), 1, rtol=1e-5)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            write_artifacts(
+                tmp_dir, df_movies, tfidf, build_neighbor_index(tfidf_matrix, k=2),
+                tfidf_matrix=tfidf_matrix, latent=latent
+            )
+            with override_settings(NANCY_RANKING_INDEX='tfidf'):
+                artifacts = load_artifacts(tmp_dir)
+                self.assertEqual(artifacts.ranking_index, 'tfidf')
+                expected_rows, expected_scores = artifacts.search('space war', 3)
+            self.assertEqual(artifacts.manifest['latent']['dims'], 5)
+            np.testing.assert_array_equal(artifacts.latent.ivf.rows, latent.ivf.rows)
+            # Probing both lists keeps the latent ranking exact
+            with override_settings(NANCY_RANKING_INDEX='latent', NANCY_ANN_PROBES=2):
+                artifacts = load_artifacts(tmp_dir)
+                self.assertEqual(artifacts.ranking_index, 'latent')
+                rows, scores = artifacts.search('space war', 3)
+                seed_rows, _ = artifacts.similar_to_seeds([0, 2], 2)
+            self.assertEqual(rows.tolist(), expected_rows.tolist())
+            np.testing.assert_allclose(scores, expected_scores, atol=1e-4)
+            self.assertEqual(seed_rows.tolist(), [1, 3])
+            # A misspelt setting fails the load, not every request
+            with override_settings(NANCY_RANKING_INDEX='lantent'):
+                with self.assertRaises(ImproperlyConfigured):
+                    load_artifacts(tmp_dir)
+
+
+class IVFIndexTest(TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        vectors = rng.normal(size=(500, 16)).astype(np.float32)
+        self.vectors = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+        self.ivf = IVFIndex.build(self.vectors, n_lists=10)
+
+    def test_lists_partition_the_rows(self):
+        self.assertEqual(self.ivf.offsets[-1], len(self.vectors))
+        self.assertEqual(sorted(self.ivf.rows.tolist()), list(range(len(self.vectors))))
+
+    def test_update_only_moves_the_changed_rows(self):
+        rng = np.random.default_rng(1)
+        tfidf_matrix = sparse.random(60, 30, density=0.3, format='csr', random_state=rng)
+        latent = LatentIndex.build(tfidf_matrix[:50], dims=8)
+        latent.ivf = IVFIndex.build(latent.vectors, n_lists=4)
+
+        # Row 7 changes, rows 50+ are new
+        changed = [7, *range(50, 60)]
+        updated = latent.updated(tfidf_matrix, changed)
+        np.testing.assert_array_equal(updated.components, latent.components)
+        np.testing.assert_array_equal(np.delete(updated.vectors[:50], 7, axis=0), np.delete(latent.vectors, 7, axis=0))
+        np.testing.assert_allclose(updated.vectors[changed], latent.project(tfidf_matrix[changed]), rtol=1e-5)
+
+        ivf = updated.ivf
+        np.testing.assert_array_equal(ivf.centroids, latent.ivf.centroids)
+        self.assertEqual(sorted(ivf.rows.tolist()), list(range(60)))
+        for row in changed:
+            position = int(np.flatnonzero(ivf.rows == row)[0])
+            self.assertEqual(np.searchsorted(ivf.offsets, position, side='right') - 1,
+                             np.argmax(ivf.centroids @ updated.vectors[row]))
+
+    def test_recall_grows_with_probes_and_is_exact_when_probing_every_list(self):
+        latent = LatentIndex(self.vectors, np.eye(16, dtype=np.float32), ivf=self.ivf)
+        report = evaluate(self.ivf, latent, np.arange(50), k=10, probes_options=(1, 4, 10))
+        recalls = [row['recall'] for row in report[1:]]
+        self.assertEqual(recalls, sorted(recalls))
+        self.assertEqual(recalls[-1], 1.0)
+
+        rows, scores = latent.rank(self.vectors[3], 5, exclude=[3], probes=10)
+        expected_rows, expected_scores = top_k(self.vectors @ self.vectors[3], 5, exclude=[3])
+        self.assertEqual(rows.tolist(), expected_rows.tolist())
+        np.testing.assert_allclose(scores, expected_scores, rtol=1e-5)
+
+
+class QuantizationTest(TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        vectors = rng.normal(size=(300, 32)).astype(np.float32)
+        self.vectors = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    def test_round_trip_error_is_bounded(self):
+        for mode, tolerance in (('float16', 1e-3), ('int8', 1e-2)):
+            values, scales = quantize(self.vectors, mode)
+            self.assertEqual(values.dtype, np.dtype(mode))
+            np.testing.assert_allclose(dequantize(values, scales), self.vectors, atol=tolerance)
+        with self.assertRaises(ValueError):
+            quantize(self.vectors, 'int4')
+
+    def test_quantized_rankings_agree_with_full_precision(self):
+        values, scales = quantize(self.vectors, 'int8')
+        agreement = rank_agreement(self.vectors, values, scales, np.arange(20))
+        self.assertGreaterEqual(agreement['overlap'], 0.9)
+        self.assertLess(agreement['max_error'], 0.05)
+
+    def test_quantized_artifacts_score_with_dequantization(self):
+        neighbor_index = build_neighbor_index(sparse.csr_matrix(self.vectors), k=5)
+        quantized = neighbor_index.quantized('int8')
+        latent = LatentIndex(self.vectors, np.eye(32, dtype=np.float32)).quantized('float16')
+        df_movies = pd.DataFrame({column: [f'{column} {i}' for i in range(300)] for column in (
+            'title', 'genres', 'actors', 'directors', 'description'
+        )})
+        df_movies['normalized_title'] = df_movies['title'].map(normalize_string)
+        tfidf = TfidfVectorizer().fit(df_movies['description'])
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            write_artifacts(tmp_dir, df_movies, tfidf, quantized, latent=latent)
+            artifacts = load_artifacts(tmp_dir)
+            self.assertEqual(artifacts.neighbors.scores.dtype, np.int8)
+            self.assertEqual(artifacts.latent.vectors.dtype, np.float16)
+            [(ids, scores)] = artifacts.neighbors.neighbors([7])
+            np.testing.assert_array_equal(ids, neighbor_index.ids[7])
+            np.testing.assert_allclose(scores, neighbor_index.scores[7], atol=1e-2)
+            rows, _ = artifacts.latent.rank(self.vectors[7], 5, exclude=[7])
+            self.assertEqual(rows.tolist(), top_k(self.vectors @ self.vectors[7], 5, exclude=[7])[0].tolist())
+
+
+class InvertedIndexTest(TestCase):
+    def setUp(self):
+        self.index = InvertedIndex.build([
+            'Science Fiction, Action', 'Action, Action', None, 'Fiction', 'Comedy',
+        ])
+
+    def test_lookups(self):
+        self.assertEqual(list(self.index.keys), ['action', 'comedy', 'fiction', 'science fiction'])
+        self.assertEqual(self.index.row_set('action', 5).to_rows().tolist(), [0, 1])
+        self.assertEqual(self.index.row_set('drama', 5).to_rows().tolist(), [])
+        self.assertEqual(self.index.row_set_containing('fiction', 5).to_rows().tolist(), [0, 3])
+
+    def test_set_operations(self):
+        action, fiction = self.index.row_set('action', 5), self.index.row_set_containing('fiction', 5)
+        self.assertEqual(all_of([action, fiction], 5).to_rows().tolist(), [0])
+        self.assertEqual(any_of([action, fiction], 5).to_rows().tolist(), [0, 1, 3])
+        self.assertEqual(any_of([], 5).to_rows().tolist(), [])
+
+
+class ArtifactStoreTest(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.df_movies = pd.DataFrame({
+            'id': [1, 2, 3],
+            'title': ['Heat', 'Ronin', 'Venom'],
+            'normalized_title': ['heat', 'ronin', 'venom'],
+            'description': ['a heist in los angeles', 'a heist in paris', 'a symbiote hero'],
+            'genres': ['Crime', 'Crime', 'Action'],
+            'actors': ['Al Pacino', 'Robert De Niro', 'Tom Hardy'],
+            'directors': ['Michael Mann', 'John Frankenheimer', 'Ruben Fleischer'],
+        })
+        self.tfidf = TfidfVectorizer()
+        self.neighbor_index = build_neighbor_index(self.tfidf.fit_transform(self.df_movies['description']), k=1)
+
+    def publish(self):
+        with new_artifact_version(self.root) as directory:
+            write_artifacts(directory, self.df_movies, self.tfidf, self.neighbor_index)
+        return current_version(self.root)
+
+    def test_versions_are_published_atomically_and_verified(self):
+        first = self.publish()
+        with self.assertRaises(RuntimeError), new_artifact_version(self.root) as directory:
+            write_artifacts(directory, self.df_movies, self.tfidf, self.neighbor_index)
+            raise RuntimeError('crash while writing')
+        # The failed write left no trace and the first version is still current
+        self.assertEqual(current_version(self.root), first)
+        self.assertEqual(os.listdir(os.path.join(self.root, 'versions')), [first])
+
+        second = self.publish()
+        self.assertGreater(second, first)
+        artifacts = load_artifacts(get_current_dir(self.root))
+        self.assertEqual(artifacts.version, second)
+        self.assertEqual(verify_artifacts(get_current_dir(self.root)), [])
+
+        with open(os.path.join(get_current_dir(self.root), 'neighbors.scores.npy'), 'r+b') as f:
+            f.seek(-1, os.SEEK_END)
+            f.write(b'\x01')
+        self.assertEqual(verify_artifacts(get_current_dir(self.root)), ['neighbors.scores.npy does not match its checksum'])
+
+        prune_versions(self.root, keep=1)
+        self.assertEqual(os.listdir(os.path.join(self.root, 'versions')), [second])
+
+    def test_workers_swap_to_a_new_version_between_requests(self):
+        self.publish()
+        registry = ResourceRegistry()
+        registry.register('nlp', mock.Mock())
+        registry.register('artifacts', lambda: load_artifacts(get_current_dir(self.root)))
+        old_artifacts = registry.get('artifacts')
+        reloader = ModelReloader(registry, root=self.root, interval=0)
+
+        reloader.check()
+        self.assertIsNone(reloader._thread)
+        new_version = self.publish()
+        reloader.check()
+        reloader._thread.join()
+        # Loaded in the background, swapped in by the next check
+        self.assertIs(registry.get('artifacts'), old_artifacts)
+        reloader.check()
+        self.assertEqual(registry.get('artifacts').version, new_version)
+        # Cached queries of the old models are no longer reachable
+        with mock.patch('nancy.query_cache.registry', registry):
+            self.assertEqual(get_models_version(), new_version)
+
+
+class ResourceRegistryTest(TestCase):
+    def setUp(self):
+        self.registry = ResourceRegistry()
+        self.loader = mock.Mock(return_value='pipeline')
+        self.registry.register('nlp', self.loader)
+        self.registry.register('broken', mock.Mock(side_effect=OSError('missing model')))
+
+    def test_resources_load_once_on_first_use(self):
+        self.loader.assert_not_called()
+        self.assertEqual(self.registry.get('nlp'), 'pipeline')
+        self.assertEqual(self.registry.get('nlp'), 'pipeline')
+        self.loader.assert_called_once()
+        self.assertIsNotNone(self.registry.status()['nlp']['load_seconds'])
+
+    def test_readiness_endpoint_reports_unloaded_resources(self):
+        url = reverse('recommender-ready')
+        with mock.patch('nancy.views.registry', self.registry):
+            response = APIClient().get(url)
+            self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+            self.assertFalse(response.data['resources']['nlp']['loaded'])
+
+            self.registry.warm_up()
+            response = APIClient().get(url)
+            self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+            self.assertTrue(response.data['resources']['nlp']['loaded'])
+            self.assertIn('missing model', response.data['resources']['broken']['error'])
+
+
+class RowSetTest(TestCase):
+    def test_operations_match_python_sets(self):
+        rng = np.random.default_rng(0)
+        n_rows = 1000
+        # Both forms: a few rows stay an array, a third of the catalog becomes a bitmap
+        samples = [np.sort(rng.choice(n_rows, size, replace=False)) for size in (5, 20, 300, 400)]
+        row_sets = [RowSet.from_rows(rows, n_rows) for rows in samples]
+        python_sets = [set(rows.tolist()) for rows in samples]
+        self.assertEqual([row_set.is_dense for row_set in row_sets], [False, False, True, True])
+
+        for a, set_a in zip(row_sets, python_sets):
+            for b, set_b in zip(row_sets, python_sets):
+                self.assertEqual(set((a & b).to_rows().tolist()), set_a & set_b)
+                self.assertEqual(set((a | b).to_rows().tolist()), set_a | set_b)
+                self.assertEqual(set((a - b).to_rows().tolist()), set_a - set_b)
+            self.assertEqual(set((~a).to_rows().tolist()), set(range(n_rows)) - set_a)
+            self.assertEqual(len(a), len(set_a))
+        self.assertEqual(set(all_of(row_sets[2:], n_rows).to_rows().tolist()), python_sets[2] & python_sets[3])
+        self.assertEqual(set(any_of(row_sets[:2], n_rows).to_rows().tolist()), python_sets[0] | python_sets[1])
+
+    def test_constraints_relax_when_nothing_matches_them_all(self):
+        n_rows = 10
+        horror, hardy, nolan = (RowSet.from_rows(rows, n_rows) for rows in ([1, 2, 3], [3, 4], [4, 5]))
+        levels = constraint_levels([horror, hardy], [], n_rows)
+        self.assertEqual([level.to_rows().tolist() for level in levels], [[3]])
+        levels = constraint_levels([horror, hardy, nolan], [], n_rows)
+        self.assertEqual([level.to_rows().tolist() for level in levels], [[3, 4], [1, 2, 5]])
+        levels = constraint_levels([horror], [hardy], n_rows)
+        self.assertEqual([level.to_rows().tolist() for level in levels], [[1, 2]])
+
+
+class ConstraintRecommendationsTest(TestCase):
+    def setUp(self):
+        Movie.objects.create(title="Venom", description="A symbiote hero.", actors="Tom Hardy", genres="Action")
+        Movie.objects.create(title="Legend", description="Twin gangsters.", actors="Tom Hardy", genres="Crime")
+        Movie.objects.create(title="Heat", description="A heist.", actors="Al Pacino", genres="Crime, Action")
+        patcher = mock.patch('nancy.recommendation.get_artifacts', return_value=None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_named_entities_are_combined_with_and_and_not(self):
+        catalog = get_catalog()
+        parsed = {'genres': ['crime'], 'actors': ['Tom Hardy'], 'directors': [], 'specific_movies': []}
+        self.assertEqual(generate_recommendations(parsed, catalog), ["Legend"])
+        parsed = {'genres': ['action'], 'actors': [], 'directors': [], 'specific_movies': [],
+                  'exclude_actors': ['Tom Hardy']}
+        self.assertEqual(generate_recommendations(parsed, catalog), ["Heat"])
+
+    def test_negated_entities_are_parsed_as_exclusions(self):
+        catalog = get_catalog()
+        query = "movies without tom hardy"
+        parsed = parse_doc(query, spacy.blank('en')(query), catalog)
+        self.assertEqual(parsed['actors'], [])
+        self.assertEqual(parsed['exclude_actors'], ["Tom Hardy"])
+
+    def test_exclusion_only_queries_recommend_the_other_movies(self):
+        with mock.patch('nancy.nlp_utils.get_nlp', return_value=spacy.blank('en')), \
+                mock.patch('nancy.views.get_request_log', return_value=RequestLogWriter(buffered=False)):
+            response = APIClient().post(
+                reverse('recommend-movies'), data={'query': 'movies without tom hardy'}, format='json'
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['mode'], 'entities')
+        self.assertEqual(response.data['parsed']['exclude_actors'], ["Tom Hardy"])
+        self.assertEqual(response.data['recommendations'], ["Heat"])
+
+    def test_negations_only_apply_right_before_an_entity(self):
+        catalog = get_catalog()
+        for query in ("a movie with no romance with tom hardy", "no gore, tom hardy please",
+                      "nothing hill with tom hardy", "no legend and tom hardy"):
+            parsed = parse_doc(query, spacy.blank('en')(query), catalog)
+            self.assertEqual(parsed['actors'], ["Tom Hardy"], query)
+            self.assertEqual(parsed['exclude_actors'], [], query)
+        for query in ("not starring tom hardy", "no heat or tom hardy"):
+            parsed = parse_doc(query, spacy.blank('en')(query), catalog)
+            self.assertEqual(parsed['exclude_actors'], ["Tom Hardy"], query)
+
+    def test_genre_negations_stop_at_punctuation_and_other_genres(self):
+        # The words before "action", as the genre pass sees them
+        entity_words = {'romance', 'action'}
+        self.assertFalse(is_negated(query_words('no romance,'), entity_words))
+        self.assertFalse(is_negated(query_words('no romance with'), entity_words))
+        self.assertTrue(is_negated(query_words('no romance or'), entity_words))
+        self.assertTrue(is_negated(query_words('without any'), entity_words))
+
+
+class BatchRecommendMoviesAPITest(TestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.url = reverse('recommend-movies-batch')
+        Movie.objects.create(title="Venom", description="A symbiote hero.", actors="Tom Hardy")
+        Movie.objects.create(title="Evil Dead", description="A cabin horror.", directors="Sam Raimi")
+        # A blank pipeline keeps the test independent of the downloadable SpaCy model
+        patcher = mock.patch('nancy.nlp_utils.get_nlp', return_value=spacy.blank('en'))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # Write log rows synchronously so they can be counted
+        patcher = mock.patch('nancy.views.get_request_log', return_value=RequestLogWriter(buffered=False))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_results_follow_the_query_order(self):
+        payload = {"queries": ["something by sam raimi", "hello there", "tom hardy movies"], "batch_size": 2}
+        response = self.client.post(self.url, data=payload, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        results = response.data['results']
+        self.assertEqual([result['query'] for result in results], payload['queries'])
+        self.assertEqual(results[0]['recommendations'], ["Evil Dead"])
+        self.assertEqual(results[1]['recommendations'], [])
+        self.assertIn('detail', results[1])
+        self.assertEqual(results[2]['recommendations'], ["Venom"])
+        self.assertEqual(RecommendationRequest.objects.count(), 2)
+
+    def test_queries_without_entities_search_descriptions(self):
+        df_movies = pd.DataFrame(Movie.objects.values('id', 'title', 'description', 'genres', 'actors', 'directors'))
+        df_movies['normalized_title'] = df_movies['title'].map(normalize_string)
+        tfidf = TfidfVectorizer(stop_words='english')
+        tfidf_matrix = tfidf.fit_transform(df_movies['description'])
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            write_artifacts(
+                tmp_dir, df_movies, tfidf, build_neighbor_index(tfidf_matrix, k=1), tfidf_matrix=tfidf_matrix
+            )
+            with mock.patch('nancy.recommendation.get_artifacts', return_value=load_artifacts(tmp_dir)):
+                payload = {"queries": ["a scary cabin in the woods", "hello there"]}
+                response = self.client.post(self.url, data=payload, format='json')
+
+        results = response.data['results']
+        self.assertEqual(results[0]['recommendations'], ["Evil Dead"])
+        self.assertEqual(results[0]['mode'], 'description')
+        self.assertEqual(results[1]['recommendations'], [])
+        self.assertIn('detail', results[1])
+
+    def test_empty_batch_is_rejected(self):
+        response = self.client.post(self.url, data={"queries": []}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('queries', response.data)
@@ -0,0 +1,80 @@
+# nancy/trigram.py
+"""
+Character-trigram candidate index for fuzzy title matching.
+
+Scoring a query against every title with edit distance costs O(N) Levenshtein
+runs per request. The index first narrows the titles to the few that share
+enough trigrams with the query, and only those are scored by fuzzywuzzy.
+"""
+import numpy as np
+from fuzzywuzzy import process, utils
+
+from .ranking import top_k
+
+# Titles scored with edit distance after the trigram filter
+MAX_CANDIDATES = 50
+# Minimum share of trigrams in common for a title to be a candidate
+MIN_OVERLAP = 0.3
+
+
+def trigrams(text):
+    """
+    Set of character trigrams of `text`, built per word with padding (as pg_trgm
+    does) so word order does not matter and short words still get trigrams.
+    Text goes through the same processing fuzzywuzzy applies before scoring.
+    """
+    grams = set()
+    for word in utils.full_process(text).split():
+        padded = f'  {word} '
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+class TrigramIndex:
+    """
+    Postings from each trigram to the rows of the titles containing it.
+    """
+
+    def __init__(self, titles):
+        self.titles = list(titles)
+        rows_by_gram = {}
+        self.sizes = np.zeros(len(self.titles), dtype=np.int32)
+        for row, title in enumerate(self.titles):
+            grams = trigrams(title)
+            self.sizes[row] = len(grams)
+            for gram in grams:
+                rows_by_gram.setdefault(gram, []).append(row)
+        self.postings = {gram: np.array(rows, dtype=np.int32) for gram, rows in rows_by_gram.items()}
+
+    def __len__(self):
+        return len(self.titles)
+
+    def candidates(self, text, limit=MAX_CANDIDATES, min_overlap=MIN_OVERLAP):
+        """
+        Titles sharing the most trigrams with `text`, best first.
+
+        Overlap is measured against the smaller of the two trigram sets, so a title
+        contained in a longer query (and the reverse) ranks high, as it does with
+        fuzzywuzzy's partial ratios.
+        """
+        grams = trigrams(text)
+        postings = [self.postings[gram] for gram in grams if gram in self.postings]
+        if not postings:
+            return []
+        # Only the titles found in the postings are counted and ranked, so the cost
+        # follows the postings read rather than the size of the catalog
+        rows, shared = np.unique(np.concatenate(postings), return_counts=True)
+        overlap = shared / np.maximum(np.minimum(self.sizes[rows], len(grams)), 1)
+        positions, scores = top_k(overlap, limit)
+        return [self.titles[row] for row in rows[positions[scores >= min_overlap]]]
+
+    def extract_one(self, text, threshold):
+        """
+        Best fuzzy match of `text` scoring at least `threshold`, or None. Same
+        scorer as process.extract, restricted to the trigram candidates.
+        """
+        matches = process.extract(text, self.candidates(text), limit=1)
+        for match, score in matches:
+            if score >= threshold:
+                return match
+        return None
@@ -1,8 +1,10 @@
 # nancy/urls.py
 from django.urls import path
-from .views import RecommendMoviesView, MovieListView
+from .views import BatchRecommendMoviesView, RecommendMoviesView, MovieListView, ReadinessView
 
 urlpatterns = [
     path('recommend/', RecommendMoviesView.as_view(), name='recommend-movies'),
+    path('recommend/batch/', BatchRecommendMoviesView.as_view(), name='recommend-movies-batch'),
     path('movies/', MovieListView.as_view(), name='movie-list'),
+    path('ready/', ReadinessView.as_view(), name='recommender-ready'),
 ]
@@ -1,19 +1,37 @@
 # nancy/views.py
 from rest_framework import generics
+from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
-from .nlp_utils import enhanced_parse_query
-from .recommendation import generate_recommendations
+from .catalog import get_catalog
+from .nlp_utils import enhanced_parse_query, parse_queries
+from .query_cache import query_cache, recommendation_cache
+from .recommendation import ENTITY_KEYS, MODE_DESCRIPTION, MODE_ENTITIES, recommend, search_descriptions
+from .registry import refresh_models, registry
+from .request_log import get_request_log
 from .models import Movie, RecommendationRequest
 from .serializers import (
+    BatchRecommendationRequestSerializer,
+    BatchRecommendationResponseSerializer,
     MovieSerializer,
     RecommendationRequestSerializer,
     RecommendationResponseSerializer
 )
-import pandas as pd
 from drf_yasg.utils import swagger_auto_schema
 from drf_yasg import openapi
 
+# Response header reporting the catalog snapshot version used for a request
+CATALOG_VERSION_HEADER = 'X-Catalog-Version'
+
+NO_ENTITIES_DETAIL = "No recognizable genres, movies, actors, or directors found in the query, " \
+                     "and no movie description matches it."
+NO_RECOMMENDATIONS_DETAIL = "No recommendations found based on your query."
+
+
+def has_entities(parsed):
+    # Exclusions alone ("movies without Tom Hardy") are resolved from the entities too
+    return any(parsed.get(key) for key in ENTITY_KEYS)
+
 
 class RecommendMoviesView(generics.GenericAPIView):
     """
@@ -25,7 +43,8 @@ class RecommendMoviesView(generics.GenericAPIView):
     request_body_example = {
         "application/json": {
             "query": "hey nancy give me some movies like Spider-Man",
-            "limit": 10
+            "limit": 10,
+            "seed": 42
         }
     }
 
@@ -34,6 +53,7 @@ class RecommendMoviesView(generics.GenericAPIView):
         "200": {
             "query": "hey nancy give me some movies like Spider-Man",
             "limit": 10,
+            "seed": 42,
             "parsed": {
                 "genres": ["romantic"],
                 "specific_movies": ["Spider-Man"],
@@ -51,7 +71,8 @@ class RecommendMoviesView(generics.GenericAPIView):
                 "The Amazing Spider-Man",
                 "The Amazing Spider-Man 2",
                 "Spider-Man"
-            ]
+            ],
+            "mode": "entities"
         },
         "400": {
             "query": ["This field is required."]
@@ -95,52 +116,143 @@ class RecommendMoviesView(generics.GenericAPIView):
 
         query = serializer.validated_data.get('query', '')
         limit = serializer.validated_data.get('limit', 10)
+        seed = serializer.validated_data.get('seed')
 
-        # Load movies DataFrame from the database
-        movies_qs = Movie.objects.all()
-        movies_data = list(movies_qs.values())
-        df_movies = pd.DataFrame(movies_data)
+        # Swap to newly published models between requests, never during one
+        refresh_models()
 
-        # Parse the query
-        parsed = enhanced_parse_query(query, df_movies)
+        # Use the shared catalog snapshot instead of reloading the Movie table
+        catalog = get_catalog()
 
-        # Check if any entities were parsed
-        if not any([parsed['genres'], parsed['specific_movies'], parsed['actors'], parsed['directors']]):
-            return Response(
-                {"detail": "No recognizable genres, movies, actors, or directors found in the query."},
-                status=status.HTTP_400_BAD_REQUEST
-            )
+        # Parse the query
+        parsed = enhanced_parse_query(query, catalog)
 
-        # Generate recommendations
-        recommendations = generate_recommendations(parsed)
+        if has_entities(parsed):
+            # Generate recommendations, cached when a seed is given
+            mode = MODE_ENTITIES
+            recommendations = recommend(parsed, catalog, limit, seed=seed)
+        else:
+            # Nothing named, match the query against movie descriptions instead
+            mode = MODE_DESCRIPTION
+            recommendations = search_descriptions(query, limit)
+            if not recommendations:
+                return Response(
+                    {"detail": NO_ENTITIES_DETAIL},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
 
         # Check if any recommendations were found
         if not recommendations:
             return Response(
-                {"detail": "No recommendations found based on your query."},
+                {"detail": NO_RECOMMENDATIONS_DETAIL},
                 status=status.HTTP_404_NOT_FOUND
             )
 
-        # Limit the number of recommendations
-        recommendations = recommendations[:limit]
-
-        # Log the recommendation request
-        RecommendationRequest.objects.create(
-            query=query,
-            limit=limit,
-            recommendations=', '.join(recommendations)
-        )
+        # Log the recommendation request, written in the background
+        get_request_log().log(query, limit, recommendations)
 
         response_data = {
             "query": query,
             "limit": limit,
             "parsed": parsed,
-            "recommendations": recommendations
+            "recommendations": recommendations,
+            "mode": mode
         }
+        if seed is not None:
+            response_data["seed"] = seed
 
         response_serializer = RecommendationResponseSerializer(response_data)
 
-        return Response(response_serializer.data, status=status.HTTP_200_OK)
+        response = Response(response_serializer.data, status=status.HTTP_200_OK)
+        # Expose which catalog snapshot served the request
+        response[CATALOG_VERSION_HEADER] = str(catalog.version)
+        return response
+
+
+class BatchRecommendMoviesView(generics.GenericAPIView):
+    """
+    API endpoint answering many recommendation queries in one call.
+    Queries are parsed together through SpaCy's nlp.pipe and ranked against one
+    shared catalog snapshot; results are returned in the order of the queries.
+    """
+    serializer_class = BatchRecommendationRequestSerializer
+
+    response_example = {
+        "limit": 10,
+        "results": [
+            {
+                "query": "tom hardy movies",
+                "parsed": {"genres": [], "specific_movies": [], "actors": ["Tom Hardy"], "directors": []},
+                "recommendations": ["Venom", "Mad Max: Fury Road"],
+                "mode": "entities"
+            },
+            {
+                "query": "hello there",
+                "parsed": {"genres": [], "specific_movies": [], "actors": [], "directors": []},
+                "recommendations": [],
+                "detail": NO_ENTITIES_DETAIL
+            }
+        ]
+    }
+
+    @swagger_auto_schema(
+        request_body=BatchRecommendationRequestSerializer,
+        responses={
+            200: openapi.Response(
+                description="Successful Response",
+                schema=BatchRecommendationResponseSerializer,
+                examples={"application/json": response_example}
+            ),
+            400: openapi.Response(description="Bad Request"),
+        },
+        operation_description="Receive several user queries and return movie recommendations for each of them.",
+        operation_summary="Recommend Movies (Batch)"
+    )
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        queries = serializer.validated_data['queries']
+        limit = serializer.validated_data.get('limit', 10)
+        batch_size = serializer.validated_data['batch_size']
+
+        refresh_models()
+
+        # Every query is answered from the same catalog snapshot
+        catalog = get_catalog()
+        parsed_queries = parse_queries(queries, catalog, batch_size=batch_size)
+
+        results = []
+        logged_requests = []
+        for query, parsed in zip(queries, parsed_queries):
+            result = {"query": query, "parsed": parsed, "recommendations": []}
+            if has_entities(parsed):
+                mode, detail = MODE_ENTITIES, NO_RECOMMENDATIONS_DETAIL
+                recommendations = recommend(parsed, catalog, limit)
+            else:
+                # Nothing named, match the query against movie descriptions instead
+                mode, detail = MODE_DESCRIPTION, NO_ENTITIES_DETAIL
+                recommendations = search_descriptions(query, limit)
+            if recommendations:
+                result["recommendations"] = recommendations
+                result["mode"] = mode
+                logged_requests.append(RecommendationRequest(
+                    query=query,
+                    limit=limit,
+                    recommendations=', '.join(recommendations)
+                ))
+            else:
+                result["detail"] = detail
+            results.append(result)
+
+        # Log all answered queries, written in the background
+        get_request_log().log_many(logged_requests)
+
+        response_serializer = BatchRecommendationResponseSerializer({"limit": limit, "results": results})
+        response = Response(response_serializer.data, status=status.HTTP_200_OK)
+        response[CATALOG_VERSION_HEADER] = str(catalog.version)
+        return response
 
 
 class MovieListView(generics.ListAPIView):
@@ -157,3 +269,30 @@ class MovieListView(generics.ListAPIView):
     )
     def get(self, request, *args, **kwargs):
         return super().get(request, *args, **kwargs)
+
+
+class ReadinessView(APIView):
+    """
+    Readiness probe reporting which recommender resources are loaded and how long
+    each took. Returns 503 until everything is loaded so load balancers only route
+    traffic to warm workers. It never triggers loading itself.
+    """
+    authentication_classes = []
+    permission_classes = []
+
+    @swagger_auto_schema(
+        operation_description="Report whether the SpaCy pipeline and model artifacts are loaded.",
+        operation_summary="Recommender Readiness",
+        responses={200: "All resources are loaded.", 503: "Some resources are not loaded yet."}
+    )
+    def get(self, request, *args, **kwargs):
+        ready = registry.is_ready()
+        return Response(
+            {
+                "ready": ready,
+                "resources": registry.status(),
+                "caches": {"queries": query_cache.stats(), "recommendations": recommendation_cache.stats()},
+                "request_log": get_request_log().stats(),
+            },
+            status=status.HTTP_200_OK if ready else status.HTTP_503_SERVICE_UNAVAILABLE
+        )